@@ -0,0 +1 @@
+"""Benchmark harness: mock store portals, synthetic receipts and scenarios (see bench/run.py)."""
@@ -0,0 +1,314 @@
+"""
+Local stand-ins for the Auchan and Carrefour invoice portals.
+
+They reproduce the page flow and the element locators used by
+src/autofill_Auchan.py and src/autofill_Carrefour.py (one page state at a
+time, so locators such as the first ``.btn`` resolve like on the real
+sites), serve a small PDF invoice per barcode, and expose the JSON endpoints
+used by the HTTP fast path.
+
+    python -m bench.portals --port 8765
+    AUCHAN_PORTAL_URL=http://127.0.0.1:8765/auchan/ \\
+    CARREFOUR_PORTAL_URL=http://127.0.0.1:8765/carrefour/ uvicorn src.main:app
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import unquote, urlparse
+
+# Fields the fast path engines (src/fast_path.py) must send
+API_REQUIRED_FIELDS = {
+    "auchan": ["barcode", "siret", "companyName", "companyAddress", "zipCode", "city", "vat", "contactName", "contactEmail"],
+    "carrefour": ["ticketNumber", "companyName", "address", "postalCode", "city", "companyIdentifier", "companyVatNumber"],
+}
+
+_COMMON_JS = """
+const DELAY = __DELAY__;
+const app = document.getElementById("app");
+const data = {};
+function show(html) {
+  app.innerHTML = "";
+  setTimeout(() => { app.innerHTML = html; }, DELAY);
+}
+function value(selector) {
+  const el = document.querySelector(selector);
+  return el ? el.value.trim() : "";
+}
+function requireFields(selectors) {
+  const missing = selectors.filter((s) => !value(s));
+  if (missing.length) {
+    document.getElementById("error").textContent = "Champs manquants: " + missing.join(", ");
+    return false;
+  }
+  selectors.forEach((s) => { data[s] = value(s); });
+  return true;
+}
+document.addEventListener("click", (event) => {
+  const target = event.target.closest("[data-action]");
+  if (!target) return;
+  if (target.tagName === "A") event.preventDefault();
+  actions[target.dataset.action](target);
+});
+document.getElementById("onetrust-accept-btn-handler").addEventListener("click", () => {
+  document.getElementById("cookies").remove();
+});
+"""
+
+_AUCHAN_JS = """
+const actions = {
+  start: () => show('<input id="barcode" placeholder="Code-barres"><button type="button" class="btn" data-action="barcode">Suivant</button>'),
+  barcode: () => requireFields(["#barcode"]) && show('<a href="#" data-action="pro">Un particulier</a> <a href="#" data-action="pro">Un professionnel</a>'),
+  pro: () => show(
+    '<div id="businessValue" data-action="openBusiness">Type d\\'entreprise</div>' +
+    '<ul id="businessList" hidden><li class="business-type" data-businessid="PRIVATE_COMPANY" data-action="pick">Entreprise privée</li></ul>' +
+    '<button type="button" class="btn" data-action="business">Suivant</button>'),
+  openBusiness: () => { document.getElementById("businessList").hidden = false; },
+  pick: (el) => { el.classList.add("selected"); },
+  business: () => show(
+    '<div id="typeId" data-action="openType">Identifiant</div>' +
+    '<ul id="typeList" hidden><li class="identification-type" data-typeid="SIRET" data-action="pick">SIRET</li></ul>' +
+    '<button type="button" class="btn" data-action="type">Suivant</button>'),
+  openType: () => { document.getElementById("typeList").hidden = false; },
+  type: () => show('<input id="siret" placeholder="SIRET"><button type="button" class="btn" data-action="siret">Suivant</button>'),
+  siret: () => requireFields(["#siret"]) && show(
+    ["companyName", "companyAddress", "zipCode", "city", "vat", "contactName", "contactEmail"]
+      .map((id) => '<input id="' + id + '" placeholder="' + id + '">').join("") +
+    '<button type="button" class="btn" data-action="company">Valider</button>'),
+  company: () => requireFields(["#companyName", "#companyAddress", "#zipCode", "#city", "#vat", "#contactName", "#contactEmail"])
+    && show('<p>Récapitulatif</p><button type="submit" data-action="submit">Envoyer</button>'),
+  submit: () => show('<a href="/auchan/invoice/' + encodeURIComponent(data["#barcode"]) + '.pdf">Télécharger</a>'),
+};
+show('<a href="#" data-action="start">Commencer</a>');
+"""
+
+_CARREFOUR_JS = """
+const actions = {
+  start: () => show('<input type="radio" id="particulier" name="customerType"><label for="particulier">Particulier</label>' +
+    '<input type="radio" id="entreprise" name="customerType" data-action="entreprise"><label for="entreprise">Entreprise</label>'),
+  entreprise: () => show('<input name="companyName" placeholder="Raison sociale"><input name="ticketNumber" placeholder="Numéro de ticket">' +
+    '<button type="button" data-action="ticket">Valider</button>'),
+  ticket: () => requireFields(['[name="companyName"]', '[name="ticketNumber"]'])
+    && show('<p>Vos informations</p><button type="button" data-action="confirm">Confirmer mes infos</button>'),
+  confirm: () => show(
+    ["address", "postalCode", "city", "companyIdentifier", "companyVatNumber"]
+      .map((name) => '<input name="' + name + '" placeholder="' + name + '">').join("") +
+    '<button type="button" data-action="download">Télécharger ma facture</button>'),
+  download: () => {
+    if (!requireFields(['[name="address"]', '[name="postalCode"]', '[name="city"]', '[name="companyIdentifier"]', '[name="companyVatNumber"]'])) return;
+    window.location.href = "/carrefour/invoice/" + encodeURIComponent(data['[name="ticketNumber"]']) + ".pdf";
+  },
+};
+show('<button class="c-button"><span class="c-button__loader__container" data-action="start">Demander ma facture</span></button>');
+"""
+
+
+def _page(title: str, script: str, step_delay_ms: int) -> bytes:
+    return f"""<!doctype html>
+<html lang="fr"><head><meta charset="utf-8"><title>{title}</title></head>
+<body>
+<div id="cookies"><button id="onetrust-accept-btn-handler">Tout accepter</button></div>
+<p id="error"></p>
+<div id="app"></div>
+<script>{_COMMON_JS.replace("__DELAY__", str(step_delay_ms))}{script}</script>
+</body></html>""".encode("utf-8")
+
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def invoice_pdf(store: str, barcode: str, issued: Optional[date] = None) -> bytes:
+    """A one-page PDF invoice whose text (store, date, barcode, total) PyPDF2 can extract."""
+    issued = issued or date.today()
+    # Deterministic per barcode, so the same receipt always gives the same invoice
+    total = int(hashlib.sha256(barcode.encode()).hexdigest()[:6], 16) % 20000 / 100 + 1
+    lines = [
+        f"Facture {store.capitalize()}",
+        f"Date: {issued.strftime('%d/%m/%Y')}",
+        f"Code-barres: {barcode}",
+        f"Total TTC: {total:.2f} EUR",
+    ]
+    text = "BT /F1 12 Tf 16 TL 72 776 Td " + " ".join(f"({_pdf_escape(line)}) '" for line in lines) + " ET"
+    stream = text.encode("latin-1")
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 4 0 R >> >> /Contents 5 0 R >>",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+        b"<< /Length " + str(len(stream)).encode() + b" >>\nstream\n" + stream + b"\nendstream",
+    ]
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += b"".join(f"{offset:010d} 00000 n \n".encode() for offset in offsets)
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(out)
+
+
+class MockPortals:
+    """
+    Serves both mock portals from one local HTTP server.
+
+    latency     seconds added to every response (network + server time)
+    step_delay  milliseconds before each page state renders (client-side rendering)
+    fail_rate   share of invoice/API requests answered with a 503
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, *, latency: float = 0.0,
+                 step_delay_ms: int = 50, fail_rate: float = 0.0, seed: Optional[int] = None):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.served: Dict[str, int] = {"auchan": 0, "carrefour": 0}
+        self.failed = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._pages = {
+            "auchan": _page("Auchan - Facture (mock)", _AUCHAN_JS, step_delay_ms),
+            "carrefour": _page("Carrefour - Facture (mock)", _CARREFOUR_JS, step_delay_ms),
+        }
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def portal_url(self, store: str) -> str:
+        return f"{self.base_url}/{store}/"
+
+    def api_url(self, store: str) -> str:
+        return f"{self.base_url}/{store}/api/invoices"
+
+    def env(self) -> Dict[str, str]:
+        """Settings pointing src.config at these portals."""
+        return {
+            "AUCHAN_PORTAL_URL": self.portal_url("auchan"),
+            "CARREFOUR_PORTAL_URL": self.portal_url("carrefour"),
+            "AUCHAN_API_URL": self.api_url("auchan"),
+            "CARREFOUR_API_URL": self.api_url("carrefour"),
+        }
+
+    def _should_fail(self) -> bool:
+        with self._lock:
+            fail = self._random.random() < self.fail_rate
+            if fail:
+                self.failed += 1
+            return fail
+
+    def _handler(self):
+        portals = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args) -> None:
+                pass
+
+            def _send(self, status: int, body: bytes, content_type: str, headers: Optional[Dict[str, str]] = None):
+                if portals.latency:
+                    time.sleep(portals.latency)
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _send_invoice(self, store: str, barcode: str) -> None:
+                with portals._lock:
+                    portals.served[store] += 1
+                self._send(
+                    200,
+                    invoice_pdf(store, barcode),
+                    "application/pdf",
+                    {"Content-Disposition": f'attachment; filename="facture_{store}_{barcode}.pdf"'},
+                )
+
+            def do_GET(self) -> None:
+                parts: List[str] = [unquote(p) for p in urlparse(self.path).path.split("/") if p]
+                if len(parts) == 1 and parts[0] in portals._pages:
+                    return self._send(200, portals._pages[parts[0]], "text/html; charset=utf-8")
+                if len(parts) == 3 and parts[0] in portals._pages and parts[1] == "invoice" and parts[2].endswith(".pdf"):
+                    if portals._should_fail():
+                        return self._send(503, b"Service temporarily unavailable", "text/plain")
+                    return self._send_invoice(parts[0], parts[2][:-4])
+                self._send(404, b"Not found", "text/plain")
+
+            def do_POST(self) -> None:
+                parts = [p for p in urlparse(self.path).path.split("/") if p]
+                if len(parts) != 3 or parts[0] not in API_REQUIRED_FIELDS or parts[1:] != ["api", "invoices"]:
+                    return self._send(404, b"Not found", "text/plain")
+                store = parts[0]
+                try:
+                    payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                except ValueError:
+                    return self._send(400, b'{"error": "invalid JSON"}', "application/json")
+                missing = [f for f in API_REQUIRED_FIELDS[store] if not payload.get(f)]
+                if missing:
+                    return self._send(400, json.dumps({"missing": missing}).encode(), "application/json")
+                if portals._should_fail():
+                    return self._send(503, b'{"error": "busy"}', "application/json")
+
+                if store == "auchan":
+                    # Auchan answers with a link, Carrefour with the PDF itself (both shapes are supported)
+                    body = json.dumps({"downloadUrl": f"/auchan/invoice/{payload['barcode']}.pdf"}).encode()
+                    return self._send(200, body, "application/json")
+                self._send_invoice(store, payload["ticketNumber"])
+
+        return Handler
+
+    def serve_forever(self) -> None:
+        self._server.serve_forever()
+
+    def start(self) -> "MockPortals":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-portals", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "MockPortals":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--step-delay-ms", type=int, default=50)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    portals = MockPortals(args.host, args.port, latency=args.latency, step_delay_ms=args.step_delay_ms,
+                          fail_rate=args.fail_rate)
+    print("Mock portals running, settings:")
+    for name, value in portals.env().items():
+        print(f"  {name}={value}")
+    try:
+        portals.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+Synthetic receipt photos with real barcodes (Interleaved 2 of 5, EAN-13).
+
+Barcodes are encoded from their specifications and drawn with Pillow on a
+receipt-like canvas, then degraded like a phone photo: scale, rotation,
+blur, sensor noise and JPEG compression.
+
+    python -m bench.receipts out_dir --count 20 --symbology I25
+"""
+from __future__ import annotations
+
+import argparse
+import io
+import random
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator, Optional
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+# Interleaved 2 of 5: widths of the 5 elements of each digit (n = narrow, w = wide)
+_ITF_DIGITS = ["nnwwn", "wnnnw", "nwnnw", "wwnnn", "nnwnw", "wnwnn", "nwwnn", "nnnww", "wnnwn", "nwnwn"]
+_ITF_WIDE = 3
+
+# EAN-13 left-hand "L" codes; "R" codes are their complement and "G" codes the reversed "R"
+_EAN_L = ["0001101", "0011001", "0010011", "0111101", "0100011", "0110001", "0101111", "0111011", "0110111", "0001011"]
+_EAN_PARITY = ["LLLLLL", "LLGLGG", "LLGGLG", "LLGGGL", "LGLLGG", "LGGLLG", "LGGGLL", "LGLGLG", "LGLGGL", "LGGLGL"]
+
+QUIET_ZONE = 12  # modules of white space on each side
+
+
+def ean13_check_digit(digits: str) -> str:
+    total = sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(digits[:12]))
+    return str((10 - total % 10) % 10)
+
+
+def ean13_modules(code: str) -> str:
+    """Bar pattern of an EAN-13 ("1" = bar), from 12 or 13 digits (check digit recomputed)."""
+    digits = code[:12] + ean13_check_digit(code)
+    parity = _EAN_PARITY[int(digits[0])]
+    left = ""
+    for kind, d in zip(parity, digits[1:7]):
+        l_code = _EAN_L[int(d)]
+        r_code = "".join("1" if b == "0" else "0" for b in l_code)
+        left += l_code if kind == "L" else r_code[::-1]
+    right = "".join("".join("1" if b == "0" else "0" for b in _EAN_L[int(d)]) for d in digits[7:])
+    return "101" + left + "01010" + right + "101"
+
+
+def itf_modules(code: str) -> str:
+    """Bar pattern of an Interleaved 2 of 5 code (a leading 0 is added to odd-length codes)."""
+    if len(code) % 2:
+        code = "0" + code
+    widths = [1, 1, 1, 1]  # start: bar, space, bar, space
+    for first, second in zip(code[::2], code[1::2]):
+        # The first digit of each pair is drawn with bars, the second with spaces
+        for bar, space in zip(_ITF_DIGITS[int(first)], _ITF_DIGITS[int(second)]):
+            widths += [_ITF_WIDE if bar == "w" else 1, _ITF_WIDE if space == "w" else 1]
+    widths += [_ITF_WIDE, 1, 1]  # stop: wide bar, space, bar
+    return "".join(("1" if i % 2 == 0 else "0") * w for i, w in enumerate(widths))
+
+
+def barcode_modules(code: str, symbology: str) -> str:
+    if symbology == "EAN13":
+        return ean13_modules(code)
+    if symbology == "I25":
+        return itf_modules(code)
+    raise ValueError(f"Unsupported symbology: {symbology}")
+
+
+def random_code(symbology: str, rng: random.Random, length: int = 24) -> str:
+    if symbology == "EAN13":
+        digits = "".join(rng.choice("0123456789") for _ in range(12))
+        return digits + ean13_check_digit(digits)
+    return "".join(rng.choice("0123456789") for _ in range(length + length % 2))
+
+
+@dataclass
+class ReceiptSpec:
+    code: str
+    symbology: str = "I25"
+    module_px: int = 3  # width of the narrowest bar, before scaling
+    scale: float = 1.0  # final resize factor (resolution of the "photo")
+    angle: float = 0.0  # rotation in degrees
+    blur: float = 0.0  # gaussian blur radius
+    noise: float = 0.0  # standard deviation of the sensor noise, in grey levels
+    jpeg_quality: Optional[int] = 85  # None keeps a lossless PNG
+    store: str = "AUCHAN"
+
+
+def render_receipt(spec: ReceiptSpec) -> Image.Image:
+    modules = barcode_modules(spec.code, spec.symbology)
+    bar_width = (len(modules) + 2 * QUIET_ZONE) * spec.module_px
+    width = max(bar_width + 40, 420)
+    bar_height = max(60, spec.module_px * 35)
+    font = ImageFont.load_default()
+
+    lines = [spec.store, "TICKET DE CAISSE", ""]
+    lines += [f"ARTICLE {i + 1:02d}              {((i * 37) % 900) / 100 + 1:6.2f}" for i in range(6)]
+    lines += ["", "TOTAL                    42.00", "MERCI DE VOTRE VISITE"]
+    line_height = 14
+    text_height = line_height * len(lines) + 20
+    height = text_height + bar_height + 50
+
+    receipt = Image.new("L", (width, height), 255)
+    draw = ImageDraw.Draw(receipt)
+    for i, line in enumerate(lines):
+        draw.text((20, 10 + i * line_height), line, fill=0, font=font)
+
+    left = (width - bar_width) // 2 + QUIET_ZONE * spec.module_px
+    top = text_height
+    for i, module in enumerate(modules):
+        if module == "1":
+            x = left + i * spec.module_px
+            draw.rectangle([x, top, x + spec.module_px - 1, top + bar_height], fill=0)
+    draw.text((left, top + bar_height + 8), spec.code, fill=0, font=font)
+
+    image = receipt
+    if spec.angle:
+        image = image.rotate(spec.angle, resample=Image.BICUBIC, expand=True, fillcolor=255)
+    if spec.scale != 1.0:
+        size = (max(1, round(image.width * spec.scale)), max(1, round(image.height * spec.scale)))
+        image = image.resize(size, Image.LANCZOS)
+    if spec.blur:
+        image = image.filter(ImageFilter.GaussianBlur(spec.blur))
+    if spec.noise:
+        pixels = np.asarray(image, dtype=np.float32)
+        rng = np.random.default_rng(int(spec.code[-9:]))
+        pixels = pixels + rng.normal(0, spec.noise, pixels.shape)
+        image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+    return image
+
+
+def encode(image: Image.Image, jpeg_quality: Optional[int]) -> bytes:
+    buffer = io.BytesIO()
+    if jpeg_quality is None:
+        image.save(buffer, "PNG")
+    else:
+        image.save(buffer, "JPEG", quality=jpeg_quality)
+    return buffer.getvalue()
+
+
+# Degradation levels used by the benchmark scenarios
+PRESETS = {
+    "clean": dict(module_px=3, scale=1.0, angle=0.0, blur=0.0, noise=0.0, jpeg_quality=None),
+    "phone": dict(module_px=4, scale=2.5, angle=2.0, blur=0.8, noise=6.0, jpeg_quality=85),
+    "tilted": dict(module_px=3, scale=1.5, angle=12.0, blur=0.5, noise=8.0, jpeg_quality=80),
+    "lowres": dict(module_px=2, scale=0.8, angle=0.0, blur=0.6, noise=10.0, jpeg_quality=70),
+}
+
+
+def generate(count: int, *, symbology: str = "I25", preset: str = "phone", seed: int = 0,
+             store: str = "AUCHAN") -> Iterator[tuple]:
+    """Yields (filename, image bytes, expected code) for `count` receipts."""
+    rng = random.Random(seed)
+    params = PRESETS[preset]
+    for i in range(count):
+        code = random_code(symbology, rng)
+        # Small per-receipt variation around the preset
+        spec = ReceiptSpec(
+            code=code,
+            symbology=symbology,
+            store=store,
+            **dict(params, angle=params["angle"] * rng.uniform(-1, 1), scale=params["scale"] * rng.uniform(0.9, 1.1)),
+        )
+        suffix = "png" if spec.jpeg_quality is None else "jpg"
+        yield f"receipt_{i:04d}_{preset}.{suffix}", encode(render_receipt(spec), spec.jpeg_quality), code
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("out_dir", type=Path)
+    parser.add_argument("--count", type=int, default=20)
+    parser.add_argument("--symbology", choices=["I25", "EAN13"], default="I25")
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="phone")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    args.out_dir.mkdir(parents=True, exist_ok=True)
+    with (args.out_dir / "expected.csv").open("w", encoding="utf-8") as index:
+        for name, data, code in generate(args.count, symbology=args.symbology, preset=args.preset, seed=args.seed):
+            (args.out_dir / name).write_bytes(data)
+            index.write(f"{name},{code}\n")
+    print(f"{args.count} receipts written to {args.out_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,351 @@
+"""
+Offline benchmark scenarios.
+
+    python -m bench.run decode   --count 40 --workers 4
+    python -m bench.run pipeline --mode fast_path --receipts 20 --jobs 3
+    python -m bench.run pipeline --mode browser --store carrefour --receipts 5 --browser-mode lean
+    python -m bench.run pipeline --store mixed --receipts 20
+    python -m bench.run all --json bench_output.json
+
+decode    decodes synthetic receipts (every degradation preset) on the decode
+          process pool: images/s, accuracy, per-image p50/p95, peak RSS.
+pipeline  runs the full POST /upload -> job -> merged PDF path against the
+          mock portals (bench/portals.py): decode throughput, invoices per
+          minute, p50/p95 time from upload to each invoice, peak RSS of the
+          server process tree (decode workers and Chrome included).
+          --mode browser drives Chrome through the portal pages,
+          --mode fast_path uses the HTTP engines only. --store mixed
+          alternates Auchan and Carrefour receipts in every upload, sent
+          with store=auto so each barcode is routed by its format.
+
+Settings are passed through the same environment variables as the app, set
+before src is imported; everything is written to a temporary directory.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List
+
+from loguru import logger
+
+from .portals import MockPortals
+from .receipts import PRESETS, generate
+
+ROOT = Path(__file__).resolve().parent.parent
+PROFILE = "DemoCompany1"
+STORE_SYMBOLOGY = {"auchan": "I25", "carrefour": "EAN13"}
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Linear-interpolated percentile (q in 0..100); 0 for an empty list."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+class PeakRss:
+    """Samples the resident memory of this process and all its descendants, keeping the peak (Linux /proc)."""
+
+    def __init__(self, interval: float = 0.2):
+        self.interval = interval
+        self.peak_bytes = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+
+    @staticmethod
+    def _rss(pid: int) -> int:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return 0
+
+    @staticmethod
+    def _children() -> Dict[int, List[int]]:
+        tree: Dict[int, List[int]] = {}
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    # "pid (comm) state ppid ...": comm may contain spaces
+                    ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            tree.setdefault(ppid, []).append(int(entry))
+        return tree
+
+    def sample(self) -> int:
+        if not os.path.isdir("/proc"):
+            import resource
+
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        tree = self._children()
+        pids, total = [os.getpid()], 0
+        while pids:
+            pid = pids.pop()
+            total += self._rss(pid)
+            pids.extend(tree.get(pid, []))
+        return total
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.peak_bytes = max(self.peak_bytes, self.sample())
+            self._stop.wait(self.interval)
+
+    def __enter__(self) -> "PeakRss":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.peak_bytes = max(self.peak_bytes, self.sample())
+
+    @property
+    def peak_mb(self) -> float:
+        return round(self.peak_bytes / 1024 ** 2, 1)
+
+
+def scenario_decode(args) -> Dict[str, object]:
+    from src.decoding import DecodeStage
+
+    work = Path(tempfile.mkdtemp(prefix="bench_decode_"))
+    expected: Dict[str, str] = {}
+    images = []
+    per_preset = max(1, args.count // len(PRESETS))
+    for preset in sorted(PRESETS):
+        for name, data, code in generate(per_preset, symbology=args.symbology, preset=preset, seed=args.seed):
+            path = work / name
+            path.write_bytes(data)
+            expected[name] = code
+            images.append((name, path))
+
+    stage = DecodeStage(workers=args.workers)
+    try:
+        # Warm-up: process pool start is reported by the pipeline scenario, not here
+        asyncio.run(stage.decode_stream(iter(images[:1])))
+        with PeakRss() as rss:
+            start = time.perf_counter()
+            results = asyncio.run(stage.decode_stream(iter(images)))
+            wall = time.perf_counter() - start
+    finally:
+        stage.shutdown()
+        shutil.rmtree(work, ignore_errors=True)
+
+    by_preset: Dict[str, Dict[str, int]] = {}
+    for result in results:
+        preset = result.filename.rsplit("_", 1)[1].split(".")[0]
+        counts = by_preset.setdefault(preset, {"images": 0, "decoded": 0})
+        counts["images"] += 1
+        # zbar reports EAN-13 codes starting with 0 in full, other readers as UPC-A: compare both
+        counts["decoded"] += bool(result.barcode) and result.barcode.lstrip("0") == expected[result.filename].lstrip("0")
+
+    seconds = [r.seconds for r in results]
+    return {
+        "scenario": "decode",
+        "images": len(results),
+        "workers": args.workers or os.cpu_count(),
+        "images_per_second": round(len(results) / wall, 2),
+        "accuracy": round(sum(c["decoded"] for c in by_preset.values()) / len(results), 3),
+        "accuracy_by_preset": {p: round(c["decoded"] / c["images"], 3) for p, c in sorted(by_preset.items())},
+        "decode_p50_ms": round(percentile(seconds, 50) * 1000, 1),
+        "decode_p95_ms": round(percentile(seconds, 95) * 1000, 1),
+        "peak_rss_mb": rss.peak_mb,
+    }
+
+
+def _configure_app_env(work: Path, portals: MockPortals, args) -> None:
+    os.environ.update(portals.env())
+    os.environ.update({
+        "DOWNLOAD_DIR": str(work / "invoices"),
+        "RETRY_QUEUE_DB": str(work / "retry_queue.sqlite3"),
+        "RETRY_QUEUE_ENABLED": "0",
+        "JOBS_DIR": str(work / "jobs"),
+        "SPOOL_DIR": str(work / "spool"),
+        "CACHE_DIR": str(work / "cache"),
+        "SLOW_JOBS_DIR": str(work / "slow_jobs"),
+        "SHARED_DIR": str(work / "shared"),
+        "CHROMEDRIVER_DIR": str(work / "chromedriver"),
+        "TASK_QUEUE_DB": str(work / "shared" / "tasks.sqlite3"),
+        "PROFILES_FILE": str(work / "profiles.json"),
+        "PROFILES_DB": "",
+        "CACHE_ENABLED": "1" if args.cache else "0",
+        "FAST_PATH_STORES": "auchan,carrefour" if args.mode == "fast_path" else "",
+        "AUTOFILL_WORKERS": str(args.workers),
+        "BROWSER_MODE": args.browser_mode,
+        "JOB_WORKERS": str(args.job_workers),
+        "DECODE_WORKERS": str(args.decode_workers),
+        "LOG_LEVEL": "WARNING",
+    })
+    shutil.copyfile(ROOT / "profiles.example.json", work / "profiles.json")
+
+
+def _job_receipts(args, job_index: int) -> List[tuple]:
+    seed = args.seed + job_index
+    if args.store != "mixed":
+        return list(generate(args.receipts, symbology=STORE_SYMBOLOGY[args.store], preset=args.preset,
+                             seed=seed, store=args.store.upper()))
+    # Interleave the stores so routing has to split every upload
+    per_store = [
+        list(generate(args.receipts, symbology=symbology, preset=args.preset, seed=seed, store=store.upper()))
+        for store, symbology in STORE_SYMBOLOGY.items()
+    ]
+    receipts = [per_store[i % len(per_store)][i // len(per_store)] for i in range(args.receipts)]
+    return [(f"{i:04d}_{name}", data, code) for i, (name, data, code) in enumerate(receipts)]
+
+
+def scenario_pipeline(args) -> Dict[str, object]:
+    work = Path(tempfile.mkdtemp(prefix="bench_pipeline_"))
+    portals = MockPortals(latency=args.latency, step_delay_ms=args.step_delay_ms, fail_rate=args.fail_rate,
+                          seed=args.seed).start()
+    try:
+        _configure_app_env(work, portals, args)
+        from fastapi.testclient import TestClient
+
+        from src.main import app
+
+        batches = []
+        for job_index in range(args.jobs):
+            batches.append([
+                ("files", (name, data, "image/png" if name.endswith(".png") else "image/jpeg"))
+                for name, data, _ in _job_receipts(args, job_index)
+            ])
+
+        upload_seconds: List[float] = []
+        invoice_latencies: List[float] = []
+        job_latencies: List[float] = []
+        downloaded = failed = decoded = unrouted = 0
+
+        with PeakRss() as rss, TestClient(app) as client:
+            start = time.perf_counter()
+            jobs = {}
+            for files in batches:
+                submitted = time.perf_counter()
+                store = "auto" if args.store == "mixed" else args.store
+                response = client.post("/upload", data={"store": store, "profile": PROFILE}, files=files)
+                upload_seconds.append(time.perf_counter() - submitted)
+                if response.status_code != 202:
+                    raise RuntimeError(f"/upload answered {response.status_code}: {response.text}")
+                body = response.json()
+                decoded += len(body["barcodes_found"]) + len(body["unrouted_barcodes"])
+                unrouted += len(body["unrouted_barcodes"])
+                jobs[body["job_id"]] = {"submitted": submitted, "processed": 0, "url": body["status_url"]}
+
+            # Poll like a client would; each new processed barcode is one invoice latency sample
+            while jobs:
+                time.sleep(args.poll_interval)
+                for job_id, state in list(jobs.items()):
+                    status = client.get(state["url"]).json()
+                    now = time.perf_counter()
+                    processed = status["progress"]["processed"]
+                    invoice_latencies += [now - state["submitted"]] * (processed - state["processed"])
+                    state["processed"] = processed
+                    if status["state"] in ("done", "failed"):
+                        job_latencies.append(now - state["submitted"])
+                        downloaded += status["downloaded"]
+                        failed += len(status["failed_barcodes"])
+                        del jobs[job_id]
+            wall = time.perf_counter() - start
+            metrics_text = client.get("/metrics").text
+    finally:
+        portals.stop()
+        shutil.rmtree(work, ignore_errors=True)
+
+    images = args.jobs * args.receipts
+    return {
+        "scenario": "pipeline",
+        "mode": args.mode,
+        "browser_mode": args.browser_mode,
+        "store": args.store,
+        "jobs": args.jobs,
+        "receipts_per_job": args.receipts,
+        "autofill_workers": args.workers,
+        "decoded": decoded,
+        "unrouted": unrouted,
+        "decode_images_per_second": round(images / sum(upload_seconds), 2) if upload_seconds else 0,
+        "downloaded": downloaded,
+        "failed": failed,
+        "invoices_per_minute": round(downloaded / wall * 60, 1),
+        "invoice_latency_p50_s": round(percentile(invoice_latencies, 50), 3),
+        "invoice_latency_p95_s": round(percentile(invoice_latencies, 95), 3),
+        "job_latency_p50_s": round(percentile(job_latencies, 50), 3),
+        "job_latency_p95_s": round(percentile(job_latencies, 95), 3),
+        "portal_invoices_served": dict(portals.served),
+        "portal_injected_failures": portals.failed,
+        "peak_rss_mb": rss.peak_mb,
+        "metrics_lines": len(metrics_text.splitlines()),
+    }
+
+
+def _print_report(result: Dict[str, object]) -> None:
+    print(f"== {result['scenario']} ==")
+    width = max(len(k) for k in result)
+    for key, value in result.items():
+        if key != "scenario":
+            print(f"  {key.ljust(width)}  {value}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("scenario", choices=["decode", "pipeline", "all"])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", type=Path, help="also write the results to this file")
+
+    decode = parser.add_argument_group("decode")
+    decode.add_argument("--count", type=int, default=40, help="receipts, spread over the degradation presets")
+    decode.add_argument("--symbology", choices=["I25", "EAN13"], default="I25")
+    decode.add_argument("--workers", type=int, default=0, help="decode processes (0 = one per core)")
+
+    pipeline = parser.add_argument_group("pipeline")
+    pipeline.add_argument("--mode", choices=["fast_path", "browser"], default="fast_path")
+    pipeline.add_argument("--browser-mode", choices=["standard", "lean"], default="lean")
+    pipeline.add_argument("--store", choices=[*sorted(STORE_SYMBOLOGY), "mixed"], default="auchan")
+    pipeline.add_argument("--receipts", type=int, default=10, help="receipts per job")
+    pipeline.add_argument("--jobs", type=int, default=3)
+    pipeline.add_argument("--preset", choices=sorted(PRESETS), default="phone")
+    pipeline.add_argument("--autofill-workers", dest="autofill_workers", type=int, default=1)
+    pipeline.add_argument("--job-workers", type=int, default=2)
+    pipeline.add_argument("--decode-workers", type=int, default=0)
+    pipeline.add_argument("--cache", action="store_true", help="keep the invoice cache enabled")
+    pipeline.add_argument("--latency", type=float, default=0.02, help="portal response time (s)")
+    pipeline.add_argument("--step-delay-ms", type=int, default=50, help="portal page render time")
+    pipeline.add_argument("--fail-rate", type=float, default=0.0, help="share of portal requests failing with 503")
+    pipeline.add_argument("--poll-interval", type=float, default=0.05)
+    args = parser.parse_args()
+
+    # Keep the report readable (the app configures its own logging in the pipeline scenario)
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    results = []
+    if args.scenario in ("decode", "all"):
+        results.append(scenario_decode(args))
+    if args.scenario in ("pipeline", "all"):
+        # --workers belongs to the decode scenario; the pipeline takes --autofill-workers
+        results.append(scenario_pipeline(argparse.Namespace(**dict(vars(args), workers=args.autofill_workers))))
+
+    for result in results:
+        _print_report(result)
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+from __future__ import annotations
+
+import re
+import time
+from dataclasses import asdict, dataclass
+from datetime import date
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from loguru import logger
+
+from .invoice_cache import InvoiceCache, read_blob, sha256_file
+from .metrics import span
+
+_COLUMNS = "id, store, barcode, profile, sha256, size, issued_on, total, currency, job_id, archived_at"
+
+# "Date: 14/03/2025", "Date de facture : 14-03-2025"
+_DATE_RE = re.compile(r"date[^\d\n]{0,30}(\d{1,2})[/.-](\d{1,2})[/.-](\d{4})", re.IGNORECASE)
+# "Total TTC: 12.34 EUR", "Montant total TTC : 1 234,56 €"
+_TOTAL_RE = re.compile(r"total(?:\s+TTC)?\s*:?\s*(\d[\d\s]*[.,]\d{2})\s*(EUR|€)?", re.IGNORECASE)
+
+
+@dataclass
+class ArchivedInvoice:
+    id: int
+    store: str
+    barcode: str
+    profile: str
+    sha256: str
+    size: int
+    issued_on: Optional[str]  # ISO date read from the invoice, None if not found
+    total: Optional[float]
+    currency: Optional[str]
+    job_id: Optional[str]
+    archived_at: float
+
+    def to_dict(self) -> Dict[str, object]:
+        return asdict(self)
+
+
+def extract_metadata(pdf_path: Path) -> Dict[str, object]:
+    """Issue date and total read from the invoice text. Missing fields are None."""
+    import PyPDF2
+
+    metadata: Dict[str, object] = {"issued_on": None, "total": None, "currency": None}
+    try:
+        reader = PyPDF2.PdfReader(str(pdf_path))
+        text = "\n".join(page.extract_text() or "" for page in reader.pages[:2])
+    except Exception as e:
+        logger.debug(f"Could not read text from {pdf_path.name}: {e}")
+        return metadata
+
+    match = _DATE_RE.search(text)
+    if match:
+        day, month, year = (int(part) for part in match.groups())
+        try:
+            metadata["issued_on"] = date(year, month, day).isoformat()
+        except ValueError:
+            pass
+    match = _TOTAL_RE.search(text)
+    if match:
+        metadata["total"] = float(re.sub(r"\s", "", match.group(1)).replace(",", "."))
+        metadata["currency"] = "EUR" if match.group(2) else None
+    return metadata
+
+
+class InvoiceArchive:
+    """
+    Every invoice ever retrieved, searchable by store, profile, barcode, date and total.
+
+    Built on the invoice cache: PDFs are its content-addressed blobs
+    (gzip-compressed), and the index is its ``archive`` table, one row per
+    (store, barcode, profile) with the metadata read from the invoice. Fetching an invoice again
+    updates its row instead of adding one, and an invoice that is also
+    cached shares its blob, so duplicates take no extra space. Unlike cache
+    entries, archived invoices never expire.
+    """
+
+    def __init__(self, cache: InvoiceCache):
+        self.cache = cache
+
+    def add(
+        self, pdf_path: Path, *, store: str, barcode: str, profile: str, job_id: Optional[str] = None
+    ) -> ArchivedInvoice:
+        """Archives a downloaded invoice (the file is copied, not moved) and returns its entry."""
+        with span("archive", store=store):
+            # Hashing and text extraction run before taking the cache lock, which other jobs wait on
+            pdf_path = Path(pdf_path)
+            sha256 = sha256_file(pdf_path)
+            metadata = extract_metadata(pdf_path)
+            key = (store, barcode, profile)
+
+            with self.cache.storing(pdf_path, sha256) as conn:
+                previous = conn.execute(
+                    "SELECT sha256 FROM archive WHERE store = ? AND barcode = ? AND profile = ?", key
+                ).fetchone()
+                conn.execute(
+                    "INSERT INTO archive (store, barcode, profile, sha256, size, issued_on, total, currency, job_id, "
+                    "archived_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (store, barcode, profile) DO UPDATE SET sha256 = excluded.sha256, "
+                    "size = excluded.size, issued_on = excluded.issued_on, total = excluded.total, "
+                    "currency = excluded.currency, job_id = excluded.job_id, archived_at = excluded.archived_at",
+                    key + (sha256, pdf_path.stat().st_size, metadata["issued_on"], metadata["total"],
+                           metadata["currency"], job_id, time.time()),
+                )
+                if previous is not None and previous[0] != sha256:
+                    self.cache.drop_unreferenced(conn, [previous[0]])
+                entry = conn.execute(
+                    f"SELECT {_COLUMNS} FROM archive WHERE store = ? AND barcode = ? AND profile = ?", key
+                ).fetchone()
+        return ArchivedInvoice(*entry)
+
+    def _where(
+        self,
+        ids: Optional[Sequence[int]],
+        store: Optional[str],
+        profile: Optional[str],
+        barcode: Optional[str],
+        date_from: Optional[date],
+        date_to: Optional[date],
+        min_total: Optional[float],
+        max_total: Optional[float],
+    ) -> Tuple[str, List[object]]:
+        clauses: List[str] = []
+        params: List[object] = []
+        if ids is not None:
+            clauses.append(f"id IN ({','.join('?' * len(ids))})" if ids else "0")
+            params += list(ids)
+        for clause, value in (
+            ("store = ?", store),
+            ("profile = ?", profile),
+            ("barcode = ?", barcode),
+            ("issued_on >= ?", date_from.isoformat() if date_from else None),
+            ("issued_on <= ?", date_to.isoformat() if date_to else None),
+            ("total >= ?", min_total),
+            ("total <= ?", max_total),
+        ):
+            if value is not None:
+                clauses.append(clause)
+                params.append(value)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def query(
+        self,
+        *,
+        ids: Optional[Sequence[int]] = None,
+        store: Optional[str] = None,
+        profile: Optional[str] = None,
+        barcode: Optional[str] = None,
+        date_from: Optional[date] = None,
+        date_to: Optional[date] = None,
+        min_total: Optional[float] = None,
+        max_total: Optional[float] = None,
+        limit: int = 100,
+        offset: int = 0,
+    ) -> Tuple[int, List[ArchivedInvoice]]:
+        """Matching invoices, most recent issue date first. Returns (number of matches, one page of them)."""
+        where, params = self._where(ids, store, profile, barcode, date_from, date_to, min_total, max_total)
+        with self.cache.connect() as conn:
+            (count,) = conn.execute(f"SELECT COUNT(*) FROM archive{where}", params).fetchone()
+            rows = conn.execute(
+                f"SELECT {_COLUMNS} FROM archive{where} ORDER BY issued_on DESC, id DESC LIMIT ? OFFSET ?",
+                params + [limit, offset],
+            ).fetchall()
+        return count, [ArchivedInvoice(*row) for row in rows]
+
+    def get(self, invoice_id: int) -> Optional[ArchivedInvoice]:
+        with self.cache.connect() as conn:
+            row = conn.execute(f"SELECT {_COLUMNS} FROM archive WHERE id = ?", (invoice_id,)).fetchone()
+        return ArchivedInvoice(*row) if row else None
+
+    def read(self, entry: ArchivedInvoice) -> bytes:
+        """The original PDF bytes of an entry."""
+        return read_blob(self.cache.blob_path(entry.sha256))
+
+    def stats(self) -> Dict[str, int]:
+        """Invoice count, and the distinct files they share with their size (uncompressed)."""
+        with self.cache.connect() as conn:
+            invoices, files, size = conn.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT sha256), "
+                "COALESCE((SELECT SUM(size) FROM (SELECT MAX(size) AS size FROM archive GROUP BY sha256)), 0) "
+                "FROM archive"
+            ).fetchone()
+        return {"invoices": invoices, "files": files, "bytes": size}
@@ -1,49 +1,51 @@
 from __future__ import annotations
 
-import time
-import glob
-import shutil
+import threading
 from pathlib import Path
 from typing import Dict, List, Optional
 
-from .config import FAILED_BARCODES_FILE, INVOICES_DIR
-import undetected_chromedriver as uc
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import NoSuchElementException
-
-
-def _wait_click(driver, by, value, timeout: int = 15):
-    el = WebDriverWait(driver, timeout).until(EC.element_to_be_clickable((by, value)))
-    el.click()
-    return el
-
-
-def _wait_send_keys(driver, by, value, text: str, timeout: int = 15, clear: bool = True):
-    el = WebDriverWait(driver, timeout).until(EC.presence_of_element_located((by, value)))
-    if clear:
-        try:
-            el.clear()
-        except Exception:
-            pass
-    el.send_keys(text)
-    return el
-
-
-def _find_latest_new_pdf(download_dir: Path, before: set[Path], timeout: int = 30) -> Path:
-    """
-    Wait until a new PDF appears in download_dir compared to 'before'.
-    Returns the newest downloaded file.
-    """
-    start = time.time()
-    while time.time() - start < timeout:
-        current = {Path(p) for p in glob.glob(str(download_dir / "*.pdf"))}
-        new_files = current - before
-        if new_files:
-            return max(new_files, key=lambda p: p.stat().st_ctime)
-        time.sleep(0.5)
-    raise RuntimeError("No new PDF file detected (download may have failed).")
+from .config import CARREFOUR_PORTAL_URL, INVOICES_DIR
+from .driver_pool import STANDARD, DriverPool
+from .fast_path import PortalHttpEngine
+from .invoice_cache import InvoiceCache
+from .runner import AttemptCallback, FailureCallback, ProgressCallback, run_barcodes
+from .flows import By, Click, ClickFirst, Fill, Flow
+
+CARREFOUR_START_URL = CARREFOUR_PORTAL_URL
+
+CARREFOUR_FLOW = Flow(
+    name="Carrefour",
+    start_url=CARREFOUR_START_URL,
+    required_keys=["address", "zipCode", "city", "siret", "vat"],
+    steps=[
+        # Cookies accept (sometimes not present)
+        Click(By.ID, "onetrust-accept-btn-handler", timeout=5, optional=True),
+        # Start button
+        Click(By.CLASS_NAME, "c-button__loader__container"),
+        # Select "entreprise"
+        Click(By.ID, "entreprise"),
+        # NOTE: the portal expects the siret in companyName
+        Fill(By.NAME, "companyName", "siret"),
+        Fill(By.NAME, "ticketNumber", "barcode"),
+        Click(By.XPATH, "//button[contains(., 'Valider')]", timeout=20),
+        Click(By.XPATH, "//button[contains(., 'Confirmer mes infos')]", timeout=20),
+        # Company details (filled in one go)
+        Fill(By.NAME, "address", "address"),
+        Fill(By.NAME, "postalCode", "zipCode"),
+        Fill(By.NAME, "city", "city"),
+        Fill(By.NAME, "companyIdentifier", "siret"),
+        Fill(By.NAME, "companyVatNumber", "vat"),
+        # Download (button or link depending on UI)
+        ClickFirst(
+            (
+                (By.XPATH, "//button[contains(., 'Télécharger ma facture')]"),
+                (By.LINK_TEXT, "Télécharger ma facture"),
+            ),
+            timeout=20,
+            error="Could not find download button/link",
+        ),
+    ],
+)
 
 
 def autofill_carrefour(
@@ -53,122 +55,64 @@ def autofill_carrefour(
     max_attempts: int = 3,
     chrome_version_main: Optional[int] = None,
     headless: bool = False,
+    mode: str = STANDARD,
+    pool: Optional[DriverPool] = None,
+    workers: int = 1,
+    download_dir: Optional[Path] = None,
+    on_progress: Optional[ProgressCallback] = None,
+    on_failure: Optional[FailureCallback] = None,
+    on_attempt: Optional[AttemptCallback] = None,
+    cache: Optional[InvoiceCache] = None,
+    refresh: bool = False,
+    fast_path: Optional[PortalHttpEngine] = None,
+    cancel: Optional[threading.Event] = None,
 ) -> Dict[str, object]:
     """
     Automates Carrefour invoice retrieval from barcodes.
 
     Required status keys:
       address, zipCode, city, siret, vat
-    """
-    download_dir = INVOICES_DIR
-    failed_barcodes_file = FAILED_BARCODES_FILE
-    download_dir.mkdir(parents=True, exist_ok=True)
-    failed_barcodes_file.parent.mkdir(parents=True, exist_ok=True)
-
-    required_keys = ["address", "zipCode", "city", "siret", "vat"]
-    missing = [k for k in required_keys if k not in status or not status[k]]
-    if missing:
-        raise ValueError(f"Missing required status fields: {missing}")
-
-    downloaded_files: List[str] = []
-    failed: List[str] = []
-
-    facture_count = 1
-
-    for barcode in barcodes:
-        success = False
-
-        for attempt in range(1, max_attempts + 1):
-            driver = None
-            try:
-                print(f"[Carrefour] Attempt {attempt}/{max_attempts} for barcode: {barcode}")
-
-                options = uc.ChromeOptions()
-
-                # Make downloads go to our folder
-                prefs = {
-                    "download.default_directory": str(download_dir.resolve()),
-                    "plugins.always_open_pdf_externally": True,
-                }
-                options.add_experimental_option("prefs", prefs)
-
-                if headless:
-                    options.add_argument("--headless=new")
-
-                before_pdfs = {Path(p) for p in glob.glob(str(download_dir / "*.pdf"))}
 
-                if chrome_version_main is None:
-                    driver = uc.Chrome(options=options)
-                else:
-                    driver = uc.Chrome(options=options, version_main=chrome_version_main)
-
-                driver.get("https://www.carrefour.fr/services/facture")
-
-                # Cookies accept (sometimes not present)
-                try:
-                    _wait_click(driver, By.ID, "onetrust-accept-btn-handler", timeout=5)
-                except Exception:
-                    pass
-
-                # Start button (your original used class 'c-button__loader__container')
-                # We keep it but wait properly:
-                _wait_click(driver, By.CLASS_NAME, "c-button__loader__container", timeout=15)
-
-                # Select "entreprise"
-                _wait_click(driver, By.ID, "entreprise", timeout=15)
-
-                # NOTE: Your code sends siret into companyName (we keep your behavior)
-                _wait_send_keys(driver, By.NAME, "companyName", status["siret"], timeout=15)
-
-                _wait_send_keys(driver, By.NAME, "ticketNumber", barcode, timeout=15)
-
-                _wait_click(driver, By.XPATH, "//button[contains(., 'Valider')]", timeout=20)
-
-                _wait_click(driver, By.XPATH, "//button[contains(., 'Confirmer mes infos')]", timeout=20)
-
-                # Fill company details
-                _wait_send_keys(driver, By.NAME, "address", status["address"], timeout=15)
-                _wait_send_keys(driver, By.NAME, "postalCode", status["zipCode"], timeout=15)
-                _wait_send_keys(driver, By.NAME, "city", status["city"], timeout=15)
-                _wait_send_keys(driver, By.NAME, "companyIdentifier", status["siret"], timeout=15)
-                _wait_send_keys(driver, By.NAME, "companyVatNumber", status["vat"], timeout=15)
-
-                # Download (button or link depending on UI)
-                try:
-                    _wait_click(driver, By.XPATH, "//button[contains(., 'Télécharger ma facture')]", timeout=20)
-                except Exception:
-                    try:
-                        _wait_click(driver, By.LINK_TEXT, "Télécharger ma facture", timeout=20)
-                    except Exception as e:
-                        raise RuntimeError("Could not find download button/link") from e
-
-                latest_file = _find_latest_new_pdf(download_dir, before_pdfs, timeout=40)
-
-                new_name = download_dir / f"facture_{facture_count}.pdf"
-                shutil.move(str(latest_file), str(new_name))
-
-                print(f"[Carrefour] Saved invoice: {new_name.name}")
-                downloaded_files.append(str(new_name))
-                facture_count += 1
-                success = True
-                break
-
-            except Exception as e:
-                print(f"[Carrefour] Error attempt {attempt} for {barcode}: {e}")
-
-            finally:
-                if driver is not None:
-                    try:
-                        driver.quit()
-                    except Exception:
-                        pass
-
-        if not success:
-            failed.append(barcode)
-            try:
-                with failed_barcodes_file.open("a", encoding="utf-8") as f:
-                    f.write(barcode + "\n")
-            except Exception:
-                pass
-
-    return {"downloaded": downloaded_files, "failed": failed}
\ No newline at end of file
+    Browser sessions are leased from `pool` (downloads go to its directory).
+    Without a pool, one warm session per worker is reused for the whole batch,
+    started in `mode` ("standard", or "lean": headless, images/fonts/media/
+    trackers blocked, memory-saving flags).
+    With workers > 1, barcodes are processed by that many browsers in parallel;
+    invoices are still numbered in barcode order.
+
+    Invoices are saved to `download_dir` (defaults to INVOICES_DIR) and
+    `on_progress(index, barcode, pdf)` is called each time a barcode is finished
+    (pdf is the invoice file, valid during the call, or None);
+    `on_failure(store, barcode, error_class, error)` for each barcode whose
+    attempts all failed, and `on_attempt(store, barcode, attempt, via)` as
+    each fast path request or browser attempt starts.
+
+    With a `cache`, invoices already fetched for this barcode and profile are
+    reused without launching a browser (`refresh=True` fetches them again).
+    A `fast_path` engine (CarrefourHttpEngine) is tried first for each barcode;
+    the browser flow is only used when it fails. Once `cancel` is set, the
+    barcodes not started yet fail as "Cancelled".
+    """
+    CARREFOUR_FLOW.check_status(status)
+
+    return run_barcodes(
+        "Carrefour",
+        barcodes,
+        status,
+        CARREFOUR_FLOW.run,
+        CARREFOUR_FLOW.start_url,
+        download_dir=download_dir or (pool.download_dir if pool is not None else INVOICES_DIR),
+        max_attempts=max_attempts,
+        workers=workers,
+        chrome_version_main=chrome_version_main,
+        headless=headless,
+        mode=mode,
+        pool=pool,
+        on_progress=on_progress,
+        on_failure=on_failure,
+        on_attempt=on_attempt,
+        cache=cache,
+        refresh=refresh,
+        fast_path=fast_path,
+        cancel=cancel,
+    )
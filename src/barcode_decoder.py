@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image, ImageOps
+from pyzbar.pyzbar import ZBarSymbol, decode
+
+# Symbologies printed on Auchan / Carrefour receipts. Restricting zbar to them
+# avoids running every decoder (QR, PDF417, ...) over each image.
+STORE_SYMBOLS: List[ZBarSymbol] = [ZBarSymbol.CODE128, ZBarSymbol.EAN13, ZBarSymbol.I25, ZBarSymbol.CODE39]
+
+# Longest side used by the cheap first pass; phone photos are ~4000px wide.
+FAST_MAX_SIDE = 1600
+# Extra scales / rotations tried once the cheap paths failed.
+FALLBACK_SCALES: Tuple[float, ...] = (0.5, 0.75, 1.5)
+FALLBACK_ANGLES: Tuple[int, ...] = (-10, 10, -20, 20, -30, 30, 45, -45)
+# Number of candidate regions examined by the ROI search.
+MAX_REGIONS = 4
+
+
+@dataclass
+class DecodeOutcome:
+    data: Optional[str]
+    symbology: Optional[str] = None
+    # Name of the pass that found the code ("fast", "full", "roi", "rotate", "multiscale", "any_symbol")
+    strategy: Optional[str] = None
+
+
+def _zbar(image: Image.Image, symbols: Optional[Sequence[ZBarSymbol]] = STORE_SYMBOLS):
+    codes = decode(image, symbols=symbols) if symbols else decode(image)
+    return codes[0] if codes else None
+
+
+def _downscale(image: Image.Image, max_side: int) -> Tuple[Image.Image, float]:
+    """Returns the image fitted in max_side and the applied scale factor."""
+    scale = min(1.0, max_side / max(image.size))
+    if scale >= 1.0:
+        return image, 1.0
+    size = (max(1, int(image.width * scale)), max(1, int(image.height * scale)))
+    return image.resize(size, Image.BILINEAR), scale
+
+
+def _binarize(gray: Image.Image) -> Image.Image:
+    """Contrast stretch + Otsu threshold, for faded or low-contrast thermal prints."""
+    arr = np.asarray(ImageOps.autocontrast(gray, cutoff=1))
+    _, th = cv2.threshold(arr, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return Image.fromarray(th)
+
+
+def _candidate_regions(gray: Image.Image) -> List[Tuple[Tuple[int, int, int, int], float]]:
+    """
+    Finds barcode-like regions: areas with strong gradient in one direction
+    only (parallel bars). Returns (box, angle) pairs, largest region first.
+    """
+    arr = np.asarray(gray)
+    grad_x = cv2.Sobel(arr, cv2.CV_32F, 1, 0, ksize=-1)
+    grad_y = cv2.Sobel(arr, cv2.CV_32F, 0, 1, ksize=-1)
+    gradient = cv2.convertScaleAbs(cv2.absdiff(cv2.convertScaleAbs(grad_x), cv2.convertScaleAbs(grad_y)))
+
+    blurred = cv2.blur(gradient, (9, 9))
+    _, th = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (21, 21))
+    closed = cv2.morphologyEx(th, cv2.MORPH_CLOSE, kernel)
+    closed = cv2.erode(closed, None, iterations=4)
+    closed = cv2.dilate(closed, None, iterations=4)
+
+    contours = cv2.findContours(closed, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
+    contours = sorted(contours, key=cv2.contourArea, reverse=True)[:MAX_REGIONS]
+
+    min_area = 0.002 * arr.shape[0] * arr.shape[1]
+    regions = []
+    for contour in contours:
+        if cv2.contourArea(contour) < min_area:
+            continue
+        (_, _, angle) = cv2.minAreaRect(contour)
+        x, y, w, h = cv2.boundingRect(contour)
+        regions.append(((x, y, w, h), angle))
+    return regions
+
+
+def _roi_crops(full_gray: Image.Image, small_gray: Image.Image, scale: float) -> Iterator[Image.Image]:
+    """Full-resolution crops of the candidate regions, deskewed when tilted."""
+    for (x, y, w, h), angle in _candidate_regions(small_gray):
+        pad_x, pad_y = int(w * 0.15) + 5, int(h * 0.15) + 5
+        box = (
+            max(0, int((x - pad_x) / scale)),
+            max(0, int((y - pad_y) / scale)),
+            min(full_gray.width, int((x + w + pad_x) / scale)),
+            min(full_gray.height, int((y + h + pad_y) / scale)),
+        )
+        crop = full_gray.crop(box)
+        yield crop
+        # minAreaRect angles live in [0, 90): bars become axis aligned after
+        # rotating either way, and zbar scans both axes.
+        if 2 < angle < 88:
+            yield crop.rotate(angle, expand=True, fillcolor=255)
+            yield crop.rotate(-angle, expand=True, fillcolor=255)
+
+
+def _passes(image: Image.Image) -> Iterator[Tuple[str, Image.Image, Optional[Sequence[ZBarSymbol]]]]:
+    """Decode attempts, cheapest first. Later passes only run if earlier ones failed."""
+    image = ImageOps.exif_transpose(image)
+    gray = image.convert("L")
+    small, scale = _downscale(gray, FAST_MAX_SIDE)
+
+    yield "fast", small, STORE_SYMBOLS
+    if scale < 1.0:
+        yield "full", gray, STORE_SYMBOLS
+
+    for crop in _roi_crops(gray, small, scale):
+        yield "roi", crop, STORE_SYMBOLS
+        yield "roi", _binarize(crop), STORE_SYMBOLS
+
+    for angle in FALLBACK_ANGLES:
+        yield "rotate", small.rotate(angle, expand=True, fillcolor=255), STORE_SYMBOLS
+
+    binary = _binarize(gray)
+    for factor in FALLBACK_SCALES:
+        size = (max(1, int(gray.width * factor)), max(1, int(gray.height * factor)))
+        yield "multiscale", binary.resize(size, Image.BILINEAR), STORE_SYMBOLS
+
+    # Last resort: what the original decoder did (full image, every symbology)
+    yield "any_symbol", image, None
+
+
+def decode_barcode(image: Image.Image) -> DecodeOutcome:
+    """
+    Decodes the receipt barcode of an image with escalating strategies.
+
+    A grayscale downscaled pass restricted to the store symbologies handles
+    most photos; region-of-interest search, rotations and multi-scale passes
+    only run when it fails. The returned outcome names the pass that worked.
+    """
+    for strategy, candidate, symbols in _passes(image):
+        code = _zbar(candidate, symbols)
+        if code is not None:
+            return DecodeOutcome(
+                data=code.data.decode("utf-8", errors="ignore"),
+                symbology=str(code.type),
+                strategy=strategy,
+            )
+    return DecodeOutcome(data=None)
@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional
+
+from loguru import logger
+
+from .metrics import span
+
+# A driver patched for "the installed Chrome" is fetched again after this long (Chrome auto-updates)
+AUTO_VERSION_MAX_AGE = 7 * 86400
+
+
+@contextmanager
+def _file_lock(path: Path) -> Iterator[None]:
+    """Exclusive lock shared by every process on the host (app, decode workers, browser workers)."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("a+b") as f:
+        try:
+            import fcntl
+        except ImportError:  # Windows
+            import msvcrt
+
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            return
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def patched_chromedriver(cache_dir: Path, version_main: Optional[int] = None) -> Path:
+    """
+    Path of a chromedriver patched by undetected_chromedriver, shared by every process.
+
+    undetected_chromedriver downloads and patches a fresh binary for each
+    Chrome it starts (and deletes it on exit). Here the first process to need
+    one patches it under a file lock and keeps it in `cache_dir`; the others
+    reuse it, so no session start pays for the download again.
+    """
+    cache_dir = Path(cache_dir)
+    name = f"chromedriver_{version_main or 'auto'}" + (".exe" if os.name == "nt" else "")
+    target = cache_dir / name
+
+    with _file_lock(cache_dir / ".lock"):
+        import undetected_chromedriver as uc
+
+        fresh = version_main or (target.exists() and time.time() - target.stat().st_mtime < AUTO_VERSION_MAX_AGE)
+        if target.exists() and fresh and uc.Patcher(executable_path=str(target)).is_binary_patched():
+            return target
+
+        with span("chromedriver_patch"):
+            patcher = uc.Patcher(version_main=version_main or 0)
+            patcher.auto()
+            tmp = target.with_name(f".{name}.{os.getpid()}.tmp")
+            shutil.copyfile(patcher.executable_path, tmp)
+            os.chmod(tmp, 0o755)
+            tmp.replace(target)
+        logger.info(f"Patched chromedriver cached at {target}")
+    return target
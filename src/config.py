@@ -8,17 +8,114 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 
 # Load configuration from .env file
 DOWNLOAD_DIR = os.getenv("DOWNLOAD_DIR", "data/invoices")
-MERGED_DIR_PATH = os.getenv("MERGED_DIR", "data/merged_pdf")
 MERGED_FILE_NAME = os.getenv("MERGED_FILE_NAME", "merged_invoices.pdf")
-FAILED_BARCODES_FILE_PATH = os.getenv("FAILED_BARCODES_FILE", "data/failed_barcodes.txt")
+RETRY_QUEUE_DB_PATH = os.getenv("RETRY_QUEUE_DB", "data/retry_queue.sqlite3")
+JOBS_DIR_PATH = os.getenv("JOBS_DIR", "data/jobs")
+SPOOL_DIR_PATH = os.getenv("SPOOL_DIR", "data/spool")
+CACHE_DIR_PATH = os.getenv("CACHE_DIR", "data/cache")
+SLOW_JOBS_DIR_PATH = os.getenv("SLOW_JOBS_DIR", "data/slow_jobs")
+SHARED_DIR_PATH = os.getenv("SHARED_DIR", "data/shared")
+# Patched chromedriver shared by every process (empty: undetected_chromedriver patches one per browser)
+CHROMEDRIVER_DIR_PATH = os.getenv("CHROMEDRIVER_DIR", "data/chromedriver")
+TASK_QUEUE_DB_PATH = os.getenv("TASK_QUEUE_DB", "data/shared/tasks.sqlite3")
+PROFILES_FILE_PATH = os.getenv("PROFILES_FILE", "profiles.json")
+# Profiles kept in SQLite instead of PROFILES_FILE (many tenants); fill with `python -m src.profiles_loader`
+PROFILES_DB_PATH = os.getenv("PROFILES_DB", "")
 CHROME_VERSION_MAIN = int(os.getenv("CHROME_VERSION_MAIN", "145"))
 
+# Browser pool: warm sessions are reused and recycled after DRIVER_MAX_USES leases
+DRIVER_MAX_USES = int(os.getenv("DRIVER_MAX_USES", "25"))
+# Browser sessions started with the app (and with each worker), so the first upload finds them warm
+PREWARM_SESSIONS = int(os.getenv("PREWARM_SESSIONS", "0"))
+# "standard": regular Chrome; "lean": headless, non-essential resources blocked, memory-saving flags
+BROWSER_MODE = os.getenv("BROWSER_MODE", "standard")
+# URL patterns blocked in lean mode (DevTools Network.setBlockedURLs wildcards)
+LEAN_BLOCKED_URLS = [s.strip() for s in os.getenv(
+    "LEAN_BLOCKED_URLS",
+    "*.png,*.jpg,*.jpeg,*.gif,*.webp,*.svg,*.ico,*.woff,*.woff2,*.ttf,*.otf,*.mp4,*.webm,"
+    "*google-analytics.com*,*googletagmanager.com*,*doubleclick.net*,*facebook.net*,*hotjar.com*,"
+    "*criteo.com*,*criteo.net*,*contentsquare.net*,*abtasty.com*",
+).split(",") if s.strip()]
+# Number of browsers processing the barcodes of one batch in parallel
+AUTOFILL_WORKERS = int(os.getenv("AUTOFILL_WORKERS", "1"))
+# Number of upload jobs running at the same time
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# Browsers shared by the jobs of the API process (0 = AUTOFILL_WORKERS * JOB_WORKERS, one per job thread)
+DRIVER_POOL_SIZE = int(os.getenv("DRIVER_POOL_SIZE", "0")) or AUTOFILL_WORKERS * JOB_WORKERS
+# Hours a finished job (status, events, merged PDF) stays available before it is deleted (0 = until restart)
+JOB_RETENTION_HOURS = float(os.getenv("JOB_RETENTION_HOURS", "24"))
+# Processes decoding receipt images (0 = one per CPU core)
+DECODE_WORKERS = int(os.getenv("DECODE_WORKERS", "0")) or None
+# ZIP uploads: most images one archive may hold, and largest uncompressed image accepted from it
+ZIP_MAX_MEMBERS = int(os.getenv("ZIP_MAX_MEMBERS", "1000"))
+ZIP_MAX_MEMBER_MB = int(os.getenv("ZIP_MAX_MEMBER_MB", "50"))
+# Delay before retrying a failed attempt, doubled on each retry (capped at RETRY_BACKOFF_MAX)
+RETRY_BACKOFF_SECONDS = float(os.getenv("RETRY_BACKOFF_SECONDS", "1"))
+RETRY_BACKOFF_MAX = float(os.getenv("RETRY_BACKOFF_MAX", "15"))
+
+# Retry queue: barcodes that failed every attempt are retried later, RETRY_QUEUE_DELAY seconds
+# after their failure (doubled per failure), up to RETRY_QUEUE_MAX_ATTEMPTS times.
+# The scheduler wakes every RETRY_QUEUE_INTERVAL seconds and retries RETRY_QUEUE_BATCH entries,
+# only during the RETRY_QUEUE_WINDOW hours ("22-6"; empty = any time, RETRY_QUEUE_ENABLED=0 = never)
+RETRY_QUEUE_ENABLED = os.getenv("RETRY_QUEUE_ENABLED", "1") == "1"
+RETRY_QUEUE_MAX_ATTEMPTS = int(os.getenv("RETRY_QUEUE_MAX_ATTEMPTS", "5"))
+RETRY_QUEUE_DELAY = float(os.getenv("RETRY_QUEUE_DELAY", "900"))
+RETRY_QUEUE_INTERVAL = float(os.getenv("RETRY_QUEUE_INTERVAL", "300"))
+RETRY_QUEUE_BATCH = int(os.getenv("RETRY_QUEUE_BATCH", "20"))
+RETRY_QUEUE_WINDOW = os.getenv("RETRY_QUEUE_WINDOW", "22-6")
+
+# Distributed workers: with TASK_QUEUE=sqlite, barcodes are queued in TASK_QUEUE_DB and processed by
+# `python -m src.worker` processes (WORKER_CONCURRENCY browsers each), which store invoices in SHARED_DIR.
+# A task whose worker stops renewing its TASK_LEASE_SECONDS lease is handed to another worker,
+# at most TASK_MAX_DELIVERIES times. Empty TASK_QUEUE: everything runs inside the API process.
+TASK_QUEUE = os.getenv("TASK_QUEUE", "")
+TASK_LEASE_SECONDS = float(os.getenv("TASK_LEASE_SECONDS", "120"))
+TASK_MAX_DELIVERIES = int(os.getenv("TASK_MAX_DELIVERIES", "3"))
+# Longest a job waits for the workers; its unfinished tasks then fail (0 = wait forever)
+TASK_QUEUE_TIMEOUT = float(os.getenv("TASK_QUEUE_TIMEOUT", "3600"))
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "1"))
+
+# Store portals driven by the browser flow (overridable, e.g. to point at bench/portals.py)
+AUCHAN_PORTAL_URL = os.getenv("AUCHAN_PORTAL_URL", "https://www.auchan.fr/facture")
+CARREFOUR_PORTAL_URL = os.getenv("CARREFOUR_PORTAL_URL", "https://www.carrefour.fr/services/facture")
+
+# HTTP fast path: stores listed in FAST_PATH_STORES are first requested over plain HTTP
+FAST_PATH_STORES = [s.strip() for s in os.getenv("FAST_PATH_STORES", "").split(",") if s.strip()]
+AUCHAN_API_URL = os.getenv("AUCHAN_API_URL", "https://www.auchan.fr/facture/api/invoices")
+CARREFOUR_API_URL = os.getenv("CARREFOUR_API_URL", "https://www.carrefour.fr/services/facture/api/invoices")
+
+# Invoice cache: entries expire after CACHE_MAX_AGE_DAYS, LRU eviction above CACHE_MAX_MB
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "1") == "1"
+CACHE_MAX_AGE_DAYS = float(os.getenv("CACHE_MAX_AGE_DAYS", "90"))
+CACHE_MAX_MB = int(os.getenv("CACHE_MAX_MB", "2048"))
+# Invoice archive: every retrieved invoice, searchable, indexed in the cache database over its blobs
+# (archived invoices never expire, even when CACHE_ENABLED=0)
+ARCHIVE_ENABLED = os.getenv("ARCHIVE_ENABLED", "1") == "1"
+# Most invoices one /archive/merge request may assemble
+ARCHIVE_MERGE_MAX = int(os.getenv("ARCHIVE_MERGE_MAX", "500"))
+
+# Logs: one JSON object per line (LOG_JSON=0 for human-readable lines)
+LOG_JSON = os.getenv("LOG_JSON", "1") == "1"
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+# Jobs slower than SLOW_JOB_SECONDS get their timing breakdown dumped to SLOW_JOBS_DIR (0 = off)
+SLOW_JOB_SECONDS = float(os.getenv("SLOW_JOB_SECONDS", "0"))
+SLOW_JOB_KEEP = int(os.getenv("SLOW_JOB_KEEP", "20"))
+
 # Create full paths
 INVOICES_DIR = Path(BASE_DIR / DOWNLOAD_DIR)
-MERGED_DIR = Path(BASE_DIR / MERGED_DIR_PATH)
-FAILED_BARCODES_FILE = Path(BASE_DIR / FAILED_BARCODES_FILE_PATH)
+RETRY_QUEUE_DB = Path(BASE_DIR / RETRY_QUEUE_DB_PATH)
+JOBS_DIR = Path(BASE_DIR / JOBS_DIR_PATH)
+SPOOL_DIR = Path(BASE_DIR / SPOOL_DIR_PATH)
+CACHE_DIR = Path(BASE_DIR / CACHE_DIR_PATH)
+SLOW_JOBS_DIR = Path(BASE_DIR / SLOW_JOBS_DIR_PATH)
+SHARED_DIR = Path(BASE_DIR / SHARED_DIR_PATH)
+CHROMEDRIVER_DIR = Path(BASE_DIR / CHROMEDRIVER_DIR_PATH) if CHROMEDRIVER_DIR_PATH else None
+TASK_QUEUE_DB = Path(BASE_DIR / TASK_QUEUE_DB_PATH)
+PROFILES_FILE = Path(BASE_DIR / PROFILES_FILE_PATH)
+PROFILES_DB = Path(BASE_DIR / PROFILES_DB_PATH) if PROFILES_DB_PATH else None
+
 
-# Create directories if they don't exist
-INVOICES_DIR.mkdir(parents=True, exist_ok=True)
-MERGED_DIR.mkdir(parents=True, exist_ok=True)
-FAILED_BARCODES_FILE.parent.mkdir(parents=True, exist_ok=True)
\ No newline at end of file
+def ensure_dirs() -> None:
+    """Creates the data directories. Called at startup (app lifespan, worker), not on import."""
+    for directory in (INVOICES_DIR, JOBS_DIR, SPOOL_DIR, RETRY_QUEUE_DB.parent):
+        directory.mkdir(parents=True, exist_ok=True)
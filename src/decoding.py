@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterator, List, Optional, Tuple
+
+from loguru import logger
+
+from .metrics import RECEIPTS_DECODED_TOTAL, record_span
+
+
+@dataclass
+class DecodeResult:
+    filename: str
+    barcode: Optional[str]
+    symbology: Optional[str] = None
+    strategy: Optional[str] = None
+    seconds: float = 0.0  # decode time in the worker process
+
+
+if TYPE_CHECKING:
+    from .barcode_decoder import DecodeOutcome
+
+
+def decode_image_file(path: str) -> Tuple["DecodeOutcome", float]:
+    """Decodes the barcode of one image file. Runs in a worker process; also returns the time it took."""
+    # PIL, OpenCV and zbar are only loaded by the worker processes, not by the server
+    from PIL import Image
+
+    from .barcode_decoder import DecodeOutcome, decode_barcode
+
+    start = time.perf_counter()
+    try:
+        with Image.open(path) as image:
+            image.load()
+            outcome = decode_barcode(image)
+    except Exception:
+        outcome = DecodeOutcome(data=None)
+    return outcome, time.perf_counter() - start
+
+
+def _load_decoders() -> None:
+    """Runs in a worker process: pays the decoder imports before the first image arrives."""
+    import importlib
+
+    importlib.import_module(f"{__package__}.barcode_decoder")
+
+
+class DecodeStage:
+    """
+    Decodes receipt images on a process pool, off the event loop.
+
+    Files are decoded in parallel across cores; results come back in the
+    order the files were given. Images are passed to workers by path and only
+    a small window of them is in flight, so memory stays flat whatever the
+    batch size.
+    """
+
+    def __init__(self, workers: Optional[int] = None):
+        self.workers = workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawn: the server runs threads (job workers), which fork does not mix well with
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._executor
+
+    async def decode_stream(
+        self, images: Iterator[Tuple[str, Optional[Path]]], *, delete_decoded: bool = False
+    ) -> List[DecodeResult]:
+        """
+        Decodes (name, path) pairs pulled lazily from `images`, keeping their order.
+
+        A None path (file that could not be read) gives a result without barcode.
+        With `delete_decoded`, each file is deleted as soon as it is decoded.
+        """
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        window = 2 * (self.workers or os.cpu_count() or 1)
+
+        pending: deque = deque()
+        results: List[DecodeResult] = []
+
+        async def collect_oldest() -> None:
+            filename, path, future = pending.popleft()
+            if future is None:
+                RECEIPTS_DECODED_TOTAL.inc(result="missing")
+                results.append(DecodeResult(filename, None))
+                return
+            outcome, seconds = await future
+            if delete_decoded:
+                path.unlink(missing_ok=True)
+            # Measured in the worker: excludes the time spent queued
+            record_span("decode", seconds, step=outcome.strategy or "")
+            RECEIPTS_DECODED_TOTAL.inc(result="found" if outcome.data else "missing")
+            logger.bind(file=filename, strategy=outcome.strategy, seconds=round(seconds, 3)).info(
+                f"Decoded {filename}: {outcome.strategy or 'no barcode'}"
+            )
+            results.append(DecodeResult(filename, outcome.data, outcome.symbology, outcome.strategy, seconds))
+
+        while True:
+            # The producer may unpack archive members: keep its disk I/O off the event loop
+            item = await loop.run_in_executor(None, next, images, None)
+            if item is None:
+                break
+            filename, path = item
+            future = loop.run_in_executor(executor, decode_image_file, str(path)) if path is not None else None
+            pending.append((filename, path, future))
+            if len(pending) >= window:
+                await collect_oldest()
+
+        while pending:
+            await collect_oldest()
+        return results
+
+    def prewarm(self) -> None:
+        """Starts the worker processes and loads the decoders in them, ahead of the first upload."""
+        executor = self._get_executor()
+        futures = [executor.submit(_load_decoders) for _ in range(self.workers or os.cpu_count() or 1)]
+        for future in futures:
+            future.result()
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from pathlib import Path
+from typing import Optional, Set
+
+# inotify(7) constants
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = getattr(os, "O_CLOEXEC", 0o2000000)
+_EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+
+# Chrome writes "<name>.crdownload" and renames it to "<name>" once complete
+PARTIAL_SUFFIXES = (".crdownload", ".tmp", ".part")
+
+
+def _load_libc():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    except OSError:
+        return None
+    return libc if hasattr(libc, "inotify_init1") else None
+
+
+_libc = _load_libc()
+
+
+class DownloadTracker:
+    """
+    Waits for the file a browser session downloads into its directory.
+
+    Arm it (``with DownloadTracker(dir) as tracker``) *before* clicking the
+    download link, then call ``tracker.wait()``. Only files completed after
+    arming count, and partial files (``.crdownload``) are ignored, so the
+    returned path is the finished file of this download, never an older or
+    half-written one.
+
+    On Linux completion is signalled by inotify (the rename Chrome does when a
+    download finishes); elsewhere the directory is scanned at a short interval.
+    """
+
+    def __init__(self, directory: Path, suffix: str = ".pdf", poll_interval: float = 0.2):
+        self.directory = Path(directory)
+        self.suffix = suffix.lower()
+        self.poll_interval = poll_interval
+        self._fd: Optional[int] = None
+        self._before: Set[str] = set()
+
+    def _is_candidate(self, name: str) -> bool:
+        lower = name.lower()
+        return lower.endswith(self.suffix) and not lower.endswith(PARTIAL_SUFFIXES)
+
+    def _listing(self) -> Set[str]:
+        with os.scandir(self.directory) as entries:
+            return {e.name for e in entries if e.is_file()}
+
+    def arm(self) -> "DownloadTracker":
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if _libc is not None:
+            fd = _libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+            if fd >= 0:
+                wd = _libc.inotify_add_watch(fd, os.fsencode(self.directory), _IN_CLOSE_WRITE | _IN_MOVED_TO)
+                if wd >= 0:
+                    self._fd = fd
+                else:
+                    os.close(fd)
+        # Taken after the watch is set up, so nothing falls in between
+        self._before = self._listing()
+        return self
+
+    def _completed_since_arm(self) -> Optional[Path]:
+        new = [
+            name for name in self._listing() - self._before
+            if self._is_candidate(name) and not (self.directory / f"{name}.crdownload").exists()
+        ]
+        if not new:
+            return None
+        return max((self.directory / name for name in new), key=lambda p: p.stat().st_mtime)
+
+    def _read_events(self, timeout: float) -> Optional[Path]:
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return None
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return None
+
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            _, _, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0").decode("utf-8", errors="replace")
+            offset += length
+            if name and self._is_candidate(name) and name not in self._before:
+                return self.directory / name
+        return None
+
+    def wait(self, timeout: float = 40) -> Path:
+        """Returns the downloaded file, or raises RuntimeError after `timeout` seconds."""
+        deadline = time.monotonic() + timeout
+
+        # The download may already be complete (fast responses, cache)
+        done = self._completed_since_arm()
+        while done is None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise RuntimeError("No new PDF file detected (download may have failed).")
+            if self._fd is not None:
+                done = self._read_events(remaining)
+            else:
+                time.sleep(min(self.poll_interval, remaining))
+                done = self._completed_since_arm()
+        return done
+
+    def close(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self) -> "DownloadTracker":
+        return self.arm()
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -0,0 +1,353 @@
+from __future__ import annotations
+
+import queue
+import shutil
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, List, Optional, Sequence, Set
+from urllib.parse import urlsplit
+
+from loguru import logger
+
+from .chromedriver import patched_chromedriver
+from .config import CHROMEDRIVER_DIR, DRIVER_MAX_USES, DRIVER_POOL_SIZE, LEAN_BLOCKED_URLS
+from .metrics import span
+
+
+STANDARD = "standard"
+LEAN = "lean"
+BROWSER_MODES = (STANDARD, LEAN)
+
+# Chrome flags of the lean mode: fewer processes and background services, smaller caches
+LEAN_ARGUMENTS = (
+    "--headless=new",
+    "--disable-gpu",
+    "--disable-dev-shm-usage",
+    "--disable-extensions",
+    "--disable-background-networking",
+    "--disable-background-timer-throttling",
+    "--disable-renderer-backgrounding",
+    "--disable-sync",
+    "--disable-features=Translate,OptimizationHints,MediaRouter,AutofillServerCommunication",
+    "--no-first-run",
+    "--mute-audio",
+    "--renderer-process-limit=2",
+    "--disk-cache-size=1048576",
+    "--js-flags=--max-old-space-size=256",
+    "--window-size=1280,900",
+)
+
+
+def origin_of(url: Optional[str]) -> Optional[str]:
+    """"https://host[:port]" of an http(s) URL, None for anything else (about:blank, data:...)."""
+    parts = urlsplit(url or "")
+    if parts.scheme not in ("http", "https") or not parts.netloc:
+        return None
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+class DriverSession:
+    """A live Chrome instance owned by a DriverPool."""
+
+    def __init__(self, driver, download_dir: Path):
+        self.driver = driver
+        self.download_dir = download_dir
+        self.uses = 0
+        self.origins: Set[str] = set()  # origins loaded since the state was last cleared
+
+    def is_alive(self) -> bool:
+        try:
+            self.driver.window_handles  # round trip to the browser
+            return True
+        except Exception:
+            return False
+
+    def quit(self) -> None:
+        try:
+            self.driver.quit()
+        except Exception:
+            pass
+
+
+class DriverPool:
+    """
+    Keeps warm Chrome sessions and leases them to callers.
+
+    Sessions are wiped on release, since one pool serves every store and
+    user: every cookie, and through DevTools the storage (localStorage,
+    IndexedDB, cache storage...) of each origin the session may have written
+    to, i.e. the origins of ``portal_urls``, of every start page it was
+    leased on and of the page it was left on. They are navigated to the
+    portal start page on lease. They are rebuilt only when
+    they crash and recycled after ``max_uses`` leases so memory does not grow
+    without limit.
+
+    With ``isolate_downloads=True`` every session downloads into its own
+    ``download_dir/session_<n>`` subdirectory, so concurrent sessions never
+    see each other's files.
+
+    ``mode="lean"`` starts headless sessions with memory-saving flags and
+    blocks images, fonts, media and trackers (``blocked_urls``) through
+    DevTools. In every mode downloads are enabled explicitly through DevTools,
+    so they also work headless.
+
+    Sessions run the patched chromedriver cached in ``driver_cache_dir``
+    (shared by every process, see chromedriver.py); None lets
+    undetected_chromedriver patch a new one for each session.
+    ``prewarm(n)`` starts sessions before the first lease.
+
+    Usage
+    -----
+        with DriverPool(download_dir) as pool:
+            with pool.lease("https://www.auchan.fr/facture") as session:
+                session.driver.find_element(...)
+    """
+
+    def __init__(
+        self,
+        download_dir: Path,
+        *,
+        size: int = DRIVER_POOL_SIZE,
+        max_uses: int = DRIVER_MAX_USES,
+        chrome_version_main: Optional[int] = None,
+        headless: bool = False,
+        isolate_downloads: bool = False,
+        mode: str = STANDARD,
+        blocked_urls: Optional[List[str]] = None,
+        driver_cache_dir: Optional[Path] = CHROMEDRIVER_DIR,
+        portal_urls: Sequence[str] = (),
+    ):
+        if size < 1:
+            raise ValueError("size must be >= 1")
+        if mode not in BROWSER_MODES:
+            raise ValueError(f"mode must be one of {BROWSER_MODES}")
+        self.download_dir = Path(download_dir)
+        self.size = size
+        self.max_uses = max_uses
+        self.chrome_version_main = chrome_version_main
+        self.headless = headless
+        self.isolate_downloads = isolate_downloads
+        self.mode = mode
+        self.blocked_urls = list(LEAN_BLOCKED_URLS if blocked_urls is None else blocked_urls)
+        self.driver_cache_dir = driver_cache_dir
+        self.portal_origins = {origin for origin in map(origin_of, portal_urls) if origin}
+
+        self._idle: "queue.LifoQueue[DriverSession]" = queue.LifoQueue()
+        self._sessions: List[DriverSession] = []
+        self._count = 0  # live sessions + sessions being started
+        self._created = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    # ------------------------------------------------------------------ #
+    # Session lifecycle
+    # ------------------------------------------------------------------ #
+    def _build_options(self, download_dir: Path):
+        import undetected_chromedriver as uc
+
+        options = uc.ChromeOptions()
+        prefs = {
+            "download.default_directory": str(download_dir.resolve()),
+            "download.prompt_for_download": False,
+            "plugins.always_open_pdf_externally": True,
+        }
+        if self.mode == LEAN:
+            prefs["profile.managed_default_content_settings.images"] = 2
+            for argument in LEAN_ARGUMENTS:
+                options.add_argument(argument)
+        elif self.headless:
+            options.add_argument("--headless=new")
+        options.add_experimental_option("prefs", prefs)
+        return options
+
+    def _configure_devtools(self, driver, download_dir: Path) -> None:
+        # Headless Chrome ignores the download prefs: allow downloads to the session directory explicitly
+        behavior = {"behavior": "allow", "downloadPath": str(download_dir.resolve())}
+        try:
+            driver.execute_cdp_cmd("Browser.setDownloadBehavior", behavior)
+        except Exception:
+            driver.execute_cdp_cmd("Page.setDownloadBehavior", behavior)
+
+        if self.mode == LEAN and self.blocked_urls:
+            driver.execute_cdp_cmd("Network.enable", {})
+            driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": self.blocked_urls})
+
+    def _create_session(self) -> DriverSession:
+        download_dir = self.download_dir
+        if self.isolate_downloads:
+            with self._lock:
+                self._created += 1
+                download_dir = self.download_dir / f"session_{self._created}"
+        download_dir.mkdir(parents=True, exist_ok=True)
+        options = self._build_options(download_dir)
+
+        # Imported here: undetected_chromedriver (and selenium) are heavy, and only needed once a browser starts
+        import undetected_chromedriver as uc
+
+        kwargs = {}
+        if self.chrome_version_main is not None:
+            kwargs["version_main"] = self.chrome_version_main
+        if self.driver_cache_dir is not None:
+            kwargs["driver_executable_path"] = str(patched_chromedriver(self.driver_cache_dir, self.chrome_version_main))
+        with span("browser_start"):
+            driver = uc.Chrome(options=options, **kwargs)
+        try:
+            self._configure_devtools(driver, download_dir)
+        except Exception:
+            driver.quit()
+            raise
+        return DriverSession(driver, download_dir)
+
+    def _discard(self, session: DriverSession) -> None:
+        session.quit()
+        if self.isolate_downloads:
+            shutil.rmtree(session.download_dir, ignore_errors=True)
+        with self._lock:
+            if session in self._sessions:
+                self._sessions.remove(session)
+                self._count -= 1
+
+    def _clear_state(self, session: DriverSession) -> None:
+        """Deletes cookies and the storage of the portal origins, so the next lease (any store or user) starts clean."""
+        driver = session.driver
+        try:
+            session.origins.add(origin_of(driver.current_url))
+        except Exception:
+            pass
+        # WebDriver's cookie and storage calls only reach the origin currently loaded.
+        # Storage.clearDataForOrigin takes one real origin: there is no wildcard.
+        driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+        for origin in sorted(origin for origin in self.portal_origins | session.origins if origin):
+            driver.execute_cdp_cmd("Storage.clearDataForOrigin", {"origin": origin, "storageTypes": "all"})
+        session.origins.clear()
+        try:
+            # sessionStorage belongs to the tab, not to the storage types above
+            driver.execute_script("window.sessionStorage.clear();")
+        except Exception:
+            pass
+
+    def _reset(self, session: DriverSession, start_url: Optional[str]) -> None:
+        """Goes back to the start page (state was cleared when the session was released)."""
+        if start_url:
+            session.origins.add(origin_of(start_url))
+            with span("navigate"):
+                session.driver.get(start_url)
+
+    def _acquire(self) -> DriverSession:
+        while True:
+            if self._closed:
+                raise RuntimeError("DriverPool is closed")
+
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+
+            with self._lock:
+                can_create = self._count < self.size
+                if can_create:
+                    # Reserve the slot before the (slow) browser start.
+                    self._count += 1
+
+            if can_create:
+                break
+
+            # Every slot is leased: wait for a release (or a discard freeing a slot).
+            try:
+                return self._idle.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+        return self._start_reserved()
+
+    def _start_reserved(self) -> DriverSession:
+        """Starts a session in a slot already counted in _count."""
+        try:
+            session = self._create_session()
+        except Exception:
+            with self._lock:
+                self._count -= 1
+            raise
+        with self._lock:
+            self._sessions.append(session)
+        return session
+
+    def prewarm(self, count: int) -> int:
+        """Starts up to `count` idle sessions (within the pool size). Returns how many were started."""
+        started = 0
+        for _ in range(count):
+            with self._lock:
+                if self._closed or self._count >= self.size:
+                    break
+                self._count += 1
+            try:
+                session = self._start_reserved()
+            except Exception as e:
+                logger.warning(f"Could not prewarm a browser session: {e}")
+                break
+            self._idle.put(session)
+            started += 1
+        return started
+
+    def _release(self, session: DriverSession, failed: bool) -> None:
+        session.uses += 1
+        recycle = session.uses >= self.max_uses
+        crashed = failed and not session.is_alive()
+
+        if self._closed or recycle or crashed:
+            self._discard(session)
+            return
+        try:
+            self._clear_state(session)
+        except Exception as e:
+            logger.warning(f"Could not clear browser state, discarding the session: {e}")
+            self._discard(session)
+            return
+        self._idle.put(session)
+
+    @contextmanager
+    def lease(self, start_url: Optional[str] = None) -> Iterator[DriverSession]:
+        """
+        Leases a warm session, positioned on ``start_url`` with a clean state.
+
+        If the session cannot be reset (browser died while idle) it is rebuilt once.
+        """
+        session = self._acquire()
+        try:
+            self._reset(session, start_url)
+        except Exception:
+            self._discard(session)
+            session = self._acquire()
+            try:
+                self._reset(session, start_url)
+            except Exception:
+                self._discard(session)
+                raise
+
+        failed = False
+        try:
+            yield session
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            self._release(session, failed)
+
+    def close(self) -> None:
+        """Quits every session owned by the pool."""
+        self._closed = True
+        with self._lock:
+            sessions = list(self._sessions)
+            self._sessions.clear()
+            self._count = 0
+        for session in sessions:
+            session.quit()
+            if self.isolate_downloads:
+                shutil.rmtree(session.download_dir, ignore_errors=True)
+
+    def __enter__(self) -> "DriverPool":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Dict
+from urllib.parse import urljoin
+
+
+class FastPathError(RuntimeError):
+    """The portal could not be served over plain HTTP; use the browser flow."""
+
+
+class PortalHttpEngine(ABC):
+    """
+    Retrieves invoices by talking to a portal's form endpoint directly.
+
+    One POST submits the same fields the browser flow types into the form.
+    The portal answers either with the PDF itself or with JSON holding the
+    download URL (``download_key``), which is then fetched. Connections come
+    from a pooled ``requests.Session`` shared by all worker threads. Only
+    the download GET is retried: a failed POST may still have reached the
+    portal, and the browser flow submits the form again anyway.
+    """
+
+    store = ""
+    download_key = "downloadUrl"
+
+    def __init__(self, form_url: str, *, pool_size: int = 10, timeout: float = 20):
+        # requests is only imported when a fast path is configured
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        self.form_url = form_url
+        self.timeout = timeout
+        self._session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            # Default allowed_methods: idempotent requests only (connection errors are retried for any method)
+            max_retries=Retry(total=2, backoff_factor=0.5, status_forcelist=(502, 503, 504)),
+        )
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+    @abstractmethod
+    def form_payload(self, barcode: str, status: Dict[str, str]) -> Dict[str, str]:
+        """JSON body of the form POST for one barcode."""
+
+    def fetch_invoice(self, barcode: str, status: Dict[str, str]) -> bytes:
+        import requests
+
+        try:
+            response = self._session.post(self.form_url, json=self.form_payload(barcode, status), timeout=self.timeout)
+            response.raise_for_status()
+
+            if not response.content.startswith(b"%PDF"):
+                body = response.json()
+                if not isinstance(body, dict):
+                    raise FastPathError(f"Unexpected portal response: {type(body).__name__}")
+                download_url = body.get(self.download_key)
+                if not download_url:
+                    raise FastPathError(f"No '{self.download_key}' in portal response")
+                response = self._session.get(urljoin(self.form_url, download_url), timeout=self.timeout)
+                response.raise_for_status()
+        except (requests.RequestException, ValueError) as e:
+            raise FastPathError(str(e)) from e
+
+        if not response.content.startswith(b"%PDF"):
+            raise FastPathError("Portal did not return a PDF")
+        return response.content
+
+    def download(self, barcode: str, status: Dict[str, str], target: Path) -> Path:
+        """Fetches the invoice of one barcode into `target`."""
+        content = self.fetch_invoice(barcode, status)
+        tmp = target.with_name(target.name + ".part")
+        tmp.write_bytes(content)
+        tmp.replace(target)
+        return target
+
+    def close(self) -> None:
+        self._session.close()
+
+
+class AuchanHttpEngine(PortalHttpEngine):
+    store = "auchan"
+
+    def form_payload(self, barcode: str, status: Dict[str, str]) -> Dict[str, str]:
+        # Same fields as the browser flow in autofill_Auchan.py
+        return {
+            "barcode": barcode,
+            "businessType": "PRIVATE_COMPANY",
+            "typeId": "SIRET",
+            "siret": status["siret"],
+            "companyName": status["companyName"],
+            "companyAddress": status["address"],
+            "zipCode": status["zipCode"],
+            "city": status["city"],
+            "vat": status["vat"],
+            "contactName": status["name"],
+            "contactEmail": status["contactEmail"],
+        }
+
+
+class CarrefourHttpEngine(PortalHttpEngine):
+    store = "carrefour"
+
+    def form_payload(self, barcode: str, status: Dict[str, str]) -> Dict[str, str]:
+        # Same fields as the browser flow in autofill_Carrefour.py
+        return {
+            "customerType": "entreprise",
+            "companyName": status["siret"],
+            "ticketNumber": barcode,
+            "address": status["address"],
+            "postalCode": status["zipCode"],
+            "city": status["city"],
+            "companyIdentifier": status["siret"],
+            "companyVatNumber": status["vat"],
+        }
@@ -0,0 +1,276 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+from .metrics import span
+
+Locator = Tuple[str, str]
+
+
+class By:
+    """Locator strategies, same values as selenium's By (selenium is only imported once a browser runs)."""
+
+    ID = "id"
+    XPATH = "xpath"
+    LINK_TEXT = "link text"
+    PARTIAL_LINK_TEXT = "partial link text"
+    NAME = "name"
+    TAG_NAME = "tag name"
+    CLASS_NAME = "class name"
+    CSS_SELECTOR = "css selector"
+
+# How a step failed, which decides how it is retried (see runner._process_barcode)
+TRANSIENT = "transient"  # timed out waiting for the page: resume after a backoff
+STALE = "stale"  # the DOM was re-rendered under us: resume right away
+HARD = "hard"  # anything else: restart the flow from the start page
+
+
+def classify_error(exc: BaseException) -> str:
+    """Classifies a step failure, looking through wrapped causes."""
+    from selenium.common.exceptions import StaleElementReferenceException, TimeoutException
+
+    while exc is not None:
+        if isinstance(exc, StaleElementReferenceException):
+            return STALE
+        if isinstance(exc, TimeoutException):
+            return TRANSIENT
+        exc = exc.__cause__
+    return HARD
+
+
+class StepError(RuntimeError):
+    """A flow step failed. `position` is the step to resume from, `kind` one of TRANSIENT/STALE/HARD."""
+
+    def __init__(self, message: str, position: int, kind: str):
+        super().__init__(message)
+        self.position = position
+        self.kind = kind
+
+
+@dataclass
+class Checkpoint:
+    """Progress of one barcode through a flow: `step` is the next step to run."""
+
+    step: int = 0
+    total: int = 0
+
+    def rewind(self) -> None:
+        """Steps back so the last completed step (e.g. the download click) runs again."""
+        self.step = max(0, self.step - 1)
+
+    def reset(self) -> None:
+        self.step = 0
+
+
+def _wait(driver, locator: Locator, timeout: int, clickable: bool = False):
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.support.ui import WebDriverWait
+
+    condition = EC.element_to_be_clickable if clickable else EC.presence_of_element_located
+    return WebDriverWait(driver, timeout).until(condition(locator))
+
+
+def _wait_click(driver, by, value, timeout: int = 15):
+    el = _wait(driver, (by, value), timeout, clickable=True)
+    el.click()
+    return el
+
+
+def _wait_send_keys(driver, by, value, text: str, timeout: int = 15, clear: bool = True):
+    el = _wait(driver, (by, value), timeout)
+    if clear:
+        try:
+            el.clear()
+        except Exception:
+            pass
+    el.send_keys(text)
+    return el
+
+
+# Locator strategies the batched fill script can resolve in the page
+_JS_LOCATORS = {By.ID, By.NAME, By.CSS_SELECTOR, By.XPATH, By.CLASS_NAME}
+
+# Sets several inputs in one round trip. Goes through the native value setter
+# and fires input/change so framework-controlled forms (React, Vue) see it.
+_FILL_SCRIPT = """
+const missing = [];
+for (const [by, value, text] of arguments[0]) {
+  let el = null;
+  if (by === "id") el = document.getElementById(value);
+  else if (by === "name") el = document.getElementsByName(value)[0] || null;
+  else if (by === "class name") el = document.getElementsByClassName(value)[0] || null;
+  else if (by === "css selector") el = document.querySelector(value);
+  else if (by === "xpath") el = document.evaluate(value, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+  if (!el) { missing.push(value); continue; }
+  const proto = el instanceof HTMLTextAreaElement ? HTMLTextAreaElement.prototype : HTMLInputElement.prototype;
+  const setter = Object.getOwnPropertyDescriptor(proto, "value").set;
+  el.focus();
+  setter.call(el, text);
+  el.dispatchEvent(new Event("input", { bubbles: true }));
+  el.dispatchEvent(new Event("change", { bubbles: true }));
+  el.blur();
+}
+return missing;
+"""
+
+
+@dataclass(frozen=True)
+class Click:
+    """Clicks an element once clickable. Optional clicks (cookie banners) may be absent."""
+
+    by: str
+    value: str
+    timeout: int = 15
+    optional: bool = False
+
+    def run(self, driver, values: Dict[str, str]) -> None:
+        try:
+            _wait_click(driver, self.by, self.value, timeout=self.timeout)
+        except Exception:
+            if not self.optional:
+                raise
+
+
+@dataclass(frozen=True)
+class ClickIfText:
+    """Clicks the first element matching the locator if its label is `text` (e.g. "Suivant")."""
+
+    by: str
+    value: str
+    text: str
+    timeout: int = 10
+
+    def run(self, driver, values: Dict[str, str]) -> None:
+        btn = _wait(driver, (self.by, self.value), self.timeout)
+        if btn.text.strip().lower() == self.text.lower():
+            btn.click()
+
+
+@dataclass(frozen=True)
+class ClickFirst:
+    """Clicks the first of several alternative elements (button or link depending on UI)."""
+
+    locators: Tuple[Locator, ...]
+    timeout: int = 15
+    error: str = "None of the expected elements could be clicked"
+
+    def run(self, driver, values: Dict[str, str]) -> None:
+        for by, value in self.locators:
+            try:
+                _wait_click(driver, by, value, timeout=self.timeout)
+                return
+            except Exception as e:
+                last_error = e
+        raise RuntimeError(self.error) from last_error
+
+
+@dataclass(frozen=True)
+class Fill:
+    """
+    Types a value in an input. `source` is "barcode" or a profile key.
+
+    Consecutive batchable fills are sent to the page in a single script
+    execution by the Flow; `batch=False` forces real keystrokes (for inputs
+    that validate on key events).
+    """
+
+    by: str
+    value: str
+    source: str
+    timeout: int = 15
+    batch: bool = True
+
+    def run(self, driver, values: Dict[str, str]) -> None:
+        _wait_send_keys(driver, self.by, self.value, values[self.source], timeout=self.timeout)
+
+
+Step = Union[Click, ClickIfText, ClickFirst, Fill]
+
+
+def _describe(item: Union[Step, List[Fill]]) -> str:
+    if isinstance(item, list):
+        return "fill " + ", ".join(f.value for f in item)
+    if isinstance(item, ClickFirst):
+        return "click " + " | ".join(value for _, value in item.locators)
+    return f"{'fill' if isinstance(item, Fill) else 'click'} {item.value}"
+
+
+def _fill_group(driver, fills: Sequence[Fill], values: Dict[str, str]) -> None:
+    """Fills several inputs with one WebDriver round trip once the first one is present."""
+    first = fills[0]
+    _wait(driver, (first.by, first.value), first.timeout)
+    try:
+        missing = set(driver.execute_script(_FILL_SCRIPT, [[f.by, f.value, values[f.source]] for f in fills]))
+    except Exception:
+        missing = {f.value for f in fills}
+
+    # Fields the script could not reach (rendered later, in a frame...) are typed normally
+    for f in fills:
+        if f.value in missing:
+            f.run(driver, values)
+
+
+@dataclass
+class Flow:
+    """
+    Declarative description of a store portal: where it starts, which
+    profile keys it needs and the steps from the start page to the
+    download click.
+    """
+
+    name: str
+    start_url: str
+    steps: List[Step]
+    required_keys: List[str] = field(default_factory=list)
+
+    def check_status(self, status: Dict[str, str]) -> None:
+        missing = [k for k in self.required_keys if k not in status or not status[k]]
+        if missing:
+            raise ValueError(f"Missing required status fields: {missing}")
+
+    def _plan(self) -> List[Union[Step, List[Fill]]]:
+        """Groups consecutive batchable fills into lists."""
+        plan: List[Union[Step, List[Fill]]] = []
+        for step in self.steps:
+            batchable = isinstance(step, Fill) and step.batch and step.by in _JS_LOCATORS
+            if batchable and plan and isinstance(plan[-1], list):
+                plan[-1].append(step)
+            elif batchable:
+                plan.append([step])
+            else:
+                plan.append(step)
+        return plan
+
+    def run(self, driver, barcode: str, status: Dict[str, str], checkpoint: Optional[Checkpoint] = None) -> None:
+        """
+        Walks the portal up to the download click.
+
+        With a `checkpoint`, starts at ``checkpoint.step`` (the page must still
+        be where that step expects it) and advances it after every step, so a
+        failed run can be resumed in the same session. Failures are raised as
+        StepError.
+        """
+        checkpoint = checkpoint if checkpoint is not None else Checkpoint()
+        values = dict(status, barcode=barcode)
+        plan = self._plan()
+        checkpoint.total = len(plan)
+
+        for position in range(checkpoint.step, len(plan)):
+            item = plan[position]
+            try:
+                with span("form_step", store=self.name.lower(), step=f"{position + 1}:{_describe(item)}"):
+                    if isinstance(item, list):
+                        if len(item) == 1:
+                            item[0].run(driver, values)
+                        else:
+                            _fill_group(driver, item, values)
+                    else:
+                        item.run(driver, values)
+            except Exception as e:
+                raise StepError(
+                    f"{self.name} step {position + 1}/{len(plan)} ({_describe(item)}) failed: {e}",
+                    position,
+                    classify_error(e),
+                ) from e
+            checkpoint.step = position + 1
@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import shutil
+import zipfile
+import zlib
+from pathlib import Path, PurePosixPath
+from typing import Iterable, Iterator, Optional, Tuple
+
+from fastapi import UploadFile
+from loguru import logger
+
+# Uploads are copied to disk by chunks of this size, never read whole
+SPOOL_CHUNK_SIZE = 1024 * 1024
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".gif", ".tif", ".tiff"}
+
+
+async def spool_upload(file: UploadFile, spool_dir: Path, index: int) -> Path:
+    """Streams one uploaded file to spool_dir and returns its path."""
+    suffix = PurePosixPath(file.filename or "").suffix.lower()
+    path = spool_dir / f"upload_{index}{suffix}"
+    with path.open("wb") as out:
+        while True:
+            chunk = await file.read(SPOOL_CHUNK_SIZE)
+            if not chunk:
+                break
+            out.write(chunk)
+    await file.close()
+    return path
+
+
+def _is_image_member(info: zipfile.ZipInfo) -> bool:
+    name = PurePosixPath(info.filename)
+    if info.is_dir() or name.parts[0] == "__MACOSX" or name.name.startswith("."):
+        return False
+    return name.suffix.lower() in IMAGE_EXTENSIONS
+
+
+class UploadRejected(ValueError):
+    """The upload exceeds the ingest limits (e.g. a ZIP archive with too many images)."""
+
+
+def _extract_member(archive: zipfile.ZipFile, info: zipfile.ZipInfo, target: Path, max_bytes: int) -> bool:
+    """Extracts one member to `target`. Returns False (and leaves nothing behind) if it cannot be."""
+    if info.file_size > max_bytes:
+        logger.warning(f"Skipping {info.filename}: {info.file_size} bytes uncompressed, above the limit")
+        return False
+    try:
+        # Reads stop at the declared file_size, and a wrong CRC raises: the check above bounds the output
+        with archive.open(info) as src, target.open("wb") as dst:
+            shutil.copyfileobj(src, dst, SPOOL_CHUNK_SIZE)
+        return True
+    except (zipfile.BadZipFile, zlib.error, OSError, EOFError, NotImplementedError) as e:
+        logger.warning(f"Could not extract {info.filename}: {e}")
+        target.unlink(missing_ok=True)
+        return False
+
+
+def iter_receipt_images(
+    spooled: Iterable[Tuple[str, Path]],
+    spool_dir: Path,
+    *,
+    max_members: int = 1000,
+    max_member_bytes: int = 50 * 1024 * 1024,
+) -> Iterator[Tuple[str, Optional[Path]]]:
+    """
+    Yields (display name, image path) for every receipt image of an upload.
+
+    Plain images are yielded as they are. ZIP archives are unpacked lazily:
+    each member is extracted to spool_dir only when the consumer asks for the
+    next image, so a large archive never has to be expanded (or held) at once.
+    Members are extracted under generated names, never under their archive path.
+
+    A member (or archive) that cannot be read, e.g. corrupt or larger than
+    `max_member_bytes` once uncompressed, is yielded with a None path, to be
+    reported as a failed file. An archive holding more than `max_members`
+    images raises UploadRejected before anything is extracted.
+    """
+    extracted = 0
+    for filename, path in spooled:
+        if not zipfile.is_zipfile(path):
+            yield filename, path
+            continue
+
+        try:
+            archive = zipfile.ZipFile(path)
+        except (zipfile.BadZipFile, OSError) as e:
+            logger.warning(f"Could not open {filename}: {e}")
+            yield filename, None
+            continue
+        with archive:
+            members = [info for info in archive.infolist() if _is_image_member(info)]
+            if len(members) > max_members:
+                raise UploadRejected(f"{filename} holds {len(members)} images, more than the {max_members} allowed")
+            for info in members:
+                extracted += 1
+                target = spool_dir / f"member_{extracted}{PurePosixPath(info.filename).suffix.lower()}"
+                ok = _extract_member(archive, info, target, max_member_bytes)
+                yield f"{filename}/{info.filename}", target if ok else None
+        path.unlink(missing_ok=True)
@@ -0,0 +1,221 @@
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+import shutil
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, Optional
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS invoices (
+    store        TEXT NOT NULL,
+    barcode      TEXT NOT NULL,
+    profile_key  TEXT NOT NULL,
+    sha256       TEXT NOT NULL,
+    size         INTEGER NOT NULL,
+    created_at   REAL NOT NULL,
+    last_used_at REAL NOT NULL,
+    PRIMARY KEY (store, barcode, profile_key)
+);
+CREATE INDEX IF NOT EXISTS invoices_last_used ON invoices (last_used_at);
+CREATE INDEX IF NOT EXISTS invoices_sha256 ON invoices (sha256);
+-- Invoice archive (see archive.py): rows never expire and keep their blob
+CREATE TABLE IF NOT EXISTS archive (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    store       TEXT NOT NULL,
+    barcode     TEXT NOT NULL,
+    profile     TEXT NOT NULL,
+    sha256      TEXT NOT NULL,
+    size        INTEGER NOT NULL,
+    issued_on   TEXT,
+    total       REAL,
+    currency    TEXT,
+    job_id      TEXT,
+    archived_at REAL NOT NULL,
+    UNIQUE (store, barcode, profile)
+);
+CREATE INDEX IF NOT EXISTS archive_profile_date ON archive (profile, issued_on);
+CREATE INDEX IF NOT EXISTS archive_store_date ON archive (store, issued_on);
+CREATE INDEX IF NOT EXISTS archive_date ON archive (issued_on);
+CREATE INDEX IF NOT EXISTS archive_barcode ON archive (barcode);
+CREATE INDEX IF NOT EXISTS archive_sha256 ON archive (sha256);
+"""
+
+
+def profile_key(status: Dict[str, str]) -> str:
+    """Fingerprint of the company info an invoice was issued for."""
+    payload = json.dumps(status, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()[:16]
+
+
+def copy_blob(blob: Path, target: Path) -> None:
+    """Writes the PDF stored in `blob` (gzip-compressed) to `target`."""
+    with gzip.open(blob, "rb") as src, open(target, "wb") as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+
+
+def read_blob(blob: Path) -> bytes:
+    """The PDF stored in `blob`."""
+    with gzip.open(blob, "rb") as f:
+        return f.read()
+
+
+def sha256_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class InvoiceCache:
+    """
+    Durable cache of downloaded invoices, keyed by (store, barcode, profile).
+
+    An SQLite index under ``root/index.sqlite3`` points to content-addressed,
+    gzip-compressed PDFs under ``root/blobs/<sha[:2]>/<sha>.pdf.gz``
+    (identical invoices are stored once; read them with `copy_blob` or
+    `read_blob`). Entries older than ``max_age_days`` are dropped, and the
+    least recently used ones are evicted once the invoices exceed
+    ``max_bytes`` (counted uncompressed).
+
+    The invoice archive indexes its invoices in the same database and blob
+    store. A blob is deleted only once neither table refers to it, and
+    archived blobs do not count towards ``max_bytes``: evicting cache entries
+    would not free them.
+    """
+
+    def __init__(
+        self, root: Path, *, max_age_days: float = 90, max_bytes: int = 2 * 1024 ** 3, compress_level: int = 6
+    ):
+        self.root = Path(root)
+        self.blobs_dir = self.root / "blobs"
+        self.db_path = self.root / "index.sqlite3"
+        self.max_age = max_age_days * 86400
+        self.max_bytes = max_bytes
+        self.compress_level = compress_level
+        self._lock = threading.Lock()
+
+        self.blobs_dir.mkdir(parents=True, exist_ok=True)
+        with self.connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def blob_path(self, sha256: str) -> Path:
+        return self.blobs_dir / sha256[:2] / f"{sha256}.pdf.gz"
+
+    def get(self, store: str, barcode: str, status: Dict[str, str]) -> Optional[Path]:
+        """Returns the blob of the cached PDF for this receipt, or None (missing or expired)."""
+        now = time.time()
+        key = (store, barcode, profile_key(status))
+        with self.connect() as conn:
+            row = conn.execute(
+                "SELECT sha256, created_at FROM invoices WHERE store = ? AND barcode = ? AND profile_key = ?",
+                key,
+            ).fetchone()
+            if row is None:
+                return None
+
+            sha256, created_at = row
+            blob = self.blob_path(sha256)
+            if now - created_at > self.max_age or not blob.exists():
+                conn.execute("DELETE FROM invoices WHERE store = ? AND barcode = ? AND profile_key = ?", key)
+                return None
+
+            conn.execute(
+                "UPDATE invoices SET last_used_at = ? WHERE store = ? AND barcode = ? AND profile_key = ?",
+                (now,) + key,
+            )
+        return blob
+
+    @contextmanager
+    def storing(self, pdf_path: Path, sha256: str) -> Iterator[sqlite3.Connection]:
+        """
+        Stores the blob of `pdf_path` (whose hash is `sha256`), then yields a
+        connection to reference it from. Runs under the eviction lock, so the
+        blob cannot be seen as an orphan before its row is committed.
+        """
+        blob = self.blob_path(sha256)
+        with self._lock:
+            if not blob.exists():
+                blob.parent.mkdir(parents=True, exist_ok=True)
+                tmp = blob.with_suffix(f".{threading.get_ident()}.tmp")
+                # mtime=0: the same PDF always compresses to the same bytes
+                with open(pdf_path, "rb") as src, gzip.GzipFile(
+                    tmp, "wb", compresslevel=self.compress_level, mtime=0
+                ) as dst:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+                tmp.replace(blob)
+            with self.connect() as conn:
+                yield conn
+
+    def put(self, store: str, barcode: str, status: Dict[str, str], pdf_path: Path) -> Path:
+        """Stores a downloaded invoice and returns its blob path."""
+        sha256 = sha256_file(pdf_path)
+        now = time.time()
+        with self.storing(pdf_path, sha256) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO invoices (store, barcode, profile_key, sha256, size, created_at, last_used_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (store, barcode, profile_key(status), sha256, Path(pdf_path).stat().st_size, now, now),
+            )
+        self.evict()
+        return self.blob_path(sha256)
+
+    def invalidate(self, store: str, barcode: str, status: Dict[str, str]) -> None:
+        """Forgets one receipt, so its next run fetches the invoice again."""
+        key = (store, barcode, profile_key(status))
+        with self._lock, self.connect() as conn:
+            shas = [sha for (sha,) in conn.execute(
+                "SELECT sha256 FROM invoices WHERE store = ? AND barcode = ? AND profile_key = ?", key
+            )]
+            conn.execute("DELETE FROM invoices WHERE store = ? AND barcode = ? AND profile_key = ?", key)
+            self.drop_unreferenced(conn, shas)
+
+    def evict(self) -> None:
+        """Drops expired entries, then least recently used ones until under max_bytes."""
+        with self._lock, self.connect() as conn:
+            cutoff = time.time() - self.max_age
+            dropped = [sha for (sha,) in conn.execute(
+                "SELECT DISTINCT sha256 FROM invoices WHERE created_at < ?", (cutoff,)
+            )]
+            conn.execute("DELETE FROM invoices WHERE created_at < ?", (cutoff,))
+
+            # Blobs are shared between entries: count each one once (archived ones stay regardless)
+            rows = conn.execute(
+                "SELECT sha256, MAX(size), MAX(last_used_at) AS used FROM invoices "
+                "WHERE sha256 NOT IN (SELECT sha256 FROM archive) GROUP BY sha256 ORDER BY used ASC"
+            ).fetchall()
+            total = sum(size for _, size, _ in rows)
+            for sha256, size, _ in rows:
+                if total <= self.max_bytes:
+                    break
+                conn.execute("DELETE FROM invoices WHERE sha256 = ?", (sha256,))
+                dropped.append(sha256)
+                total -= size
+
+            self.drop_unreferenced(conn, dropped)
+
+    def drop_unreferenced(self, conn: sqlite3.Connection, shas) -> None:
+        """Deletes the blobs of `shas` that no cache entry or archived invoice refers to any more."""
+        for sha256 in set(shas):
+            still_used = conn.execute(
+                "SELECT 1 FROM invoices WHERE sha256 = ? UNION ALL SELECT 1 FROM archive WHERE sha256 = ? LIMIT 1",
+                (sha256, sha256),
+            ).fetchone()
+            if still_used is None:
+                self.blob_path(sha256).unlink(missing_ok=True)
@@ -0,0 +1,345 @@
+from __future__ import annotations
+
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from enum import Enum
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from loguru import logger
+
+from .merge_pdf import IncrementalMerger
+from .metrics import JOBS_TOTAL, SlowJobRecorder, span, trace
+
+# pipeline(job) runs the automation for a job and returns the autofill result dict
+Pipeline = Callable[["Job"], Dict[str, object]]
+
+
+class JobState(str, Enum):
+    queued = "queued"
+    running = "running"
+    done = "done"
+    failed = "failed"
+
+
+@dataclass
+class JobEvent:
+    """One step of a job, as streamed to clients. IDs count from 1 within a job."""
+
+    id: int
+    event: str  # decoded, attempt, downloaded, failed, state
+    data: Dict[str, object]
+
+    @property
+    def final(self) -> bool:
+        """Last event of a job: nothing follows it."""
+        return self.event == "state" and self.data["state"] in (JobState.done.value, JobState.failed.value)
+
+
+@dataclass
+class Job:
+    id: str
+    store: str
+    profile: str
+    status: Dict[str, str]
+    barcodes: List[str]
+    failed_files: List[str]
+    work_dir: Path
+    # Store of each barcode (job.store is what was requested: a store name or "auto")
+    stores: List[str]
+    merged_file_name: str
+    refresh: bool = False
+    state: JobState = JobState.queued
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    processed: int = 0
+    downloaded: List[str] = field(default_factory=list)
+    failed_barcodes: List[str] = field(default_factory=list)
+    error: Optional[str] = None
+    merger: Optional[IncrementalMerger] = field(default=None, repr=False)
+    events: List[JobEvent] = field(default_factory=list, repr=False)
+    # Invoices finished so far, by position: downloadable one by one until the job ends
+    parts: Dict[int, Path] = field(default_factory=dict, repr=False)
+    # Last error of each failed barcode, until its failure is reported (see JobManager.record_failure)
+    errors: Dict[str, Tuple[str, str]] = field(default_factory=dict, repr=False)
+    # Set to stop the job: barcodes not started yet fail, the invoices already retrieved are kept
+    cancelled: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    @property
+    def invoices_dir(self) -> Path:
+        return self.work_dir / "invoices"
+
+    @property
+    def parts_dir(self) -> Path:
+        return self.work_dir / "parts"
+
+    @property
+    def merged_path(self) -> Path:
+        return self.work_dir / self.merged_file_name
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "job_id": self.id,
+            "state": self.state.value,
+            "store": self.store,
+            "profile": self.profile,
+            "barcodes_found": self.barcodes,
+            "stores": {s: self.stores.count(s) for s in dict.fromkeys(self.stores)},
+            "failed_files": self.failed_files,
+            "progress": {"processed": self.processed, "total": len(self.barcodes)},
+            "downloaded": len(self.downloaded),
+            "finished_invoices": sorted(self.parts),
+            "merged_invoices": self.merger.appended if self.merger is not None else 0,
+            "failed_barcodes": self.failed_barcodes,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "merged_pdf": str(self.merged_path) if self.merged_path.exists() else None,
+        }
+
+
+class JobManager:
+    """
+    Runs upload pipelines in the background on a bounded set of workers.
+
+    Each job gets its own working directory (``root/<job_id>``) holding its
+    downloaded invoices and its merged PDF, so concurrent jobs never share files.
+    The pipeline must report each finished barcode to ``record_progress``,
+    which appends its invoice to the job's merged PDF right away and keeps a
+    copy of it until the job ends, so invoices can be downloaded before the
+    whole job is done.
+
+    Every step of a job (file decoded, attempt, invoice downloaded, barcode
+    failed, state change) is recorded as a JobEvent, for clients to follow
+    with ``events``.
+
+    Finished jobs are forgotten, and their directory deleted, `retention`
+    seconds after they end (None keeps them for the life of the process).
+    Directories left in `root` by a previous process are deleted once older
+    than `retention` too.
+
+    With a `slow_jobs` recorder, the timing spans of jobs above its threshold
+    are dumped for profiling.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        pipeline: Pipeline,
+        *,
+        workers: int = 2,
+        merged_file_name: str = "merged_invoices.pdf",
+        slow_jobs: Optional[SlowJobRecorder] = None,
+        retention: Optional[float] = None,
+    ):
+        self.root = Path(root)
+        self.pipeline = pipeline
+        self.merged_file_name = merged_file_name
+        self.slow_jobs = slow_jobs
+        self.retention = retention
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job-worker")
+
+    def submit(
+        self,
+        store: str,
+        profile: str,
+        status: Dict[str, str],
+        barcodes: List[str],
+        failed_files: List[str],
+        *,
+        stores: Optional[List[str]] = None,
+        refresh: bool = False,
+        decoded: Sequence[Tuple[str, Optional[str]]] = (),
+    ) -> Job:
+        """
+        `decoded` lists the (file name, barcode or None) of the upload, recorded as the job's first events.
+        The upload is decoded before the job exists, so these events replay decoding, they are not live.
+        """
+        self.evict_expired()
+        job_id = uuid.uuid4().hex
+        job = Job(
+            id=job_id,
+            store=store,
+            profile=profile,
+            status=status,
+            barcodes=list(barcodes),
+            failed_files=list(failed_files),
+            work_dir=self.root / job_id,
+            stores=list(stores) if stores is not None else [store] * len(barcodes),
+            merged_file_name=self.merged_file_name,
+            refresh=refresh,
+        )
+        store_of = dict(zip(job.barcodes, job.stores))
+        for filename, barcode in decoded:
+            self.emit(job, "decoded", file=filename, barcode=barcode, store=store_of.get(barcode))
+        with self._lock:
+            self._jobs[job_id] = job
+        self._executor.submit(self._run, job)
+        return job
+
+    def emit(self, job: Job, event: str, **data) -> None:
+        with self._lock:
+            job.events.append(JobEvent(len(job.events) + 1, event, data))
+
+    def events(self, job: Job, after: int = 0) -> List[JobEvent]:
+        """Events of `job` with an ID above `after`."""
+        with self._lock:
+            return job.events[after:]
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def evict_expired(self) -> int:
+        """Forgets finished jobs older than `retention` and deletes their directories. Returns how many."""
+        if self.retention is None:
+            return 0
+        cutoff = time.time() - self.retention
+        with self._lock:
+            expired = [job for job in self._jobs.values() if job.finished_at is not None and job.finished_at < cutoff]
+            for job in expired:
+                del self._jobs[job.id]
+            known = set(self._jobs)
+        for job in expired:
+            shutil.rmtree(job.work_dir, ignore_errors=True)
+
+        # Left by a previous process: no job refers to them any more
+        orphans = 0
+        try:
+            for directory in self.root.iterdir():
+                if directory.is_dir() and directory.name not in known and directory.stat().st_mtime < cutoff:
+                    shutil.rmtree(directory, ignore_errors=True)
+                    orphans += 1
+        except OSError:
+            pass
+        if expired or orphans:
+            logger.info(f"Deleted {len(expired)} expired jobs and {orphans} leftover job directories")
+        return len(expired) + orphans
+
+    def finished_parts(self, job: Job) -> List[Tuple[int, Path]]:
+        """Invoices finished so far, as (position, path) in batch order."""
+        with self._lock:
+            return sorted(job.parts.items())
+
+    def record_attempt(self, job: Job, store: str, barcode: str, attempt: int, via: str) -> None:
+        self.emit(job, "attempt", barcode=barcode, store=store, attempt=attempt, via=via)
+
+    def record_failure(self, job: Job, store: str, barcode: str, error_class: str, error: str) -> None:
+        """Called by the pipeline before reporting a failed barcode, to attach its error to the failed event."""
+        with self._lock:
+            job.errors[barcode] = (error_class, error)
+
+    def record_progress(self, job: Job, index: int, barcode: str, pdf: Optional[Path]) -> None:
+        """Called by the pipeline for every finished barcode; appends its invoice to the merge."""
+        with self._lock:
+            job.processed += 1
+            processed = job.processed
+        progress = {"index": index, "barcode": barcode, "store": job.stores[index], "processed": processed,
+                    "total": len(job.barcodes)}
+        if pdf is None:
+            job.merger.skip(index)
+            with self._lock:
+                error_class, error = job.errors.pop(barcode, ("", ""))
+            self.emit(job, "failed", error_class=error_class, error=error, **progress)
+            return
+
+        # The part is what gets merged: it stays on disk until the job ends, whenever its turn comes
+        part = job.parts_dir / f"{index}.pdf"
+        try:
+            job.parts_dir.mkdir(exist_ok=True)
+            shutil.copyfile(pdf, part)
+            with self._lock:
+                job.parts[index] = part
+        except OSError as e:
+            logger.bind(job_id=job.id, barcode=barcode).warning(
+                f"Could not keep invoice for {barcode}, leaving it out of the merged PDF: {e}"
+            )
+            job.merger.skip(index)
+        else:
+            job.merger.add(index, part)
+        self.emit(job, "downloaded", **progress)
+
+    def _run(self, job: Job) -> None:
+        with trace() as spans:
+            self._execute(job)
+        JOBS_TOTAL.inc(state=job.state.value)
+
+        duration = job.finished_at - job.started_at
+        logger.bind(job_id=job.id, store=job.store, state=job.state.value, seconds=round(duration, 3)).info(
+            f"Job {job.id} {job.state.value} in {duration:.1f}s"
+        )
+        if self.slow_jobs is not None:
+            try:
+                self.slow_jobs.record(
+                    job.id, duration, spans, store=job.store, barcodes=len(job.barcodes), state=job.state.value
+                )
+            except OSError as e:
+                logger.warning(f"Could not dump slow job {job.id}: {e}")
+
+    def cancel(self, job: Job) -> None:
+        job.cancelled.set()
+
+    def _execute(self, job: Job) -> None:
+        if job.cancelled.is_set():
+            with self._lock:
+                job.state = JobState.failed
+                job.error = "Cancelled"
+                job.started_at = job.finished_at = time.time()
+            self.emit(job, "state", state=job.state.value, downloaded=0, failed_barcodes=[], error=job.error)
+            return
+        with self._lock:
+            job.state = JobState.running
+            job.started_at = time.time()
+        self.emit(job, "state", state=job.state.value)
+        try:
+            job.invoices_dir.mkdir(parents=True, exist_ok=True)
+            # Invoices are merged as they arrive (see record_progress)
+            job.merger = IncrementalMerger(job.merged_path)
+            with span("job", store=job.store):
+                result = self.pipeline(job)
+            job.merger.close()
+            shutil.rmtree(job.invoices_dir, ignore_errors=True)
+
+            with self._lock:
+                job.downloaded = list(result.get("downloaded", []))
+                job.failed_barcodes = list(result.get("failed", []))
+                if job.merged_path.exists():
+                    job.state = JobState.done
+                else:
+                    job.state = JobState.failed
+                    job.error = "No invoice could be retrieved"
+        except Exception as e:
+            logger.bind(job_id=job.id).exception(f"Job {job.id} failed: {e}")
+            with self._lock:
+                job.state = JobState.failed
+                job.error = str(e)
+        finally:
+            # Single invoices are only served while the job runs; the merged PDF holds them all
+            with self._lock:
+                job.parts.clear()
+                job.finished_at = time.time()
+            shutil.rmtree(job.parts_dir, ignore_errors=True)
+            self.emit(
+                job,
+                "state",
+                state=job.state.value,
+                downloaded=len(job.downloaded),
+                failed_barcodes=job.failed_barcodes,
+                error=job.error,
+            )
+
+    def shutdown(self) -> None:
+        with self._lock:
+            unfinished = [job for job in self._jobs.values() if job.finished_at is None]
+        # Running jobs stop at their next barcode instead of holding the process open
+        for job in unfinished:
+            job.cancelled.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
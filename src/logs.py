@@ -0,0 +1,16 @@
+import sys
+
+from loguru import logger
+
+from .config import LOG_JSON, LOG_LEVEL
+
+
+def configure_logging(json_logs: bool = LOG_JSON, level: str = LOG_LEVEL) -> None:
+    """Sends logs to stderr, one JSON object per line when `json_logs` (bound fields go to "extra")."""
+    logger.remove()
+    logger.add(
+        sys.stderr,
+        level=level,
+        serialize=json_logs,
+        format="{time:HH:mm:ss.SSS} | {level: <7} | {message} | {extra}",
+    )
@@ -1,35 +1,251 @@
 # uvicorn src.main:app --reload --host 0.0.0.0 --port 8000
 
-from enum import Enum
+import asyncio
+import itertools
 import json
-from typing import List
+from contextlib import asynccontextmanager
+from datetime import date
+from typing import List, Optional
 
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
-from fastapi.responses import HTMLResponse, FileResponse, JSONResponse
+from fastapi import FastAPI, File, UploadFile, Form, Header, HTTPException, Request
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from starlette.concurrency import run_in_threadpool
+from loguru import logger
+from pydantic import BaseModel
 
-from pyzbar.pyzbar import decode
-from PIL import Image
-import io
 from pathlib import Path
+import tempfile
 
-from .autofill_Auchan import autofill_auchan
-from .autofill_Carrefour import autofill_carrefour
-from .merge_pdf import merge_and_delete_pdfs
+from .archive import InvoiceArchive
+from .decoding import DecodeStage
+from .driver_pool import DriverPool
+from .ingest import UploadRejected, iter_receipt_images, spool_upload
+from .invoice_cache import InvoiceCache
+from .jobs import Job, JobEvent, JobManager, JobState
+from .logs import configure_logging
+from .merge_pdf import iter_pdf_chunks, merge_to_bytes
+from .metrics import CONTENT_TYPE, SlowJobRecorder, render as render_metrics, span
+from .retry_queue import RetryEntry, RetryQueue, RetryScheduler, parse_window
+from .stores import AUTO, STORES, route_barcodes, run_mixed_batch
+from .task_queue import SharedStorage, TaskQueue, open_task_queue, run_on_workers
 
-from .config import INVOICES_DIR, MERGED_DIR, MERGED_FILE_NAME, CHROME_VERSION_MAIN
-from .profiles_loader import load_profile
+from .config import JOBS_DIR, MERGED_FILE_NAME, CHROME_VERSION_MAIN, AUTOFILL_WORKERS, JOB_WORKERS, DECODE_WORKERS, SPOOL_DIR
+from .config import BROWSER_MODE, DRIVER_POOL_SIZE, INVOICES_DIR, JOB_RETENTION_HOURS, PREWARM_SESSIONS, ensure_dirs
+from .config import CACHE_DIR, CACHE_ENABLED, CACHE_MAX_AGE_DAYS, CACHE_MAX_MB
+from .config import ARCHIVE_ENABLED, ARCHIVE_MERGE_MAX
+from .config import FAST_PATH_STORES, ZIP_MAX_MEMBERS, ZIP_MAX_MEMBER_MB
+from .config import SLOW_JOBS_DIR, SLOW_JOB_SECONDS, SLOW_JOB_KEEP
+from .config import RETRY_QUEUE_DB, RETRY_QUEUE_ENABLED, RETRY_QUEUE_MAX_ATTEMPTS, RETRY_QUEUE_DELAY
+from .config import RETRY_QUEUE_INTERVAL, RETRY_QUEUE_BATCH, RETRY_QUEUE_WINDOW
+from .config import SHARED_DIR, TASK_QUEUE, TASK_QUEUE_DB, TASK_LEASE_SECONDS, TASK_MAX_DELIVERIES, TASK_QUEUE_TIMEOUT
+from .config import PROFILES_DB, PROFILES_FILE
+from .profiles_loader import JsonProfileSource, ProfileError, ProfileRegistry, SQLiteProfileSource
 
-app = FastAPI(title="Receipt → Invoice Automation")
+configure_logging()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    ensure_dirs()
+    open_stores()
+    job_manager.evict_expired()
+    if RETRY_QUEUE_ENABLED:
+        retry_scheduler.start()
+    # Before the app reports ready, so the first upload finds decoders loaded and browsers running
+    warmups = [asyncio.to_thread(decode_stage.prewarm)]
+    if browser_pool is not None and PREWARM_SESSIONS:
+        warmups.append(asyncio.to_thread(browser_pool.prewarm, PREWARM_SESSIONS))
+    await asyncio.gather(*warmups)
+    yield
+    if retry_scheduler is not None:
+        retry_scheduler.stop()
+    job_manager.shutdown()
+    decode_stage.shutdown()
+    if browser_pool is not None:
+        browser_pool.close()
+
+
+app = FastAPI(title="Receipt → Invoice Automation", lifespan=lifespan)
 BASE_DIR = Path(__file__).resolve().parent.parent
 app.mount("/static", StaticFiles(directory=str(BASE_DIR / "src" / "static")), name="static")
-PROFILES_EXAMPLE_PATH = BASE_DIR / "profiles.json"
+# /jobs/{id}/events: how often new events are looked for, and the longest silence before a keepalive
+SSE_POLL_SECONDS = 0.25
+SSE_KEEPALIVE_SECONDS = 15.0
+
+
+# Optional HTTP engines tried before the browser flow (see FAST_PATH_STORES)
+fast_path_engines = {
+    name: handler.http_engine(handler.api_url, pool_size=AUTOFILL_WORKERS * JOB_WORKERS)
+    for name, handler in STORES.items()
+    if name in FAST_PATH_STORES
+}
+
+
+shared_storage = SharedStorage(SHARED_DIR)
+
+# Opened by open_stores() at startup: their constructors create directories and SQLite databases
+profiles: Optional[ProfileRegistry] = None
+invoice_cache: Optional[InvoiceCache] = None
+task_queue: Optional[TaskQueue] = None
+browser_pool: Optional[DriverPool] = None
+retry_queue: Optional[RetryQueue] = None
+retry_scheduler: Optional[RetryScheduler] = None
+invoice_archive: Optional[InvoiceArchive] = None
+
+
+def open_stores() -> None:
+    global profiles, invoice_cache, task_queue, browser_pool, retry_queue, retry_scheduler, invoice_archive
 
+    # Parsed once, reloaded when the file (or database) changes, and checked against each store's required fields
+    profiles = ProfileRegistry(
+        SQLiteProfileSource(PROFILES_DB) if PROFILES_DB else JsonProfileSource(PROFILES_FILE),
+        requirements={name: handler.flow.required_keys for name, handler in STORES.items()},
+    )
 
-class Store(str, Enum):
-    auchan = "auchan"
-    carrefour = "carrefour"
+    # One blob store for the cache and the archive: an invoice in both is stored once
+    if CACHE_ENABLED or ARCHIVE_ENABLED:
+        blobs = InvoiceCache(CACHE_DIR, max_age_days=CACHE_MAX_AGE_DAYS, max_bytes=CACHE_MAX_MB * 1024 * 1024)
+        invoice_cache = blobs if CACHE_ENABLED else None
+        # Every retrieved invoice, kept after its job's merged PDF is gone (see /archive)
+        invoice_archive = InvoiceArchive(blobs) if ARCHIVE_ENABLED else None
+
+    # With TASK_QUEUE set, barcodes are processed by `python -m src.worker` processes (possibly on other nodes)
+    task_queue = open_task_queue(TASK_QUEUE, TASK_QUEUE_DB, lease_seconds=TASK_LEASE_SECONDS,
+                                 max_deliveries=TASK_MAX_DELIVERIES)
+
+    # Warm browsers shared by every job of this process (none when workers run the browsers)
+    if task_queue is None:
+        browser_pool = DriverPool(
+            INVOICES_DIR,
+            size=DRIVER_POOL_SIZE,
+            chrome_version_main=CHROME_VERSION_MAIN,
+            isolate_downloads=True,
+            mode=BROWSER_MODE,
+            portal_urls=[handler.flow.start_url for handler in STORES.values()],
+        )
+
+    # Barcodes that failed every attempt, retried later by the scheduler (or on request)
+    retry_queue = RetryQueue(RETRY_QUEUE_DB, max_attempts=RETRY_QUEUE_MAX_ATTEMPTS, base_delay=RETRY_QUEUE_DELAY)
+    retry_scheduler = RetryScheduler(
+        retry_queue,
+        submit_retries,
+        batch_size=RETRY_QUEUE_BATCH,
+        interval=RETRY_QUEUE_INTERVAL,
+        window=parse_window(RETRY_QUEUE_WINDOW),
+    )
+
+
+def record_progress(job: Job, index: int, barcode: str, pdf: Optional[Path]) -> None:
+    job_manager.record_progress(job, index, barcode, pdf)
+    if pdf is None:
+        return
+    if invoice_archive is not None:
+        try:
+            invoice_archive.add(pdf, store=job.stores[index], barcode=barcode, profile=job.profile, job_id=job.id)
+        except Exception as e:
+            logger.bind(job_id=job.id, barcode=barcode).warning(f"Could not archive invoice for {barcode}: {e}")
+    # Retrieved at last (retry job or new upload): nothing left to retry
+    try:
+        retry_queue.resolve(job.stores[index], job.profile, barcode)
+    except Exception as e:
+        logger.bind(job_id=job.id, barcode=barcode).warning(f"Could not update the retry queue: {e}")
+
+
+def queue_failure(job: Job, store: str, barcode: str, error_class: str, error: str) -> None:
+    try:
+        entry = retry_queue.push(store, job.profile, barcode, error_class, error)
+        logger.bind(job_id=job.id, store=store, barcode=barcode).info(
+            f"Queued {barcode} for retry ({entry.state}, {entry.attempts} failures)"
+        )
+    except Exception as e:
+        logger.bind(job_id=job.id, store=store, barcode=barcode).warning(f"Could not queue {barcode} for retry: {e}")
+
+
+def run_store_pipeline(job: Job) -> dict:
+    """Runs the automation of one job (on the workers, or here with one executor per store) into its invoices directory."""
+    def on_progress(index: int, barcode: str, pdf: Optional[Path]) -> None:
+        record_progress(job, index, barcode, pdf)
+
+    def on_failure(store: str, barcode: str, error_class: str, error: str) -> None:
+        job_manager.record_failure(job, store, barcode, error_class, error)
+        # A cancelled barcode was not tried, there is nothing to retry
+        if error_class != "Cancelled":
+            queue_failure(job, store, barcode, error_class, error)
+
+    def on_attempt(store: str, barcode: str, attempt: int, via: str) -> None:
+        job_manager.record_attempt(job, store, barcode, attempt, via)
+
+    if task_queue is not None:
+        # Browsers run on the workers; this process only merges what they store in the shared storage
+        return run_on_workers(
+            task_queue,
+            shared_storage,
+            job.id,
+            job.barcodes,
+            job.stores,
+            job.status,
+            download_dir=job.invoices_dir,
+            refresh=job.refresh,
+            on_progress=on_progress,
+            on_failure=on_failure,
+            on_attempt=on_attempt,
+            timeout=TASK_QUEUE_TIMEOUT or None,
+            cancel=job.cancelled,
+        )
+    return run_mixed_batch(
+        job.barcodes,
+        job.stores,
+        job.status,
+        download_dir=job.invoices_dir,
+        on_progress=on_progress,
+        on_failure=on_failure,
+        on_attempt=on_attempt,
+        fast_path_engines=fast_path_engines,
+        pool=browser_pool,
+        workers=AUTOFILL_WORKERS,
+        cache=invoice_cache,
+        refresh=job.refresh,
+        cancel=job.cancelled,
+    )
+
+
+job_manager = JobManager(
+    JOBS_DIR,
+    run_store_pipeline,
+    workers=JOB_WORKERS,
+    merged_file_name=MERGED_FILE_NAME,
+    slow_jobs=SlowJobRecorder(SLOW_JOBS_DIR, SLOW_JOB_SECONDS, keep=SLOW_JOB_KEEP),
+    retention=JOB_RETENTION_HOURS * 3600 or None,
+)
+decode_stage = DecodeStage(workers=DECODE_WORKERS)
+
+
+def submit_retries(entries: List[RetryEntry]) -> List[str]:
+    """Starts one job per profile for claimed retry queue entries. Returns the job IDs."""
+    by_profile: dict[str, List[RetryEntry]] = {}
+    for entry in entries:
+        by_profile.setdefault(entry.profile, []).append(entry)
+
+    job_ids = []
+    for profile, group in by_profile.items():
+        stores = [entry.store for entry in group]
+        try:
+            status = profiles.check(profile, stores)
+        except (FileNotFoundError, KeyError, ProfileError) as e:
+            # Counts as a failed retry: the entry is pushed back (and ends up dead if the profile stays missing)
+            for entry in group:
+                retry_queue.push(entry.store, profile, entry.barcode, type(e).__name__, str(e))
+            continue
+        job = job_manager.submit(
+            stores[0] if len(set(stores)) == 1 else AUTO,
+            profile,
+            status,
+            [entry.barcode for entry in group],
+            [],
+            stores=stores,
+        )
+        job_ids.append(job.id)
+    return job_ids
 
 
 @app.get("/")
@@ -40,84 +256,328 @@ def home():
 
 @app.post("/upload")
 async def upload_tickets(
-    store: Store = Form(...),
+    store: str = Form(AUTO),
     profile: str = Form(...),
-    files: List[UploadFile] = File(...)
+    files: List[UploadFile] = File(...),
+    refresh: bool = Form(False),
 ):
     if not files:
         raise HTTPException(status_code=400, detail="No files uploaded")
+    # "auto" detects the store of each barcode; a store name forces it for the whole upload
+    if store != AUTO and store not in STORES:
+        raise HTTPException(status_code=400, detail=f"Unknown store {store!r}, expected one of {[AUTO, *STORES]}")
+
+    # Profile checked before anything is decoded: for the forced store now, for detected stores once routed
+    try:
+        status = profiles.check(profile, [] if store == AUTO else [store])
+    except (FileNotFoundError, KeyError, ProfileError) as e:
+        raise HTTPException(status_code=400, detail=str(e).strip("'\""))
 
-    # 1) OCR / barcode extraction
-    barcodes: list[str] = []
+    # 1) OCR / barcode extraction, on the decode process pool (keeps upload order).
+    # Uploads are streamed to a spool directory; ZIP archives are unpacked lazily.
+    decoded: list[tuple] = []
     failed_files: list[str] = []
 
-    for file in files:
-        contents = await file.read()
+    with tempfile.TemporaryDirectory(dir=SPOOL_DIR) as spool:
+        spool_dir = Path(spool)
+        with span("spool"):
+            spooled = [(file.filename, await spool_upload(file, spool_dir, i)) for i, file in enumerate(files)]
+        images = iter_receipt_images(
+            spooled, spool_dir, max_members=ZIP_MAX_MEMBERS, max_member_bytes=ZIP_MAX_MEMBER_MB * 1024 * 1024
+        )
         try:
-            image = Image.open(io.BytesIO(contents))
-        except Exception:
-            failed_files.append(file.filename)
-            continue
+            with span("decode_batch"):
+                # Each image is deleted once decoded: an archive's members never pile up in the spool
+                results = await decode_stage.decode_stream(images, delete_decoded=True)
+        except UploadRejected as e:
+            raise HTTPException(status_code=413, detail=str(e))
 
-        codes = decode(image)
-        if not codes:
-            failed_files.append(file.filename)
-            continue
+    for result in results:
+        if result.barcode is None:
+            failed_files.append(result.filename)
+        else:
+            decoded.append((result.barcode, result.symbology))
 
-        barcode = codes[0].data.decode("utf-8", errors="ignore")
-        barcodes.append(barcode)
+    if not decoded:
+        raise HTTPException(
+            status_code=422,
+            detail={"message": "No barcodes detected", "failed_files": failed_files}
+        )
 
+    barcodes, stores, unrouted = route_barcodes(decoded, store)
     if not barcodes:
         raise HTTPException(
             status_code=422,
-            detail={"message": "No barcodes detected", "failed_files": failed_files}
+            detail={"message": "No barcode matches a known store", "unrouted_barcodes": unrouted,
+                    "failed_files": failed_files},
         )
 
-    # 2) Load user profile (no hardcoded personal data in code)
+    if store == AUTO:
+        try:
+            profiles.check(profile, sorted(set(stores)))
+        except ProfileError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    # 2) Queue automation + merge; the client polls /jobs/{job_id}
+    # refresh=true bypasses the invoice cache and fetches every invoice again
+    job = job_manager.submit(
+        store,
+        profile,
+        status,
+        barcodes,
+        failed_files,
+        stores=stores,
+        refresh=refresh,
+        decoded=[(result.filename, result.barcode) for result in results],
+    )
+
+    return JSONResponse(
+        status_code=202,
+        content={
+            "job_id": job.id,
+            "store": store,
+            "profile": profile,
+            "barcodes_found": barcodes,
+            "stores": stores,
+            "unrouted_barcodes": unrouted,
+            "failed_files": failed_files,
+            "status_url": f"/jobs/{job.id}",
+            "events_url": f"/jobs/{job.id}/events",
+            "download_url": f"/jobs/{job.id}/download",
+        },
+    )
+
+
+def _stream_pdf(path: Path) -> StreamingResponse:
+    return StreamingResponse(
+        iter_pdf_chunks(path),
+        media_type="application/pdf",
+        headers={"Content-Disposition": f'attachment; filename="{MERGED_FILE_NAME}"'},
+    )
+
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+
+@app.post("/jobs/{job_id}/cancel")
+def cancel_job(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    job_manager.cancel(job)
+    return job.to_dict()
+
+
+def _sse(event: JobEvent) -> str:
+    return f"id: {event.id}\nevent: {event.event}\ndata: {json.dumps(event.data)}\n\n"
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, request: Request, last_event_id: Optional[str] = Header(None)):
+    """
+    Server-Sent Events of a job, from its first event (or after Last-Event-ID,
+    so a reconnecting EventSource resumes where it stopped) until it finishes.
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    after = int(last_event_id) if last_event_id and last_event_id.isdigit() else 0
+
+    async def stream():
+        nonlocal after
+        seen = job_manager.events(job)[:after]
+        if seen and seen[-1].final:
+            return
+        yield "retry: 2000\n\n"
+        idle = 0.0
+        while not await request.is_disconnected():
+            events = job_manager.events(job, after)
+            for event in events:
+                yield _sse(event)
+                after = event.id
+                if event.final:
+                    return
+            idle = 0.0 if events else idle + SSE_POLL_SECONDS
+            if idle >= SSE_KEEPALIVE_SECONDS:
+                # Comment line: keeps proxies from closing an idle connection
+                yield ": keepalive\n\n"
+                idle = 0.0
+            await asyncio.sleep(SSE_POLL_SECONDS)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/jobs/{job_id}/download")
+def download_job(job_id: str, partial: bool = False):
+    # partial=true: the merged PDF as written so far (see IncrementalMerger), while the job still runs
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.state == JobState.done and job.merged_path.exists():
+        return _stream_pdf(job.merged_path)
+    if not partial or job.state != JobState.running:
+        raise HTTPException(status_code=409, detail=f"Job is {job.state.value}, merged PDF not available")
+    # Only the committed prefix: the merger keeps appending past it
+    committed = job.merger.committed_size if job.merger is not None else 0
     try:
-        status = load_profile(profile)  # expects profiles.json
-    except (FileNotFoundError, KeyError) as e:
-        raise HTTPException(status_code=400, detail=str(e))
-
-    # 3) Run automation + merge (blocking) in a threadpool
-    async def run_pipeline():
-        if store == Store.auchan:
-            autofill_auchan(barcodes=barcodes, status=status, chrome_version_main=CHROME_VERSION_MAIN)
-        else:
-            autofill_carrefour(barcodes=barcodes, status=status, chrome_version_main=CHROME_VERSION_MAIN)
+        chunks = iter_pdf_chunks(job.merged_path, limit=committed)
+        first = next(chunks)
+    except (FileNotFoundError, StopIteration):
+        raise HTTPException(status_code=409, detail=f"Job is {job.state.value}, no invoice merged yet")
+    return StreamingResponse(
+        itertools.chain([first], chunks),
+        media_type="application/pdf",
+        headers={"Content-Disposition": f'attachment; filename="partial_{MERGED_FILE_NAME}"'},
+    )
 
-        merge_and_delete_pdfs(
-            str(INVOICES_DIR),
-            str(MERGED_DIR),
-            MERGED_FILE_NAME
-        )
 
-    await run_in_threadpool(lambda: __import__("asyncio").run(run_pipeline()))
+@app.get("/jobs/{job_id}/invoices/{index}")
+def download_invoice(job_id: str, index: int):
+    # One invoice, by barcode position, as soon as it is downloaded
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.finished_at is not None:
+        # Single invoices are only kept while the job runs
+        raise HTTPException(status_code=410, detail="Job is finished, download its merged PDF")
+    path = dict(job_manager.finished_parts(job)).get(index)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"Invoice {index} is not available")
+    return FileResponse(path, media_type="application/pdf", filename=f"facture_{index + 1}.pdf")
+
+class RetryRequest(BaseModel):
+    # Entries to retry now: by ID, or every entry matching the filters
+    ids: Optional[List[int]] = None
+    store: Optional[str] = None
+    profile: Optional[str] = None
+    state: Optional[str] = None
+    limit: int = 1000
+
+
+@app.get("/retries")
+def list_retries(
+    store: Optional[str] = None,
+    profile: Optional[str] = None,
+    state: Optional[str] = None,
+    limit: int = 100,
+    offset: int = 0,
+):
+    entries = retry_queue.list(store=store, profile=profile, state=state, limit=limit, offset=offset)
+    return {"stats": retry_queue.stats(), "entries": [entry.to_dict() for entry in entries]}
+
+
+@app.post("/retries/retry")
+def retry_now(request: RetryRequest):
+    # Bulk retry, outside the off-peak window; dead entries are given another chance too
+    entries = retry_queue.claim(
+        ids=request.ids, store=request.store, profile=request.profile, state=request.state, limit=request.limit
+    )
+    job_ids = submit_retries(entries)
+    return {
+        "retried": len(entries),
+        "jobs": [{"job_id": job_id, "status_url": f"/jobs/{job_id}"} for job_id in job_ids],
+    }
+
+
+class ArchiveMergeRequest(BaseModel):
+    # Invoices to assemble: by ID, or every invoice matching the filters (most recent first)
+    ids: Optional[List[int]] = None
+    store: Optional[str] = None
+    profile: Optional[str] = None
+    barcode: Optional[str] = None
+    date_from: Optional[date] = None
+    date_to: Optional[date] = None
+    min_total: Optional[float] = None
+    max_total: Optional[float] = None
+    limit: int = ARCHIVE_MERGE_MAX
+
 
-    merged_path = MERGED_DIR / MERGED_FILE_NAME
-    if not merged_path.exists():
-        raise HTTPException(status_code=500, detail="Merged PDF not found after processing")
+def _archive() -> InvoiceArchive:
+    if invoice_archive is None:
+        raise HTTPException(status_code=404, detail="Invoice archive is disabled (ARCHIVE_ENABLED=0)")
+    return invoice_archive
+
+
+@app.get("/archive/invoices")
+def search_archive(
+    store: Optional[str] = None,
+    profile: Optional[str] = None,
+    barcode: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    min_total: Optional[float] = None,
+    max_total: Optional[float] = None,
+    limit: int = 100,
+    offset: int = 0,
+):
+    archive = _archive()
+    total, entries = archive.query(
+        store=store, profile=profile, barcode=barcode, date_from=date_from, date_to=date_to,
+        min_total=min_total, max_total=max_total, limit=limit, offset=offset,
+    )
+    return {
+        "stats": archive.stats(),
+        "matches": total,
+        "invoices": [{**entry.to_dict(), "download_url": f"/archive/invoices/{entry.id}"} for entry in entries],
+    }
+
+
+@app.get("/archive/invoices/{invoice_id}")
+def download_archived(invoice_id: int):
+    archive = _archive()
+    entry = archive.get(invoice_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Invoice not found")
+    return Response(
+        archive.read(entry),
+        media_type="application/pdf",
+        headers={"Content-Disposition": f'attachment; filename="{entry.store}_{entry.barcode}.pdf"'},
+    )
+
+
+@app.post("/archive/merge")
+def merge_archived(request: ArchiveMergeRequest):
+    # One PDF for any subset of the archive, assembled on demand
+    archive = _archive()
+    total, entries = archive.query(
+        ids=request.ids, store=request.store, profile=request.profile, barcode=request.barcode,
+        date_from=request.date_from, date_to=request.date_to, min_total=request.min_total,
+        max_total=request.max_total, limit=min(request.limit, ARCHIVE_MERGE_MAX),
+    )
+    if not entries:
+        raise HTTPException(status_code=404, detail="No archived invoice matches")
+    return Response(
+        merge_to_bytes([archive.read(entry) for entry in entries]),
+        media_type="application/pdf",
+        headers={
+            "Content-Disposition": f'attachment; filename="{MERGED_FILE_NAME}"',
+            # Fewer invoices than matches: the limit was reached
+            "X-Invoices": str(len(entries)),
+            "X-Matches": str(total),
+        },
+    )
+
+
+@app.get("/metrics")
+def metrics():
+    # Prometheus scrape endpoint: stage latencies, invoice/attempt/job counters
+    return PlainTextResponse(render_metrics(), media_type=CONTENT_TYPE)
 
-    return JSONResponse({
-        "store": store.value,
-        "profile": profile,
-        "barcodes_found": barcodes,
-        "failed_files": failed_files,
-        "merged_pdf": str(merged_path)
-    })
 
 @app.get("/profiles")
 def list_profiles():
-    if not PROFILES_EXAMPLE_PATH.exists():
-        raise HTTPException(status_code=404, detail="profiles.json not found")
-
-    data = json.loads(PROFILES_EXAMPLE_PATH.read_text(encoding="utf-8"))
-    # retourne juste les noms de profils (keys)
-    return {"profiles": list(data.keys())}
-
-@app.get("/download")
-def download_merged():
-    merged_path = MERGED_DIR / MERGED_FILE_NAME
-    if not merged_path.exists():
-        raise HTTPException(status_code=404, detail="Merged PDF not found")
-    return FileResponse(path=str(merged_path), filename=MERGED_FILE_NAME, media_type="application/pdf")
\ No newline at end of file
+    try:
+        names = profiles.names()
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    # Stores each profile has every required field for
+    return {"profiles": names, "valid_stores": {name: profiles.valid_stores(name) for name in names}}
@@ -1,35 +1,269 @@
-import PyPDF2
-import os
-
-def merge_and_delete_pdfs(source_folder, output_folder, output_filename):
-    """Merges all PDF files from a folder into a single file, saves it to a specific folder, and deletes the original files."""
-    merger = PyPDF2.PdfMerger()
-    pdf_files = [f for f in os.listdir(source_folder) if f.lower().endswith(".pdf")]
-    pdf_files.sort()
-
-    if not pdf_files:
-        print("No PDF files found in the source folder.")
-        return
-
-    for pdf in pdf_files:
-        pdf_path = os.path.join(source_folder, pdf)
-        merger.append(pdf_path)
-        print(f"Added {pdf} to the merge...")
-
-    # Create output folder if it does not exist
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
-
-    # Save the merged file
-    output_path = os.path.join(output_folder, output_filename)
-    merger.write(output_path)
-    merger.close()
-    print(f"Merging completed: {output_path}")
-
-    # Delete the original PDF files
-    for pdf in pdf_files:
-        pdf_path = os.path.join(source_folder, pdf)
-        os.remove(pdf_path)
-        print(f"Deleted: {pdf}")
-
-    print("All source PDF files have been deleted.")
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from .metrics import span
+
+
+# Object numbers of the catalog and page tree, redefined by every update of the merged file
+_CATALOG = 1
+_PAGES = 2
+# Page attributes that may be set on an ancestor in the source page tree
+_INHERITED = ("/Resources", "/MediaBox", "/CropBox", "/Rotate")
+
+
+class IncrementalMerger:
+    """
+    Builds the merged PDF while invoices are still being downloaded.
+
+    Invoices are added with their position in the batch (``add(index, path)``;
+    ``skip(index)`` for a barcode without invoice) and may arrive in any order,
+    e.g. from parallel workers: they are appended as soon as every earlier
+    position is known, and their file must stay readable until then.
+
+    The merged file is only ever appended to. When an invoice's turn comes,
+    its pages and the objects they use are copied to the end of the file, so
+    only that invoice is held in memory, whatever the size of the batch. A
+    flush then appends a PDF incremental update (page tree, catalog and a
+    cross-reference section for the new objects), after which the first
+    `committed_size` bytes are a complete document with every invoice
+    appended so far. Flushes happen at most every `min_flush_interval`
+    seconds, and invoices appended in between are flushed by a timer, so a
+    finished invoice never waits for the next one to be committed. A reader
+    streaming the committed prefix always gets a valid PDF.
+    """
+
+    def __init__(self, output_path, min_flush_interval: float = 1.0):
+        self.output_path = Path(output_path)
+        self.min_flush_interval = min_flush_interval
+        self._file = None
+        self._pending = {}  # index -> path (or None for skipped positions)
+        self._next_index = 0
+        self._pages: List[int] = []  # object numbers of the merged pages, in order
+        self._offsets: Dict[int, int] = {}  # objects written since the last flush -> file offset
+        self._next_object = _PAGES + 1
+        self._last_xref: Optional[int] = None
+        self._appended = 0
+        self._flushed = 0
+        self._committed = 0
+        self._last_flush = 0.0
+        self._timer: Optional[threading.Timer] = None
+        self._closed = False
+        self._lock = threading.Lock()
+
+    @property
+    def appended(self) -> int:
+        """Number of invoices in the committed part of the merged file."""
+        return self._flushed
+
+    @property
+    def committed_size(self) -> int:
+        """Length of the merged file's prefix that is a complete PDF (0 before the first flush)."""
+        return self._committed
+
+    def add(self, index, pdf_path) -> None:
+        with self._lock:
+            self._pending[index] = Path(pdf_path)
+            self._drain()
+
+    def skip(self, index) -> None:
+        with self._lock:
+            self._pending[index] = None
+            self._drain()
+
+    def _drain(self) -> None:
+        while self._next_index in self._pending:
+            path = self._pending.pop(self._next_index)
+            self._next_index += 1
+            if path is None:
+                continue
+            try:
+                self._append(path)
+            except Exception as e:
+                logger.warning(f"Could not merge {path.name}: {e}")
+                continue
+            self._appended += 1
+        if self._appended == self._flushed or self._closed:
+            return
+        wait = self._last_flush + self.min_flush_interval - time.monotonic()
+        if wait <= 0:
+            self._flush()
+        elif self._timer is None:
+            self._timer = threading.Timer(wait, self._flush_later)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _flush_later(self) -> None:
+        with self._lock:
+            self._timer = None
+            if not self._closed:
+                self._flush()
+
+    def _write_object(self, number: int, obj) -> None:
+        self._offsets[number] = self._file.tell()
+        self._file.write(b"%d 0 obj\n" % number)
+        obj.write_to_stream(self._file, None)
+        self._file.write(b"\nendobj\n")
+
+    def _append(self, pdf_path: Path) -> None:
+        """Copies the pages of one invoice, and every object they refer to, to the end of the merged file."""
+        import PyPDF2
+        from PyPDF2.generic import (
+            ArrayObject, DecodedStreamObject, DictionaryObject, EncodedStreamObject, IndirectObject, NameObject,
+            StreamObject,
+        )
+
+        with span("merge_parse"):
+            reader = PyPDF2.PdfReader(str(pdf_path))
+            pages = list(reader.pages)
+        if self._file is None:
+            self.output_path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = open(self.output_path, "wb")
+            self._file.write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+
+        numbers: Dict[Tuple[int, int], int] = {}  # source (idnum, generation) -> object number in the merged file
+        to_copy = []
+
+        def number_of(ref) -> int:
+            key = (ref.idnum, ref.generation)
+            if key not in numbers:
+                numbers[key] = self._next_object
+                self._next_object += 1
+                to_copy.append(ref)
+            return numbers[key]
+
+        def copy(obj):
+            if isinstance(obj, IndirectObject):
+                return IndirectObject(number_of(obj), 0, None)
+            if isinstance(obj, ArrayObject):
+                return ArrayObject(copy(item) for item in obj)
+            if isinstance(obj, StreamObject):
+                clone = DecodedStreamObject() if isinstance(obj, DecodedStreamObject) else EncodedStreamObject()
+                clone._data = obj._data
+            elif isinstance(obj, DictionaryObject):
+                clone = DictionaryObject()
+            else:
+                return obj
+            for key, value in dict.items(obj):
+                clone[key] = copy(value)
+            return clone
+
+        with span("merge_append"):
+            page_numbers = []
+            for page in pages:
+                # Numbered here rather than through number_of: pages are written below, with a new parent
+                ref = page.indirect_reference
+                numbers[(ref.idnum, ref.generation)] = self._next_object
+                page_numbers.append(self._next_object)
+                self._next_object += 1
+                clone = copy(DictionaryObject({key: value for key, value in dict.items(page) if key != "/Parent"}))
+                for key in _INHERITED:
+                    node = page
+                    while key not in node and "/Parent" in node:
+                        node = node["/Parent"]
+                    if key in node and key not in clone:
+                        clone[NameObject(key)] = copy(dict.__getitem__(node, key))
+                clone[NameObject("/Parent")] = IndirectObject(_PAGES, 0, None)
+                self._write_object(page_numbers[-1], clone)
+            while to_copy:
+                ref = to_copy.pop()
+                self._write_object(numbers[(ref.idnum, ref.generation)], copy(ref.get_object()))
+        self._pages += page_numbers
+
+    def _flush(self) -> None:
+        """Appends the update that makes everything written so far part of the document."""
+        if self._appended == self._flushed:
+            return
+        from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject, NumberObject
+
+        with span("merge_flush"):
+            self._write_object(_PAGES, DictionaryObject({
+                NameObject("/Type"): NameObject("/Pages"),
+                NameObject("/Kids"): ArrayObject(IndirectObject(number, 0, None) for number in self._pages),
+                NameObject("/Count"): NumberObject(len(self._pages)),
+            }))
+            self._write_object(_CATALOG, DictionaryObject({
+                NameObject("/Type"): NameObject("/Catalog"),
+                NameObject("/Pages"): IndirectObject(_PAGES, 0, None),
+            }))
+
+            xref = self._file.tell()
+            entries = dict(self._offsets)
+            if self._last_xref is None:
+                entries[0] = None  # head of the free list, in the first section only
+            numbers = sorted(entries)
+            lines = [b"xref\n"]
+            start = 0
+            while start < len(numbers):
+                end = start
+                while end + 1 < len(numbers) and numbers[end + 1] == numbers[end] + 1:
+                    end += 1
+                lines.append(b"%d %d\n" % (numbers[start], end - start + 1))
+                for number in numbers[start:end + 1]:
+                    offset = entries[number]
+                    lines.append(b"0000000000 65535 f\r\n" if offset is None else b"%010d 00000 n\r\n" % offset)
+                start = end + 1
+            self._file.write(b"".join(lines))
+
+            trailer = DictionaryObject({
+                NameObject("/Size"): NumberObject(self._next_object),
+                NameObject("/Root"): IndirectObject(_CATALOG, 0, None),
+            })
+            if self._last_xref is not None:
+                trailer[NameObject("/Prev")] = NumberObject(self._last_xref)
+            self._file.write(b"trailer\n")
+            trailer.write_to_stream(self._file, None)
+            self._file.write(b"\nstartxref\n%d\n%%%%EOF\n" % xref)
+            self._file.flush()
+
+        self._offsets = {}
+        self._last_xref = xref
+        self._committed = self._file.tell()
+        self._flushed = self._appended
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        """Writes what is left. Returns the merged path, or None if nothing was added."""
+        with self._lock:
+            self._closed = True
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self._flush()
+            if self._file is not None:
+                self._file.close()
+        logger.info(f"Merging completed: {self.output_path} ({self._flushed} invoices)")
+        return self.output_path if self._flushed else None
+
+
+def merge_to_bytes(pdfs) -> bytes:
+    """Merges PDFs (paths or bytes), in order, into an in-memory document (archive subsets)."""
+    import io
+
+    import PyPDF2
+
+    writer = PyPDF2.PdfWriter()
+    with span("merge_on_demand"):
+        for pdf in pdfs:
+            writer.append(io.BytesIO(pdf) if isinstance(pdf, bytes) else str(pdf))
+        buffer = io.BytesIO()
+        writer.write(buffer)
+        writer.close()
+    return buffer.getvalue()
+
+
+def iter_pdf_chunks(path, chunk_size: int = 64 * 1024, limit: Optional[int] = None):
+    """Streams a PDF from disk, or its first `limit` bytes (the committed part
+    of a merge in progress, see IncrementalMerger.committed_size)."""
+    remaining = limit
+    with open(path, "rb") as f:
+        while remaining is None or remaining > 0:
+            chunk = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
@@ -0,0 +1,235 @@
+from __future__ import annotations
+
+import bisect
+import contextvars
+import json
+import math
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from loguru import logger
+
+# Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Browser steps and downloads take seconds, decoding milliseconds: cover both
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60, 120, 300)
+
+_REGISTRY: List["_Metric"] = []
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(pairs: Sequence[Tuple[str, str]]) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in pairs) + "}"
+
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, object]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @abstractmethod
+    def _samples(self) -> List[str]:
+        """Sample lines of the metric, in exposition format."""
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [
+            f"{self.name}{_format_labels(list(zip(self.labelnames, key)))} {_format_value(value)}"
+            for key, value in items
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (not cumulative), sum, count]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            if position < len(self.buckets):
+                series[0][position] += 1
+            series[1] += value
+            series[2] += 1
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._series.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            pairs = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(pairs + [('le', _format_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(pairs + [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(pairs)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(pairs)} {count}")
+        return lines
+
+
+def render() -> str:
+    """All metrics in the Prometheus text format (served by GET /metrics)."""
+    lines: List[str] = []
+    for metric in _REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+STAGE_SECONDS = Histogram(
+    "invoice_stage_duration_seconds",
+    "Time spent in each stage of the pipeline (decode, browser start, navigation, form steps, downloads, merge...).",
+    ("stage", "store", "step"),
+)
+INVOICES_TOTAL = Counter(
+    "invoices_total",
+    "Barcodes processed, by how the invoice was obtained (cache, fast_path, browser) or failed.",
+    ("store", "source"),
+)
+ATTEMPTS_TOTAL = Counter(
+    "automation_attempts_total",
+    "Browser attempts, by outcome (ok, transient, stale, hard).",
+    ("store", "outcome"),
+)
+RECEIPTS_DECODED_TOTAL = Counter(
+    "receipts_decoded_total",
+    "Receipt images decoded, by result (found, missing).",
+    ("result",),
+)
+JOBS_TOTAL = Counter("jobs_total", "Finished jobs, by final state.", ("state",))
+
+
+# Spans recorded by the current job (see trace()), None outside of a job
+_trace: contextvars.ContextVar[Optional[List[dict]]] = contextvars.ContextVar("metrics_trace", default=None)
+
+
+def record_span(stage: str, seconds: float, *, store: str = "", step: str = "") -> None:
+    """Records a duration measured elsewhere (e.g. in a decode worker process)."""
+    STAGE_SECONDS.observe(seconds, stage=stage, store=store, step=step)
+    spans = _trace.get()
+    if spans is not None:
+        spans.append({"stage": stage, "store": store, "step": step, "seconds": round(seconds, 4)})
+    logger.bind(stage=stage, store=store, step=step, seconds=round(seconds, 4)).debug(f"{stage} took {seconds:.3f}s")
+
+
+@contextmanager
+def span(stage: str, *, store: str = "", step: str = "") -> Iterator[None]:
+    """Times the enclosed block as one `stage` (recorded even if it raises)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(stage, time.perf_counter() - start, store=store, step=step)
+
+
+@contextmanager
+def trace() -> Iterator[List[dict]]:
+    """Collects every span recorded in the enclosed block (and in threads started via in_context)."""
+    spans: List[dict] = []
+    token = _trace.set(spans)
+    try:
+        yield spans
+    finally:
+        _trace.reset(token)
+
+
+def in_context(fn: Callable) -> Callable:
+    """Wraps `fn` to run in the caller's context, so executor threads report to the current trace."""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.copy().run(fn, *args, **kwargs)
+
+
+class SlowJobRecorder:
+    """
+    Dumps the span breakdown of jobs slower than `threshold` seconds.
+
+    Each one is written to ``directory/<seconds>_<job_id>.json`` with the
+    time per stage and its slowest spans; only the `keep` slowest dumps are
+    kept. A threshold of 0 disables the recorder.
+    """
+
+    def __init__(self, directory: Path, threshold: float, keep: int = 20):
+        self.directory = Path(directory)
+        self.threshold = threshold
+        self.keep = keep
+        self._lock = threading.Lock()
+
+    def record(self, job_id: str, seconds: float, spans: List[dict], **info) -> Optional[Path]:
+        if self.threshold <= 0 or seconds < self.threshold:
+            return None
+
+        stages: Dict[str, Dict[str, float]] = {}
+        for s in spans:
+            entry = stages.setdefault(s["stage"], {"seconds": 0.0, "count": 0})
+            entry["seconds"] = round(entry["seconds"] + s["seconds"], 4)
+            entry["count"] += 1
+        payload = {
+            "job_id": job_id,
+            "seconds": round(seconds, 3),
+            **info,
+            "stages": dict(sorted(stages.items(), key=lambda kv: -kv[1]["seconds"])),
+            "slowest_spans": sorted(spans, key=lambda s: -s["seconds"])[:50],
+        }
+
+        with self._lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            # Zero-padded duration first: file names sort by job duration
+            path = self.directory / f"{seconds:010.2f}_{job_id}.json"
+            path.write_text(json.dumps(payload, indent=2), encoding="utf-8")
+            for old in sorted(self.directory.glob("*.json"), reverse=True)[self.keep:]:
+                old.unlink(missing_ok=True)
+        logger.bind(job_id=job_id, seconds=round(seconds, 3)).warning(f"Slow job profiled: {path.name}")
+        return path
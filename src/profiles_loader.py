@@ -1,11 +1,218 @@
+from __future__ import annotations
+
+import argparse
 import json
+import sqlite3
+import threading
+import time
 from pathlib import Path
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple
+
+from loguru import logger
+
+Profile = Dict[str, str]
+
+
+class ProfileError(ValueError):
+    """A profile cannot be used for a store (fields missing or malformed)."""
+
+
+class JsonProfileSource:
+    """Profiles in one JSON object keyed by profile name (profiles.json)."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+
+    def version(self) -> Tuple[int, int]:
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            raise FileNotFoundError(f"{self.path.name} not found. Create it from profiles.example.json.") from None
+        return stat.st_mtime_ns, stat.st_size
+
+    def load(self) -> Dict[str, object]:
+        return json.loads(self.path.read_text(encoding="utf-8"))
+
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS profiles (
+    name TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS profiles_revision (id INTEGER PRIMARY KEY CHECK (id = 0), revision INTEGER NOT NULL);
+INSERT OR IGNORE INTO profiles_revision VALUES (0, 0);
+CREATE TRIGGER IF NOT EXISTS profiles_insert AFTER INSERT ON profiles
+    BEGIN UPDATE profiles_revision SET revision = revision + 1; END;
+CREATE TRIGGER IF NOT EXISTS profiles_update AFTER UPDATE ON profiles
+    BEGIN UPDATE profiles_revision SET revision = revision + 1; END;
+CREATE TRIGGER IF NOT EXISTS profiles_delete AFTER DELETE ON profiles
+    BEGIN UPDATE profiles_revision SET revision = revision + 1; END;
+"""
+
+
+class SQLiteProfileSource:
+    """
+    Profiles in an SQLite table (name, JSON data), for large numbers of tenants.
+
+    Triggers bump a revision counter on every change, whoever makes it, so
+    checking for changes is one single-row read.
+    """
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SQLITE_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def version(self) -> int:
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT revision FROM profiles_revision").fetchone()[0]
+        finally:
+            conn.close()
+
+    def load(self) -> Dict[str, object]:
+        conn = self._connect()
+        try:
+            return {name: json.loads(data) for name, data in conn.execute("SELECT name, data FROM profiles")}
+        finally:
+            conn.close()
+
+    def put_many(self, profiles: Mapping[str, Profile]) -> None:
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT INTO profiles (name, data) VALUES (?, ?) "
+                    "ON CONFLICT (name) DO UPDATE SET data = excluded.data",
+                    [(name, json.dumps(data, ensure_ascii=False)) for name, data in profiles.items()],
+                )
+        finally:
+            conn.close()
+
+
+class ProfileRegistry:
+    """
+    Profiles parsed once and kept in memory, indexed by name.
+
+    The source is re-read when it changes (file mtime or database revision,
+    checked at most every `check_interval` seconds). Every profile is
+    validated at load time against `requirements` (required fields per
+    store), so a profile missing fields is rejected before any work is done.
+    A source that becomes unreadable keeps the last good profiles.
+    """
+
+    def __init__(self, source, requirements: Optional[Mapping[str, Sequence[str]]] = None,
+                 *, check_interval: float = 1.0):
+        self.source = source
+        self.requirements = {store: list(keys) for store, keys in (requirements or {}).items()}
+        self.check_interval = check_interval
+        self._profiles: Dict[str, Profile] = {}
+        # profile -> store -> missing fields (only stores the profile cannot be used for)
+        self._problems: Dict[str, Dict[str, List[str]]] = {}
+        self._version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _validate(self, data: object) -> Dict[str, List[str]]:
+        if not isinstance(data, dict):
+            return {store: ["<profile is not an object>"] for store in self.requirements}
+        problems = {}
+        for store, keys in self.requirements.items():
+            # Same rule as Flow.check_status
+            missing = [k for k in keys if not data.get(k)]
+            if missing:
+                problems[store] = missing
+        return problems
+
+    def _refresh(self) -> None:
+        now = time.monotonic()
+        if self._version is not None and now - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            if self._version is not None and now - self._checked_at < self.check_interval:
+                return
+            self._checked_at = now
+            try:
+                version = self.source.version()
+                if version == self._version:
+                    return
+                data = self.source.load()
+                if not isinstance(data, dict):
+                    raise ValueError("profiles must be an object keyed by profile name")
+            except (OSError, ValueError, sqlite3.Error) as e:
+                if self._version is None:
+                    raise
+                logger.error(f"Could not reload profiles, keeping the previous ones: {e}")
+                return
+
+            problems = {name: self._validate(profile) for name, profile in data.items()}
+            incomplete = 0
+            for name, by_store in problems.items():
+                incomplete += bool(by_store)
+                for store, missing in by_store.items():
+                    logger.debug(f"Profile {name!r} cannot be used for {store}: missing {missing}")
+            self._profiles = {name: profile for name, profile in data.items() if isinstance(profile, dict)}
+            self._problems = problems
+            self._version = version
+            logger.info(f"Loaded {len(data)} profiles ({incomplete} missing fields required by some store)")
+
+    def names(self) -> List[str]:
+        self._refresh()
+        return list(self._problems)
+
+    def get(self, name: str) -> Profile:
+        self._refresh()
+        if name not in self._problems:
+            raise KeyError(f"Profile '{name}' not found.")
+        if name not in self._profiles:
+            raise ProfileError(f"Profile '{name}' is not an object.")
+        return self._profiles[name]
+
+    def valid_stores(self, name: str) -> List[str]:
+        self._refresh()
+        problems = self._problems.get(name, {})
+        return [store for store in self.requirements if store not in problems]
+
+    def check(self, name: str, stores: Sequence[str]) -> Profile:
+        """Returns the profile, or raises ProfileError if it lacks fields one of `stores` requires."""
+        profile = self.get(name)
+        problems = {store: missing for store, missing in self._problems[name].items() if store in stores}
+        if problems:
+            details = "; ".join(f"{store}: {', '.join(missing)}" for store, missing in problems.items())
+            raise ProfileError(f"Profile '{name}' is missing required fields ({details})")
+        return profile
+
+
+_registries: Dict[str, ProfileRegistry] = {}
+_registries_lock = threading.Lock()
+
 
 def load_profile(profile_name: str, profiles_path: str = "profiles.json") -> dict:
-    path = Path(profiles_path)
-    if not path.exists():
-        raise FileNotFoundError("profiles.json not found. Create it from profiles.example.json.")
-    data = json.loads(path.read_text(encoding="utf-8"))
-    if profile_name not in data:
-        raise KeyError(f"Profile '{profile_name}' not found in profiles.json.")
-    return data[profile_name]
\ No newline at end of file
+    path = str(Path(profiles_path).resolve())
+    with _registries_lock:
+        registry = _registries.get(path)
+        if registry is None:
+            registry = _registries[path] = ProfileRegistry(JsonProfileSource(Path(path)))
+    try:
+        return registry.get(profile_name)
+    except KeyError:
+        raise KeyError(f"Profile '{profile_name}' not found in {Path(path).name}.") from None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Imports a profiles.json file into an SQLite profile store.")
+    parser.add_argument("json_file", type=Path)
+    parser.add_argument("db", type=Path)
+    args = parser.parse_args()
+
+    profiles = JsonProfileSource(args.json_file).load()
+    SQLiteProfileSource(args.db).put_many(profiles)
+    print(f"{len(profiles)} profiles imported into {args.db}")
+
+
+if __name__ == "__main__":
+    main()
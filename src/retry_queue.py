@@ -0,0 +1,298 @@
+from __future__ import annotations
+
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from loguru import logger
+
+PENDING = "pending"
+# Gave up after max_attempts: kept for inspection, only retried on request
+DEAD = "dead"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS retries (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    store       TEXT NOT NULL,
+    profile     TEXT NOT NULL,
+    barcode     TEXT NOT NULL,
+    error_class TEXT NOT NULL,
+    error       TEXT NOT NULL,
+    attempts    INTEGER NOT NULL,
+    state       TEXT NOT NULL,
+    next_retry  REAL NOT NULL,
+    created_at  REAL NOT NULL,
+    updated_at  REAL NOT NULL,
+    UNIQUE (store, profile, barcode)
+);
+CREATE INDEX IF NOT EXISTS retries_due ON retries (state, next_retry);
+"""
+
+_COLUMNS = "id, store, profile, barcode, error_class, error, attempts, state, next_retry, created_at, updated_at"
+
+
+@dataclass
+class RetryEntry:
+    id: int
+    store: str
+    profile: str
+    barcode: str
+    error_class: str
+    error: str
+    attempts: int
+    state: str
+    next_retry: float
+    created_at: float
+    updated_at: float
+
+    def to_dict(self) -> Dict[str, object]:
+        return asdict(self)
+
+
+class RetryQueue:
+    """
+    Durable queue of barcodes whose invoice could not be retrieved.
+
+    One SQLite row per (store, profile, barcode) under ``db_path``: failing
+    again bumps its attempt count and pushes its next retry back
+    (``base_delay`` doubled per attempt, capped at ``max_delay``). After
+    ``max_attempts`` failures the entry is marked dead and only retried on
+    request. Writers may live in several threads or processes (WAL, and
+    claims are taken under an immediate write lock).
+    """
+
+    def __init__(
+        self,
+        db_path: Path,
+        *,
+        max_attempts: int = 5,
+        base_delay: float = 900,
+        max_delay: float = 86400,
+        claim_timeout: float = 3600,
+    ):
+        self.db_path = Path(db_path)
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.claim_timeout = claim_timeout
+
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            # WAL lets readers run while a writer holds the lock; persistent, set once per database
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _connect(self, immediate: bool = False) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        try:
+            # Take the write lock up front when reading rows that are about to be updated
+            conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def _delay(self, attempts: int) -> float:
+        return min(self.max_delay, self.base_delay * 2 ** max(0, attempts - 1))
+
+    def push(self, store: str, profile: str, barcode: str, error_class: str, error: str = "") -> RetryEntry:
+        """Records a failure; an entry already queued for this receipt gets one more attempt counted."""
+        now = time.time()
+        with self._connect(immediate=True) as conn:
+            row = conn.execute(
+                "SELECT attempts FROM retries WHERE store = ? AND profile = ? AND barcode = ?",
+                (store, profile, barcode),
+            ).fetchone()
+            attempts = (row[0] if row else 0) + 1
+            state = DEAD if attempts >= self.max_attempts else PENDING
+            conn.execute(
+                "INSERT INTO retries (store, profile, barcode, error_class, error, attempts, state, next_retry, "
+                "created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (store, profile, barcode) DO UPDATE SET error_class = excluded.error_class, "
+                "error = excluded.error, attempts = excluded.attempts, state = excluded.state, "
+                "next_retry = excluded.next_retry, updated_at = excluded.updated_at",
+                (store, profile, barcode, error_class, error[:1000], attempts, state, now + self._delay(attempts),
+                 now, now),
+            )
+            entry = conn.execute(
+                f"SELECT {_COLUMNS} FROM retries WHERE store = ? AND profile = ? AND barcode = ?",
+                (store, profile, barcode),
+            ).fetchone()
+        return RetryEntry(*entry)
+
+    def resolve(self, store: str, profile: str, barcode: str) -> bool:
+        """Removes a receipt whose invoice was finally retrieved. Returns whether it was queued."""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "DELETE FROM retries WHERE store = ? AND profile = ? AND barcode = ?", (store, profile, barcode)
+            )
+        return cursor.rowcount > 0
+
+    def _where(
+        self, ids: Optional[Sequence[int]], store: Optional[str], profile: Optional[str], state: Optional[str]
+    ) -> Tuple[str, List[object]]:
+        clauses: List[str] = []
+        params: List[object] = []
+        if ids is not None:
+            clauses.append(f"id IN ({','.join('?' * len(ids))})" if ids else "0")
+            params += list(ids)
+        for column, value in (("store", store), ("profile", profile), ("state", state)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def list(
+        self,
+        *,
+        store: Optional[str] = None,
+        profile: Optional[str] = None,
+        state: Optional[str] = None,
+        limit: int = 100,
+        offset: int = 0,
+    ) -> List[RetryEntry]:
+        where, params = self._where(None, store, profile, state)
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT {_COLUMNS} FROM retries{where} ORDER BY next_retry LIMIT ? OFFSET ?",
+                params + [limit, offset],
+            ).fetchall()
+        return [RetryEntry(*row) for row in rows]
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Number of entries per store and state."""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT store, state, COUNT(*) FROM retries GROUP BY store, state").fetchall()
+        counts: Dict[str, Dict[str, int]] = {}
+        for store, state, count in rows:
+            counts.setdefault(store, {})[state] = count
+        return counts
+
+    def claim_due(self, limit: int) -> List[RetryEntry]:
+        """
+        Takes up to `limit` pending entries whose retry time has come.
+
+        Their next retry is pushed ``claim_timeout`` ahead, so concurrent
+        schedulers never take the same entry twice; the retry then either
+        resolves the entry or pushes it again. Entries of a crashed retry
+        become due again once the claim times out.
+        """
+        now = time.time()
+        with self._connect(immediate=True) as conn:
+            rows = conn.execute(
+                f"SELECT {_COLUMNS} FROM retries WHERE state = ? AND next_retry <= ? ORDER BY next_retry LIMIT ?",
+                (PENDING, now, limit),
+            ).fetchall()
+            self._claim(conn, [row[0] for row in rows], now)
+        return [RetryEntry(*row) for row in rows]
+
+    def claim(
+        self,
+        *,
+        ids: Optional[Sequence[int]] = None,
+        store: Optional[str] = None,
+        profile: Optional[str] = None,
+        state: Optional[str] = None,
+        limit: int = 1000,
+    ) -> List[RetryEntry]:
+        """Takes the selected entries right away, whatever their retry time and state (bulk retry)."""
+        where, params = self._where(ids, store, profile, state)
+        now = time.time()
+        with self._connect(immediate=True) as conn:
+            rows = conn.execute(
+                f"SELECT {_COLUMNS} FROM retries{where} ORDER BY next_retry LIMIT ?", params + [limit]
+            ).fetchall()
+            self._claim(conn, [row[0] for row in rows], now)
+        return [RetryEntry(*row) for row in rows]
+
+    def _claim(self, conn: sqlite3.Connection, ids: List[int], now: float) -> None:
+        conn.executemany(
+            "UPDATE retries SET state = ?, next_retry = ?, updated_at = ? WHERE id = ?",
+            [(PENDING, now + self.claim_timeout, now, entry_id) for entry_id in ids],
+        )
+
+
+def parse_window(window: str) -> Optional[Tuple[int, int]]:
+    """"22-6" -> (22, 6): hours of the off-peak window (may wrap past midnight). Empty means always."""
+    if not window.strip():
+        return None
+    start, end = (int(hour) % 24 for hour in window.split("-"))
+    return start, end
+
+
+def in_window(window: Optional[Tuple[int, int]], now: Optional[datetime] = None) -> bool:
+    if window is None:
+        return True
+    hour = (now or datetime.now()).hour
+    start, end = window
+    if start == end:
+        return True
+    if start < end:
+        return start <= hour < end
+    return hour >= start or hour < end
+
+
+class RetryScheduler:
+    """
+    Drains a RetryQueue in the background.
+
+    Every `interval` seconds, inside the off-peak `window` only, due entries
+    are claimed by batches of `batch_size` and handed to `submit`, which
+    starts their reprocessing. One batch per wake-up, so a large backlog is
+    spread over the window instead of competing with daytime uploads.
+    """
+
+    def __init__(
+        self,
+        queue: RetryQueue,
+        submit: Callable[[List[RetryEntry]], None],
+        *,
+        batch_size: int = 20,
+        interval: float = 300,
+        window: Optional[Tuple[int, int]] = None,
+    ):
+        self.queue = queue
+        self.submit = submit
+        self.batch_size = batch_size
+        self.interval = interval
+        self.window = window
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def run_once(self) -> int:
+        """Claims and submits one batch if inside the window. Returns the number of entries submitted."""
+        if not in_window(self.window):
+            return 0
+        entries = self.queue.claim_due(self.batch_size)
+        if entries:
+            logger.info(f"Retrying {len(entries)} queued barcodes")
+            self.submit(entries)
+        return len(entries)
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.exception(f"Retry scheduler run failed: {e}")
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="retry-scheduler", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
@@ -0,0 +1,287 @@
+from __future__ import annotations
+
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from .config import RETRY_BACKOFF_MAX, RETRY_BACKOFF_SECONDS
+from .downloads import DownloadTracker
+from .driver_pool import STANDARD, DriverPool
+from .fast_path import FastPathError, PortalHttpEngine
+from .flows import HARD, TRANSIENT, Checkpoint, StepError
+from .invoice_cache import InvoiceCache, copy_blob
+from .metrics import ATTEMPTS_TOTAL, INVOICES_TOTAL, in_context, span
+from loguru import logger
+
+# fill_invoice(driver, barcode, status, checkpoint) drives the portal up to the download click,
+# starting at checkpoint.step and advancing it (see flows.Flow.run)
+FillInvoice = Callable[[object, str, Dict[str, str], Checkpoint], None]
+# on_progress(index, barcode, pdf) is called from worker threads as barcodes complete;
+# pdf is the retrieved invoice (only valid during the call) or None if it failed
+ProgressCallback = Callable[[int, str, Optional[Path]], None]
+# on_failure(store, barcode, error_class, error) is called for every barcode whose attempts all failed
+FailureCallback = Callable[[str, str, str, str], None]
+# on_attempt(store, barcode, attempt, via) is called as each attempt starts; via is "fast_path" or "browser"
+AttemptCallback = Callable[[str, str, int, str], None]
+
+
+def _try_fast_path(
+    label: str, index: int, barcode: str, status: Dict[str, str], engine: PortalHttpEngine, staging_dir: Path
+) -> Optional[Path]:
+    """Fetches the invoice over plain HTTP. Returns None when the browser flow is needed."""
+    log = logger.bind(store=label.lower(), barcode=barcode)
+    try:
+        with span("fast_path", store=label.lower()):
+            staged = engine.download(barcode, status, staging_dir / f"invoice_{index}.tmp")
+        log.info(f"Fast path served barcode: {barcode}")
+        return staged
+    except (FastPathError, KeyError, OSError) as e:
+        log.warning(f"Fast path failed for {barcode}, using browser: {e}")
+        return None
+
+
+def error_class(exc: BaseException) -> str:
+    """Name of the exception behind a failure (StepError wraps the driver's)."""
+    return type(exc.__cause__ if isinstance(exc, StepError) and exc.__cause__ else exc).__name__
+
+
+def _backoff(retry: int) -> float:
+    """Delay before the n-th retry: exponential, capped."""
+    return min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_SECONDS * 2 ** (retry - 1))
+
+
+def _attempt(session, store: str, barcode: str, status: Dict[str, str], fill_invoice: FillInvoice,
+             checkpoint: Checkpoint, staging_dir: Path, index: int) -> Path:
+    """Runs the flow from the checkpoint and waits for its download. Failures are raised as StepError."""
+    with DownloadTracker(session.download_dir) as tracker:
+        fill_invoice(session.driver, barcode, status, checkpoint)
+
+        # Armed before the download click: returns the file this attempt produced
+        try:
+            with span("download_wait", store=store):
+                latest_file = tracker.wait(timeout=40)
+        except RuntimeError as e:
+            # Clicking the download again is enough, no need to refill the form
+            checkpoint.rewind()
+            raise StepError(str(e), checkpoint.step, TRANSIENT) from e
+
+    # Move it out of the session directory before the session is released
+    staged = staging_dir / f"invoice_{index}.tmp"
+    shutil.move(str(latest_file), str(staged))
+    return staged
+
+
+def _process_barcode(
+    label: str,
+    index: int,
+    barcode: str,
+    status: Dict[str, str],
+    fill_invoice: FillInvoice,
+    start_url: str,
+    pool: DriverPool,
+    staging_dir: Path,
+    max_attempts: int,
+    on_attempt: Optional[AttemptCallback] = None,
+) -> Path:
+    """
+    Runs every attempt for one barcode. Returns the staged PDF, or raises the last error.
+
+    Attempts resume where the previous one stopped, in the same live session,
+    when it failed on a timeout (after a backoff) or a stale element (right
+    away), but only once per step: failing again from the same step means the
+    page is stuck, so like hard failures it releases the session and restarts
+    from the start page.
+    """
+    store = label.lower()
+    log = logger.bind(store=store, barcode=barcode)
+    checkpoint = Checkpoint()
+    attempt = 0
+    last_error: Optional[Exception] = None
+    while attempt < max_attempts:
+        leased_at = attempt
+        try:
+            # Warm session, already on the start page with cookies cleared
+            with pool.lease(start_url) as session:
+                checkpoint.reset()
+                resumed_from = set()  # steps already resumed from in this session
+                while True:
+                    attempt += 1
+                    resuming = f" (resuming at step {checkpoint.step + 1}/{checkpoint.total})" if checkpoint.step else ""
+                    log.info(f"Attempt {attempt}/{max_attempts} for barcode: {barcode}{resuming}")
+                    if on_attempt is not None:
+                        on_attempt(store, barcode, attempt, "browser")
+                    try:
+                        staged = _attempt(session, store, barcode, status, fill_invoice, checkpoint, staging_dir, index)
+                        ATTEMPTS_TOTAL.inc(store=store, outcome="ok")
+                        return staged
+                    except StepError as e:
+                        ATTEMPTS_TOTAL.inc(store=store, outcome=e.kind)
+                        if e.kind == HARD or attempt >= max_attempts or checkpoint.step in resumed_from:
+                            raise
+                        resumed_from.add(checkpoint.step)
+                        log.warning(f"Error attempt {attempt} for {barcode} ({e.kind}): {e}")
+                        if e.kind == TRANSIENT:
+                            time.sleep(_backoff(attempt))
+
+        except Exception as e:
+            last_error = e
+            if attempt == leased_at:
+                # The session itself could not be leased: that counts as an attempt too
+                attempt += 1
+                ATTEMPTS_TOTAL.inc(store=store, outcome=HARD)
+                if on_attempt is not None:
+                    on_attempt(store, barcode, attempt, "browser")
+            log.warning(f"Error attempt {attempt} for {barcode}: {e}")
+            if attempt < max_attempts:
+                time.sleep(_backoff(attempt))
+
+    raise last_error
+
+
+def run_barcodes(
+    label: str,
+    barcodes: List[str],
+    status: Dict[str, str],
+    fill_invoice: FillInvoice,
+    start_url: str,
+    *,
+    download_dir: Path,
+    max_attempts: int = 3,
+    workers: int = 1,
+    chrome_version_main: Optional[int] = None,
+    headless: bool = False,
+    mode: str = STANDARD,
+    pool: Optional[DriverPool] = None,
+    on_progress: Optional[ProgressCallback] = None,
+    on_failure: Optional[FailureCallback] = None,
+    on_attempt: Optional[AttemptCallback] = None,
+    cache: Optional[InvoiceCache] = None,
+    refresh: bool = False,
+    fast_path: Optional[PortalHttpEngine] = None,
+    cancel: Optional[threading.Event] = None,
+) -> Dict[str, object]:
+    """
+    Retrieves one invoice per barcode, with up to `workers` browsers in parallel.
+
+    Each worker leases its own browser session and downloads into its own
+    subdirectory. Results are collected back in barcode order, so invoices are
+    saved as download_dir/facture_{n}.pdf in the order of `barcodes` whatever
+    the completion order was.
+
+    With a `cache`, barcodes already fetched for this store and profile are
+    copied from it without starting a browser, and every new download is added
+    to it. `refresh=True` ignores cached entries (they are replaced on success).
+
+    With a `fast_path` engine, each remaining barcode is first requested over
+    plain HTTP; the browser flow only runs for the ones it could not serve.
+    Browsers are started lazily, so a fully served batch never launches Chrome.
+    `mode` selects the browser profile of the sessions started here (see DriverPool).
+    Barcodes that fail every attempt are reported to `on_failure` with the
+    class of their last error (e.g. to queue them for a later retry), and
+    `on_attempt` is told of every fast path request and browser attempt.
+    Once `cancel` is set, the barcodes not started yet fail as "Cancelled".
+
+    Returns
+    -------
+    dict with:
+        - downloaded: list of saved pdf paths
+        - failed: list of barcodes that failed
+    """
+    download_dir.mkdir(parents=True, exist_ok=True)
+    store = label.lower()
+
+    # Cache hits go straight to staging; only misses need a browser
+    staged: List[Optional[Path]] = [None] * len(barcodes)
+    to_fetch: List[int] = []
+    for index, barcode in enumerate(barcodes):
+        cached = cache.get(store, barcode, status) if cache is not None and not refresh else None
+        if cached is None:
+            to_fetch.append(index)
+            continue
+        staged[index] = download_dir / f"invoice_{index}.tmp"
+        copy_blob(cached, staged[index])
+        INVOICES_TOTAL.inc(store=store, source="cache")
+        logger.bind(store=store, barcode=barcode).info(f"Cache hit for barcode: {barcode}")
+        if on_progress is not None:
+            on_progress(index, barcode, staged[index])
+
+    workers = max(1, min(workers, len(to_fetch) or 1))
+
+    own_pool = pool is None and bool(to_fetch)
+    if own_pool:
+        pool = DriverPool(
+            download_dir,
+            size=workers,
+            chrome_version_main=chrome_version_main,
+            headless=headless,
+            isolate_downloads=True,
+            mode=mode,
+        )
+
+    def task(index: int, barcode: str) -> Optional[Path]:
+        if cancel is not None and cancel.is_set():
+            if on_failure is not None:
+                on_failure(store, barcode, "Cancelled", "Job cancelled")
+            if on_progress is not None:
+                on_progress(index, barcode, None)
+            return None
+        staged_file = None
+        with span("barcode", store=store):
+            if fast_path is not None:
+                if on_attempt is not None:
+                    on_attempt(store, barcode, 1, "fast_path")
+                staged_file = _try_fast_path(label, index, barcode, status, fast_path, download_dir)
+            source = "fast_path" if staged_file is not None else "browser"
+            if staged_file is None:
+                try:
+                    staged_file = _process_barcode(
+                        label, index, barcode, status, fill_invoice, start_url, pool, download_dir, max_attempts,
+                        on_attempt,
+                    )
+                except Exception as e:
+                    logger.bind(store=store, barcode=barcode).error(f"Giving up on barcode {barcode}: {e}")
+                    if on_failure is not None:
+                        on_failure(store, barcode, error_class(e), str(e))
+        INVOICES_TOTAL.inc(store=store, source=source if staged_file is not None else "failed")
+        if staged_file is not None and cache is not None:
+            try:
+                cache.put(store, barcode, status, staged_file)
+            except Exception as e:
+                logger.bind(store=store, barcode=barcode).warning(f"Could not cache invoice for {barcode}: {e}")
+        if on_progress is not None:
+            on_progress(index, barcode, staged_file)
+        return staged_file
+
+    try:
+        if workers == 1:
+            fetched = [task(i, barcodes[i]) for i in to_fetch]
+        else:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{store}-worker") as executor:
+                # in_context: worker threads report their spans to the caller's job trace
+                fetched = list(executor.map(in_context(task), to_fetch, [barcodes[i] for i in to_fetch]))
+        for index, staged_file in zip(to_fetch, fetched):
+            staged[index] = staged_file
+    finally:
+        if own_pool:
+            pool.close()
+
+    downloaded_files: List[str] = []
+    failed: List[str] = []
+
+    facture_count = 1
+    for barcode, staged_file in zip(barcodes, staged):
+        if staged_file is None:
+            failed.append(barcode)
+            continue
+
+        new_name = download_dir / f"facture_{facture_count}.pdf"
+        shutil.move(str(staged_file), str(new_name))
+
+        logger.bind(store=store, barcode=barcode).info(f"Saved invoice: {new_name.name}")
+        downloaded_files.append(str(new_name))
+        facture_count += 1
+
+    return {"downloaded": downloaded_files, "failed": failed}
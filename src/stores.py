@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import re
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Set, Tuple, Type
+
+from loguru import logger
+
+from .autofill_Auchan import AUCHAN_FLOW, autofill_auchan
+from .autofill_Carrefour import CARREFOUR_FLOW, autofill_carrefour
+from .config import AUCHAN_API_URL, CARREFOUR_API_URL
+from .fast_path import AuchanHttpEngine, CarrefourHttpEngine, PortalHttpEngine
+from .flows import Flow
+from .metrics import in_context
+from .runner import FailureCallback, ProgressCallback
+
+# Store value asking for per-barcode detection instead of one store for the batch
+AUTO = "auto"
+
+
+@dataclass(frozen=True)
+class StoreHandler:
+    """
+    Everything the pipeline needs to know about one store.
+
+    Barcodes are attributed to a store when their symbology (if the decoder
+    reported one) is in `symbologies` and their text matches `barcode_pattern`.
+    """
+
+    name: str
+    autofill: Callable[..., Dict[str, object]]
+    flow: Flow
+    http_engine: Type[PortalHttpEngine]
+    api_url: str
+    symbologies: Tuple[str, ...]
+    barcode_pattern: str
+
+    def matches(self, barcode: str, symbology: Optional[str] = None) -> bool:
+        if symbology and symbology not in self.symbologies:
+            return False
+        return re.fullmatch(self.barcode_pattern, barcode) is not None
+
+
+STORES: Dict[str, StoreHandler] = {}
+
+
+def register(handler: StoreHandler) -> StoreHandler:
+    STORES[handler.name] = handler
+    return handler
+
+
+# Auchan receipts carry a long Interleaved 2 of 5 code, Carrefour receipts an EAN-13
+register(StoreHandler(
+    name="auchan",
+    autofill=autofill_auchan,
+    flow=AUCHAN_FLOW,
+    http_engine=AuchanHttpEngine,
+    api_url=AUCHAN_API_URL,
+    symbologies=("I25", "CODE128"),
+    barcode_pattern=r"\d{16,32}",
+))
+register(StoreHandler(
+    name="carrefour",
+    autofill=autofill_carrefour,
+    flow=CARREFOUR_FLOW,
+    http_engine=CarrefourHttpEngine,
+    api_url=CARREFOUR_API_URL,
+    symbologies=("EAN13", "CODE128"),
+    barcode_pattern=r"\d{13}",
+))
+
+
+def detect_store(barcode: str, symbology: Optional[str] = None) -> Optional[str]:
+    """Name of the only store whose barcode format matches, or None (unknown or ambiguous)."""
+    matches = [h.name for h in STORES.values() if h.matches(barcode, symbology)]
+    return matches[0] if len(matches) == 1 else None
+
+
+def route_barcodes(
+    decoded: Sequence[Tuple[str, Optional[str]]], override: str = AUTO
+) -> Tuple[List[str], List[str], List[str]]:
+    """
+    Attributes each (barcode, symbology) to a store.
+
+    With an `override` store every barcode goes to it; with AUTO each one is
+    detected from its format. Returns (barcodes, stores, unrouted barcodes).
+    """
+    barcodes: List[str] = []
+    stores: List[str] = []
+    unrouted: List[str] = []
+    for barcode, symbology in decoded:
+        store = override if override != AUTO else detect_store(barcode, symbology)
+        if store is None:
+            unrouted.append(barcode)
+            continue
+        barcodes.append(barcode)
+        stores.append(store)
+    return barcodes, stores, unrouted
+
+
+def run_mixed_batch(
+    barcodes: List[str],
+    stores: List[str],
+    status: Dict[str, str],
+    *,
+    download_dir: Path,
+    on_progress: Optional[ProgressCallback] = None,
+    on_failure: Optional[FailureCallback] = None,
+    fast_path_engines: Optional[Dict[str, PortalHttpEngine]] = None,
+    **autofill_options,
+) -> Dict[str, object]:
+    """
+    Runs the barcodes of each store on its own executor, all stores at the same time.
+
+    `stores[i]` is the store of `barcodes[i]`. Each store downloads into
+    ``download_dir/<store>``; indices passed to `on_progress` are positions in
+    `barcodes`, so one merge can follow the whole batch. A store that fails as
+    a whole (e.g. its required profile fields are missing) only fails its own
+    barcodes, which are reported to `on_failure` like any other failure.
+    """
+    groups: Dict[str, List[int]] = {}
+    for index, store in enumerate(stores):
+        groups.setdefault(store, []).append(index)
+
+    def run_group(store: str, indices: List[int]) -> Dict[str, object]:
+        reported: Set[int] = set()
+
+        def progress(local_index: int, barcode: str, pdf: Optional[Path]) -> None:
+            reported.add(indices[local_index])
+            if on_progress is not None:
+                on_progress(indices[local_index], barcode, pdf)
+
+        try:
+            return STORES[store].autofill(
+                [barcodes[i] for i in indices],
+                status,
+                download_dir=download_dir / store,
+                on_progress=progress,
+                on_failure=on_failure,
+                fast_path=(fast_path_engines or {}).get(store),
+                **autofill_options,
+            )
+        except Exception as e:
+            logger.bind(store=store).exception(f"{store} batch failed: {e}")
+            # Unreported barcodes still have to be accounted for (the merge waits for every position)
+            for i in indices:
+                if i in reported:
+                    continue
+                if on_failure is not None:
+                    on_failure(store, barcodes[i], type(e).__name__, str(e))
+                if on_progress is not None:
+                    on_progress(i, barcodes[i], None)
+            return {"downloaded": [], "failed": [barcodes[i] for i in indices if i not in reported]}
+
+    if len(groups) == 1:
+        results = [run_group(*next(iter(groups.items())))]
+    else:
+        with ThreadPoolExecutor(max_workers=len(groups), thread_name_prefix="store") as executor:
+            results = list(executor.map(in_context(run_group), groups.keys(), groups.values()))
+
+    return {
+        "downloaded": [path for result in results for path in result["downloaded"]],
+        "failed": [barcode for result in results for barcode in result["failed"]],
+    }
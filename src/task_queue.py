@@ -0,0 +1,391 @@
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence
+
+from loguru import logger
+
+from .runner import AttemptCallback, FailureCallback, ProgressCallback
+
+QUEUED = "queued"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id            INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id        TEXT NOT NULL,
+    position      INTEGER NOT NULL,
+    store         TEXT NOT NULL,
+    barcode       TEXT NOT NULL,
+    status        TEXT NOT NULL,
+    refresh       INTEGER NOT NULL,
+    state         TEXT NOT NULL,
+    worker        TEXT,
+    lease_expires REAL,
+    deliveries    INTEGER NOT NULL DEFAULT 0,
+    result        TEXT,
+    error_class   TEXT,
+    error         TEXT,
+    created_at    REAL NOT NULL,
+    updated_at    REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tasks_job ON tasks (job_id, position);
+CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, lease_expires);
+"""
+
+_COLUMNS = (
+    "id, job_id, position, store, barcode, status, refresh, state, worker, lease_expires, deliveries, "
+    "result, error_class, error"
+)
+
+
+@dataclass
+class Task:
+    """One barcode of a job, processed by whichever worker leases it."""
+
+    id: int
+    job_id: str
+    position: int  # index of the barcode in its job
+    store: str
+    barcode: str
+    status: Dict[str, str]  # profile data, so workers need no profiles.json
+    refresh: bool
+    state: str
+    worker: Optional[str] = None
+    lease_expires: Optional[float] = None
+    deliveries: int = 0
+    result: Optional[str] = None  # PDF path, relative to the shared storage
+    error_class: Optional[str] = None
+    error: Optional[str] = None
+
+    @classmethod
+    def from_row(cls, row) -> "Task":
+        values = list(row)
+        values[5] = json.loads(values[5])
+        values[6] = bool(values[6])
+        return cls(*values)
+
+
+class TaskQueue(ABC):
+    """
+    Queue of per-barcode tasks shared by the API and the workers (src/worker.py).
+
+    A worker leases tasks for ``lease_seconds`` and renews the lease with
+    heartbeats while it works on them. A task whose lease expires (its worker
+    died or hung) is queued again, up to ``max_deliveries`` times, then
+    failed. Only the worker holding the lease can complete or fail a task.
+
+    Implemented by SQLiteTaskQueue; another backend (e.g. a database server
+    shared by several nodes) implements these methods.
+    """
+
+    @abstractmethod
+    def enqueue(self, job_id: str, barcodes: Sequence[str], stores: Sequence[str], status: Dict[str, str],
+                *, refresh: bool = False) -> None:
+        """Queues one task per barcode; `stores[i]` is the store of `barcodes[i]`."""
+
+    @abstractmethod
+    def lease(self, worker: str, limit: int = 1, stores: Optional[Sequence[str]] = None) -> List[Task]:
+        """Leases up to `limit` queued tasks (of `stores` only, if given), oldest first."""
+
+    @abstractmethod
+    def heartbeat(self, worker: str, task_ids: Sequence[int]) -> List[int]:
+        """Extends the leases still held by `worker`. Returns the IDs it still holds."""
+
+    @abstractmethod
+    def complete(self, task_id: int, worker: str, result: str) -> bool:
+        """Marks a task done. Returns False if `worker` no longer holds its lease."""
+
+    @abstractmethod
+    def fail(self, task_id: int, worker: str, error_class: str, error: str) -> bool:
+        """Marks a task failed. Returns False if `worker` no longer holds its lease."""
+
+    @abstractmethod
+    def job_tasks(self, job_id: str) -> List[Task]:
+        """The tasks of a job, in barcode order."""
+
+    @abstractmethod
+    def requeue_expired(self) -> int:
+        """Queues again (or fails) the tasks of workers that stopped sending heartbeats."""
+
+    @abstractmethod
+    def cancel_job(self, job_id: str, error_class: str, error: str) -> int:
+        """Fails every unfinished task of a job (leased ones too: their worker can no longer complete them)."""
+
+    @abstractmethod
+    def delete_job(self, job_id: str) -> None:
+        """Removes a finished job's tasks."""
+
+
+class SQLiteTaskQueue(TaskQueue):
+    """
+    TaskQueue in an SQLite database (WAL, leases taken under BEGIN IMMEDIATE).
+
+    Safe for any number of processes on one host, or on several hosts
+    sharing a filesystem with working file locks. Meant for local runs and
+    tests; a larger deployment would plug a server-backed TaskQueue instead.
+    """
+
+    def __init__(self, db_path: Path, *, lease_seconds: float = 120, max_deliveries: int = 3):
+        self.db_path = Path(db_path)
+        self.lease_seconds = lease_seconds
+        self.max_deliveries = max_deliveries
+
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _connect(self, immediate: bool = False) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        try:
+            conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def enqueue(self, job_id: str, barcodes: Sequence[str], stores: Sequence[str], status: Dict[str, str],
+                *, refresh: bool = False) -> None:
+        now = time.time()
+        payload = json.dumps(status, ensure_ascii=False)
+        with self._connect(immediate=True) as conn:
+            conn.executemany(
+                "INSERT INTO tasks (job_id, position, store, barcode, status, refresh, state, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(job_id, i, store, barcode, payload, int(refresh), QUEUED, now, now)
+                 for i, (barcode, store) in enumerate(zip(barcodes, stores))],
+            )
+
+    def _requeue_expired(self, conn: sqlite3.Connection, now: float) -> int:
+        conn.execute(
+            "UPDATE tasks SET state = ?, worker = NULL, error_class = 'WorkerLost', "
+            "error = 'Lease expired on every delivery', updated_at = ? "
+            "WHERE state = ? AND lease_expires < ? AND deliveries >= ?",
+            (FAILED, now, LEASED, now, self.max_deliveries),
+        )
+        cursor = conn.execute(
+            "UPDATE tasks SET state = ?, worker = NULL, updated_at = ? WHERE state = ? AND lease_expires < ?",
+            (QUEUED, now, LEASED, now),
+        )
+        return cursor.rowcount
+
+    def requeue_expired(self) -> int:
+        with self._connect(immediate=True) as conn:
+            return self._requeue_expired(conn, time.time())
+
+    def lease(self, worker: str, limit: int = 1, stores: Optional[Sequence[str]] = None) -> List[Task]:
+        now = time.time()
+        query = f"SELECT {_COLUMNS} FROM tasks WHERE state = ?"
+        params: List[object] = [QUEUED]
+        if stores:
+            query += f" AND store IN ({','.join('?' * len(stores))})"
+            params += list(stores)
+        # Oldest jobs first, barcodes of a job in order: invoices reach the merge in sequence
+        query += " ORDER BY id LIMIT ?"
+        params.append(limit)
+
+        with self._connect(immediate=True) as conn:
+            self._requeue_expired(conn, now)
+            tasks = [Task.from_row(row) for row in conn.execute(query, params).fetchall()]
+            conn.executemany(
+                "UPDATE tasks SET state = ?, worker = ?, lease_expires = ?, deliveries = deliveries + 1, "
+                "updated_at = ? WHERE id = ?",
+                [(LEASED, worker, now + self.lease_seconds, now, task.id) for task in tasks],
+            )
+        for task in tasks:
+            task.state, task.worker, task.deliveries = LEASED, worker, task.deliveries + 1
+        return tasks
+
+    def heartbeat(self, worker: str, task_ids: Sequence[int]) -> List[int]:
+        if not task_ids:
+            return []
+        now = time.time()
+        marks = ",".join("?" * len(task_ids))
+        with self._connect(immediate=True) as conn:
+            conn.execute(
+                f"UPDATE tasks SET lease_expires = ?, updated_at = ? "
+                f"WHERE state = ? AND worker = ? AND id IN ({marks})",
+                [now + self.lease_seconds, now, LEASED, worker, *task_ids],
+            )
+            held = conn.execute(
+                f"SELECT id FROM tasks WHERE state = ? AND worker = ? AND id IN ({marks})",
+                [LEASED, worker, *task_ids],
+            ).fetchall()
+        return [task_id for (task_id,) in held]
+
+    def _finish(self, task_id: int, worker: str, state: str, result: Optional[str],
+                error_class: Optional[str], error: Optional[str]) -> bool:
+        with self._connect(immediate=True) as conn:
+            cursor = conn.execute(
+                "UPDATE tasks SET state = ?, result = ?, error_class = ?, error = ?, lease_expires = NULL, "
+                "updated_at = ? WHERE id = ? AND state = ? AND worker = ?",
+                (state, result, error_class, error, time.time(), task_id, LEASED, worker),
+            )
+        return cursor.rowcount > 0
+
+    def complete(self, task_id: int, worker: str, result: str) -> bool:
+        return self._finish(task_id, worker, DONE, result, None, None)
+
+    def fail(self, task_id: int, worker: str, error_class: str, error: str) -> bool:
+        return self._finish(task_id, worker, FAILED, None, error_class, error[:1000])
+
+    def job_tasks(self, job_id: str) -> List[Task]:
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT {_COLUMNS} FROM tasks WHERE job_id = ? ORDER BY position", (job_id,)
+            ).fetchall()
+        return [Task.from_row(row) for row in rows]
+
+    def cancel_job(self, job_id: str, error_class: str, error: str) -> int:
+        with self._connect(immediate=True) as conn:
+            cursor = conn.execute(
+                "UPDATE tasks SET state = ?, worker = NULL, lease_expires = NULL, error_class = ?, error = ?, "
+                "updated_at = ? WHERE job_id = ? AND state IN (?, ?)",
+                (FAILED, error_class, error[:1000], time.time(), job_id, QUEUED, LEASED),
+            )
+        return cursor.rowcount
+
+    def delete_job(self, job_id: str) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM tasks WHERE job_id = ?", (job_id,))
+
+
+def open_task_queue(backend: str, db_path: Path, **options) -> Optional[TaskQueue]:
+    """TaskQueue for a TASK_QUEUE setting; None ("" or "local") runs every job inside the API process."""
+    if backend in ("", "local"):
+        return None
+    if backend == "sqlite":
+        return SQLiteTaskQueue(db_path, **options)
+    raise ValueError(f"Unknown TASK_QUEUE backend: {backend!r}")
+
+
+class SharedStorage:
+    """
+    Directory shared by the API and the workers (a volume mounted on every node).
+
+    Workers store the invoice of each task under ``results/<job_id>/``; the
+    queue only carries paths relative to the root, so nodes may mount it
+    anywhere.
+    """
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+
+    def put_result(self, task: Task, pdf: Path) -> str:
+        relative = f"results/{task.job_id}/{task.position}.pdf"
+        target = self.root / relative
+        target.parent.mkdir(parents=True, exist_ok=True)
+        # Written next to the target then renamed: readers never see a partial file
+        tmp = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+        shutil.copyfile(pdf, tmp)
+        tmp.replace(target)
+        return relative
+
+    def path(self, relative: str) -> Path:
+        return self.root / relative
+
+    def delete_job(self, job_id: str) -> None:
+        shutil.rmtree(self.root / "results" / job_id, ignore_errors=True)
+
+
+def run_on_workers(
+    queue: TaskQueue,
+    storage: SharedStorage,
+    job_id: str,
+    barcodes: List[str],
+    stores: List[str],
+    status: Dict[str, str],
+    *,
+    download_dir: Path,
+    refresh: bool = False,
+    on_progress: Optional[ProgressCallback] = None,
+    on_failure: Optional[FailureCallback] = None,
+    on_attempt: Optional[AttemptCallback] = None,
+    timeout: Optional[float] = None,
+    cancel: Optional[threading.Event] = None,
+    poll_interval: float = 0.5,
+) -> Dict[str, object]:
+    """
+    Runs a job's barcodes on the workers and waits for them.
+
+    Same contract as run_mixed_batch: `on_progress` receives each barcode as
+    its task finishes, with its upload position, and invoices are saved as
+    download_dir/facture_{n}.pdf in barcode order. Each delivery of a task to
+    a worker is reported to `on_attempt`, with the worker's ID as `via`.
+
+    Tasks still unfinished `timeout` seconds after they were queued (no
+    worker took them, or their worker is stuck) fail as "WorkerTimeout";
+    setting `cancel` fails them as "Cancelled". Either way the job ends with
+    the invoices retrieved so far.
+    """
+    download_dir.mkdir(parents=True, exist_ok=True)
+    queue.enqueue(job_id, barcodes, stores, status, refresh=refresh)
+    log = logger.bind(job_id=job_id)
+    log.info(f"Queued {len(barcodes)} tasks for the workers")
+
+    staged: Dict[int, Path] = {}
+    reported = set()
+    deliveries: Dict[int, int] = {}
+    deadline = time.monotonic() + timeout if timeout else None
+    cancel = cancel or threading.Event()
+    try:
+        while len(reported) < len(barcodes):
+            if cancel.wait(poll_interval):
+                failed_now = queue.cancel_job(job_id, "Cancelled", "Job cancelled")
+                log.info(f"Job cancelled, {failed_now} tasks dropped")
+            if deadline is not None and time.monotonic() >= deadline:
+                failed_now = queue.cancel_job(job_id, "WorkerTimeout", f"Not finished by a worker within {timeout:g}s")
+                if failed_now:
+                    log.warning(f"{failed_now} tasks not finished by a worker within {timeout:g}s")
+            queue.requeue_expired()
+            for task in queue.job_tasks(job_id):
+                if task.state == LEASED and task.deliveries > deliveries.get(task.position, 0):
+                    deliveries[task.position] = task.deliveries
+                    if on_attempt is not None:
+                        on_attempt(task.store, task.barcode, task.deliveries, task.worker or "")
+                if task.position in reported or task.state not in (DONE, FAILED):
+                    continue
+                reported.add(task.position)
+                pdf = None
+                if task.state == DONE:
+                    pdf = download_dir / f"invoice_{task.position}.tmp"
+                    shutil.move(str(storage.path(task.result)), str(pdf))
+                    staged[task.position] = pdf
+                elif on_failure is not None:
+                    on_failure(task.store, task.barcode, task.error_class or "", task.error or "")
+                if on_progress is not None:
+                    on_progress(task.position, task.barcode, pdf)
+    finally:
+        queue.delete_job(job_id)
+        storage.delete_job(job_id)
+
+    downloaded: List[str] = []
+    failed: List[str] = []
+    for position, barcode in enumerate(barcodes):
+        if position not in staged:
+            failed.append(barcode)
+            continue
+        saved = download_dir / f"facture_{len(downloaded) + 1}.pdf"
+        shutil.move(str(staged[position]), str(saved))
+        downloaded.append(str(saved))
+    return {"downloaded": downloaded, "failed": failed}
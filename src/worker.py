@@ -0,0 +1,224 @@
+"""
+Browser worker: pulls per-barcode tasks from the shared task queue.
+
+    TASK_QUEUE=sqlite python -m src.worker --concurrency 2
+
+Start as many as needed, on any node that sees the same TASK_QUEUE_DB and
+SHARED_DIR as the API. Each worker keeps warm browsers (one per concurrent
+task), renews the leases of its tasks while it works on them, and stores
+every invoice in the shared storage for the API to merge. SIGINT/SIGTERM
+stop leasing and let the tasks in progress finish.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import signal
+import socket
+import tempfile
+import threading
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+from .config import BROWSER_MODE, CHROME_VERSION_MAIN, FAST_PATH_STORES
+from .config import CACHE_DIR, CACHE_ENABLED, CACHE_MAX_AGE_DAYS, CACHE_MAX_MB
+from .config import SHARED_DIR, TASK_LEASE_SECONDS, TASK_MAX_DELIVERIES, TASK_QUEUE, TASK_QUEUE_DB
+from .config import PREWARM_SESSIONS, WORKER_CONCURRENCY, ensure_dirs
+from .driver_pool import DriverPool
+from .fast_path import PortalHttpEngine
+from .invoice_cache import InvoiceCache
+from .logs import configure_logging
+from .stores import STORES
+from .task_queue import SharedStorage, Task, TaskQueue, open_task_queue
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+class Worker:
+    """
+    Runs leased tasks on a thread pool of `concurrency` threads sharing one DriverPool.
+
+    Tasks go through the store's regular autofill (fast path, cache, browser
+    flow with its own retries); the queue only sees the final outcome.
+    """
+
+    def __init__(
+        self,
+        queue: TaskQueue,
+        storage: SharedStorage,
+        work_dir: Path,
+        *,
+        worker_id: Optional[str] = None,
+        concurrency: int = 1,
+        stores: Optional[List[str]] = None,
+        pool: Optional[DriverPool] = None,
+        cache: Optional[InvoiceCache] = None,
+        fast_path_engines: Optional[Dict[str, PortalHttpEngine]] = None,
+        poll_interval: float = 1.0,
+        heartbeat_interval: float = 30.0,
+    ):
+        self.queue = queue
+        self.storage = storage
+        self.work_dir = Path(work_dir)
+        self.worker_id = worker_id or default_worker_id()
+        self.concurrency = concurrency
+        self.stores = stores
+        self.pool = pool
+        self.cache = cache
+        self.fast_path_engines = fast_path_engines or {}
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+
+        self._in_flight: Dict[int, Future] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._finished = threading.Event()
+        self.log = logger.bind(worker=self.worker_id)
+
+    def _run_task(self, task: Task) -> None:
+        log = self.log.bind(job_id=task.job_id, store=task.store, barcode=task.barcode)
+        failures = []
+        try:
+            with tempfile.TemporaryDirectory(dir=self.work_dir) as tmp:
+                result = STORES[task.store].autofill(
+                    [task.barcode],
+                    task.status,
+                    pool=self.pool,
+                    download_dir=Path(tmp),
+                    on_failure=lambda store, barcode, error_class, error: failures.append((error_class, error)),
+                    cache=self.cache,
+                    refresh=task.refresh,
+                    fast_path=self.fast_path_engines.get(task.store),
+                )
+                if result["downloaded"]:
+                    relative = self.storage.put_result(task, Path(result["downloaded"][0]))
+                    if not self.queue.complete(task.id, self.worker_id, relative):
+                        log.warning(f"Lease of task {task.id} was lost, result dropped")
+                    return
+            error_class, error = failures[0] if failures else ("Unknown", "No invoice downloaded")
+        except Exception as e:
+            # e.g. a profile missing fields required by the store, or an unknown store
+            log.exception(f"Task {task.id} failed: {e}")
+            error_class, error = type(e).__name__, str(e)
+        self.queue.fail(task.id, self.worker_id, error_class, error)
+
+    def _heartbeat(self) -> None:
+        # Keeps going after stop(): tasks still finishing must keep their leases
+        while not self._finished.wait(self.heartbeat_interval):
+            with self._lock:
+                task_ids = list(self._in_flight)
+            try:
+                held = set(self.queue.heartbeat(self.worker_id, task_ids))
+            except Exception as e:
+                self.log.warning(f"Heartbeat failed: {e}")
+                continue
+            lost = set(task_ids) - held
+            if lost:
+                self.log.warning(f"Leases lost for tasks {sorted(lost)}")
+
+    def _forget(self, task_id: int) -> None:
+        with self._lock:
+            self._in_flight.pop(task_id, None)
+
+    def run(self) -> None:
+        """Leases and runs tasks until stop() is called, then waits for the ones in progress."""
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+        self.log.info(f"Worker {self.worker_id} started ({self.concurrency} concurrent tasks)")
+        heartbeat = threading.Thread(target=self._heartbeat, name="worker-heartbeat", daemon=True)
+        heartbeat.start()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="task") as executor:
+            while not self._stop.is_set():
+                with self._lock:
+                    free = self.concurrency - len(self._in_flight)
+                tasks = []
+                if free > 0:
+                    try:
+                        tasks = self.queue.lease(self.worker_id, free, self.stores)
+                    except Exception as e:
+                        self.log.warning(f"Could not lease tasks: {e}")
+                for task in tasks:
+                    self.log.bind(job_id=task.job_id, barcode=task.barcode).info(
+                        f"Leased task {task.id} (delivery {task.deliveries})"
+                    )
+                    future = executor.submit(self._run_task, task)
+                    with self._lock:
+                        self._in_flight[task.id] = future
+                    future.add_done_callback(lambda _, task_id=task.id: self._forget(task_id))
+                if not tasks:
+                    self._stop.wait(self.poll_interval)
+
+        self._finished.set()
+        self.log.info(f"Worker {self.worker_id} stopped")
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=WORKER_CONCURRENCY, help="tasks (browsers) at a time")
+    parser.add_argument("--stores", help="comma-separated stores to serve (default: all)")
+    parser.add_argument("--id", dest="worker_id", help="worker name (default: host-pid-random)")
+    parser.add_argument("--headless", action="store_true")
+    args = parser.parse_args()
+
+    configure_logging()
+    ensure_dirs()
+    queue = open_task_queue(TASK_QUEUE, TASK_QUEUE_DB, lease_seconds=TASK_LEASE_SECONDS,
+                            max_deliveries=TASK_MAX_DELIVERIES)
+    if queue is None:
+        raise SystemExit("TASK_QUEUE is not set: jobs run inside the API process, there is nothing to pull")
+
+    worker_id = args.worker_id or default_worker_id()
+    # Browser downloads stay on the local disk; only finished invoices go to the shared storage
+    work_dir = Path(tempfile.gettempdir()) / "receipt-worker" / worker_id
+    pool = DriverPool(
+        work_dir / "browser",
+        size=args.concurrency,
+        chrome_version_main=CHROME_VERSION_MAIN,
+        headless=args.headless,
+        isolate_downloads=True,
+        mode=BROWSER_MODE,
+        portal_urls=[handler.flow.start_url for handler in STORES.values()],
+    )
+    cache = (
+        InvoiceCache(CACHE_DIR, max_age_days=CACHE_MAX_AGE_DAYS, max_bytes=CACHE_MAX_MB * 1024 * 1024)
+        if CACHE_ENABLED
+        else None
+    )
+    fast_path_engines = {
+        name: handler.http_engine(handler.api_url, pool_size=args.concurrency)
+        for name, handler in STORES.items()
+        if name in FAST_PATH_STORES
+    }
+    worker = Worker(
+        queue,
+        SharedStorage(SHARED_DIR),
+        work_dir,
+        worker_id=worker_id,
+        concurrency=args.concurrency,
+        stores=args.stores.split(",") if args.stores else None,
+        pool=pool,
+        cache=cache,
+        fast_path_engines=fast_path_engines,
+        heartbeat_interval=TASK_LEASE_SECONDS / 3,
+    )
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: worker.stop())
+    try:
+        if PREWARM_SESSIONS:
+            pool.prewarm(min(PREWARM_SESSIONS, args.concurrency))
+        worker.run()
+    finally:
+        pool.close()
+
+
+if __name__ == "__main__":
+    main()
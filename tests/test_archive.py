@@ -0,0 +1,106 @@
+import gzip
+from datetime import date
+
+import pytest
+
+from bench.portals import invoice_pdf
+from src.archive import InvoiceArchive, extract_metadata
+from src.invoice_cache import InvoiceCache, copy_blob
+
+STATUS = {"siret": "73282932000074"}
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return InvoiceCache(tmp_path / "cache", max_age_days=90, max_bytes=10 ** 9)
+
+
+def _invoice(tmp_path, barcode, issued=date(2025, 3, 14)):
+    path = tmp_path / f"{barcode}.pdf"
+    path.write_bytes(invoice_pdf("carrefour", barcode, issued))
+    return path
+
+
+def _blobs(cache):
+    return sorted(path.name for path in cache.blobs_dir.rglob("*.pdf.gz"))
+
+
+def test_metadata_is_read_from_the_invoice(tmp_path):
+    metadata = extract_metadata(_invoice(tmp_path, "4006381333931"))
+    assert metadata["issued_on"] == "2025-03-14"
+    assert metadata["total"] > 0 and metadata["currency"] == "EUR"
+
+
+def test_archiving_again_updates_the_entry(cache, tmp_path):
+    archive = InvoiceArchive(cache)
+    pdf = _invoice(tmp_path, "4006381333931")
+    first = archive.add(pdf, store="carrefour", barcode="4006381333931", profile="P1", job_id="a")
+    second = archive.add(pdf, store="carrefour", barcode="4006381333931", profile="P1", job_id="b")
+
+    assert second.id == first.id and second.job_id == "b"
+    assert archive.stats() == {"invoices": 1, "files": 1, "bytes": pdf.stat().st_size}
+    assert archive.read(second) == pdf.read_bytes()
+
+
+def test_blobs_are_stored_compressed(cache, tmp_path):
+    archive = InvoiceArchive(cache)
+    pdf = _invoice(tmp_path, "4006381333931")
+    entry = archive.add(pdf, store="carrefour", barcode="4006381333931", profile="P1")
+
+    stored = cache.blob_path(entry.sha256).read_bytes()
+    assert stored[:2] == b"\x1f\x8b" and not stored.startswith(b"%PDF")
+    assert gzip.decompress(stored) == pdf.read_bytes()
+    assert archive.read(entry) == pdf.read_bytes()
+
+    cache.put("carrefour", "4006381333931", STATUS, pdf)
+    copy_blob(cache.get("carrefour", "4006381333931", STATUS), tmp_path / "copy.pdf")
+    assert (tmp_path / "copy.pdf").read_bytes() == pdf.read_bytes()
+
+
+def test_cache_and_archive_share_one_blob(cache, tmp_path):
+    archive = InvoiceArchive(cache)
+    pdf = _invoice(tmp_path, "4006381333931")
+    cache.put("carrefour", "4006381333931", STATUS, pdf)
+    archive.add(pdf, store="carrefour", barcode="4006381333931", profile="P1")
+    assert len(_blobs(cache)) == 1
+
+
+def test_archived_blobs_survive_cache_eviction(cache, tmp_path):
+    archive = InvoiceArchive(cache)
+    archived, cached_only = _invoice(tmp_path, "4006381333931"), _invoice(tmp_path, "5449000000996")
+    cache.put("carrefour", "4006381333931", STATUS, archived)
+    cache.put("carrefour", "5449000000996", STATUS, cached_only)
+    entry = archive.add(archived, store="carrefour", barcode="4006381333931", profile="P1")
+
+    cache.max_age = -1
+    cache.evict()
+    assert cache.get("carrefour", "4006381333931", STATUS) is None
+    assert _blobs(cache) == [f"{entry.sha256}.pdf.gz"]
+
+
+def test_replaced_invoice_drops_its_old_blob(cache, tmp_path):
+    archive = InvoiceArchive(cache)
+    old = archive.add(_invoice(tmp_path, "4006381333931"), store="carrefour", barcode="4006381333931", profile="P1")
+    (tmp_path / "reissued").mkdir()
+    reissued = _invoice(tmp_path / "reissued", "4006381333931", issued=date(2025, 4, 1))
+    new = archive.add(reissued, store="carrefour", barcode="4006381333931", profile="P1")
+
+    assert new.sha256 != old.sha256 and new.issued_on == "2025-04-01"
+    assert _blobs(cache) == [f"{new.sha256}.pdf.gz"]
+
+
+def test_query_filters(cache, tmp_path):
+    archive = InvoiceArchive(cache)
+    for barcode, profile, issued in [
+        ("4006381333931", "P1", date(2025, 1, 10)),
+        ("5449000000996", "P1", date(2025, 3, 2)),
+        ("3017620422003", "P2", date(2025, 3, 20)),
+    ]:
+        archive.add(_invoice(tmp_path, barcode, issued), store="carrefour", barcode=barcode, profile=profile)
+
+    count, entries = archive.query(profile="P1")
+    assert count == 2 and [e.barcode for e in entries] == ["5449000000996", "4006381333931"]
+    count, entries = archive.query(date_from=date(2025, 3, 1), date_to=date(2025, 3, 31))
+    assert count == 2
+    count, entries = archive.query(ids=[])
+    assert count == 0 and entries == []
@@ -0,0 +1,58 @@
+import threading
+
+import pytest
+
+import src.downloads as downloads
+from src.downloads import DownloadTracker
+
+
+@pytest.fixture(params=["inotify", "polling"])
+def tracker_mode(request, monkeypatch):
+    if request.param == "polling":
+        monkeypatch.setattr(downloads, "_libc", None)
+    elif downloads._libc is None:
+        pytest.skip("inotify is not available")
+    return request.param
+
+
+def _later(action, delay=0.1):
+    timer = threading.Timer(delay, action)
+    timer.start()
+    return timer
+
+
+def test_finished_download_is_returned(tmp_path, tracker_mode):
+    def download():
+        partial = tmp_path / "facture.pdf.crdownload"
+        partial.write_bytes(b"%PDF-1.4 partial")
+        partial.rename(tmp_path / "facture.pdf")
+
+    with DownloadTracker(tmp_path, poll_interval=0.02) as tracker:
+        _later(download)
+        assert tracker.wait(timeout=5) == tmp_path / "facture.pdf"
+
+
+def test_partial_and_older_files_are_ignored(tmp_path, tracker_mode):
+    (tmp_path / "old.pdf").write_bytes(b"%PDF-1.4")
+    with DownloadTracker(tmp_path, poll_interval=0.02) as tracker:
+        (tmp_path / "facture.pdf.crdownload").write_bytes(b"%PDF")
+        (tmp_path / "facture.pdf.part").write_bytes(b"%PDF")
+        (tmp_path / "notes.txt").write_text("not a pdf")
+        with pytest.raises(RuntimeError, match="No new PDF"):
+            tracker.wait(timeout=0.3)
+
+
+def test_pdf_still_being_written_is_not_returned(tmp_path):
+    # Chrome may create the final name before it removes the .crdownload file
+    with DownloadTracker(tmp_path, poll_interval=0.02) as tracker:
+        (tmp_path / "facture.pdf.crdownload").write_bytes(b"%PDF")
+        (tmp_path / "facture.pdf").write_bytes(b"")
+        assert tracker._completed_since_arm() is None
+        (tmp_path / "facture.pdf.crdownload").unlink()
+        assert tracker._completed_since_arm() == tmp_path / "facture.pdf"
+
+
+def test_download_completed_before_wait_is_found(tmp_path, tracker_mode):
+    with DownloadTracker(tmp_path) as tracker:
+        (tmp_path / "facture.PDF").write_bytes(b"%PDF-1.4")
+        assert tracker.wait(timeout=1) == tmp_path / "facture.PDF"
@@ -0,0 +1,102 @@
+import pytest
+
+from src.driver_pool import DriverPool, DriverSession, origin_of
+
+
+class RecordingDriver:
+    """Stands in for a Chrome WebDriver: records the commands it receives."""
+
+    def __init__(self, fail_cdp=False):
+        self.commands = []
+        self.fail_cdp = fail_cdp
+        self.window_handles = ["main"]
+        self.quit_called = False
+        self.current_url = "about:blank"
+
+    def execute_cdp_cmd(self, command, params):
+        if self.fail_cdp:
+            raise RuntimeError("browser gone")
+        self.commands.append((command, params))
+
+    def execute_script(self, script):
+        self.commands.append(("script", script))
+
+    def get(self, url):
+        self.commands.append(("get", url))
+        self.current_url = url
+
+    def quit(self):
+        self.quit_called = True
+
+
+class RecordingPool(DriverPool):
+    def __init__(self, tmp_path, **options):
+        super().__init__(tmp_path, driver_cache_dir=None, **options)
+        self.drivers = []
+        self.fail_cdp = False
+
+    def _create_session(self):
+        driver = RecordingDriver(self.fail_cdp)
+        self.drivers.append(driver)
+        return DriverSession(driver, self.download_dir)
+
+
+def _cleared_origins(commands):
+    return [params["origin"] for command, params in commands if command == "Storage.clearDataForOrigin"]
+
+
+def test_origin_of():
+    assert origin_of("https://www.auchan.fr/facture?x=1") == "https://www.auchan.fr"
+    assert origin_of("http://127.0.0.1:8000/carrefour/") == "http://127.0.0.1:8000"
+    assert origin_of("about:blank") is None and origin_of(None) is None
+
+
+def test_storage_is_cleared_for_each_portal_origin_on_release(tmp_path):
+    portals = ["https://auchan.test/facture", "https://carrefour.test/start"]
+    with RecordingPool(tmp_path, size=1, portal_urls=portals) as pool:
+        with pool.lease("https://carrefour.test/start") as session:
+            # The flow ends on another origin (login redirect, invoice host...)
+            session.driver.current_url = "https://sso.carrefour.test/done"
+        (driver,) = pool.drivers
+
+    assert ("Network.clearBrowserCookies", {}) in driver.commands
+    assert _cleared_origins(driver.commands) == [
+        "https://auchan.test", "https://carrefour.test", "https://sso.carrefour.test",
+    ]
+    assert all(
+        params["storageTypes"] == "all" for command, params in driver.commands
+        if command == "Storage.clearDataForOrigin"
+    )
+
+
+def test_origins_visited_by_a_session_are_cleared_on_each_release(tmp_path):
+    with RecordingPool(tmp_path, size=1) as pool:
+        for url in ("https://portal.test/start", "https://other.test/start"):
+            with pool.lease(url):
+                pass
+        (driver,) = pool.drivers
+
+    assert _cleared_origins(driver.commands) == ["https://portal.test", "https://other.test"]
+
+
+def test_session_that_cannot_be_cleared_is_discarded(tmp_path):
+    with RecordingPool(tmp_path, size=1) as pool:
+        pool.fail_cdp = True
+        with pool.lease():
+            pass
+        pool.fail_cdp = False
+        with pool.lease():
+            pass
+
+    first, second = pool.drivers
+    assert first.quit_called
+    assert second is not first
+
+
+def test_failed_lease_is_still_cleared(tmp_path):
+    with RecordingPool(tmp_path, size=1) as pool:
+        with pytest.raises(ValueError):
+            with pool.lease():
+                raise ValueError("form step failed")
+        (driver,) = pool.drivers
+        assert ("Network.clearBrowserCookies", {}) in driver.commands
@@ -0,0 +1,89 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from bench.portals import MockPortals
+from src.fast_path import AuchanHttpEngine, CarrefourHttpEngine, FastPathError, PortalHttpEngine
+
+STATUS = {
+    "name": "Martin",
+    "vat": "FR40732829320",
+    "siret": "73282932000074",
+    "companyName": "DemoTech Solutions",
+    "address": "12 avenue des Tests",
+    "zipCode": "75015",
+    "city": "Paris",
+    "contactEmail": "contact@demotech-solutions.com",
+}
+
+
+@pytest.fixture
+def portals():
+    with MockPortals(step_delay_ms=0) as portals:
+        yield portals
+
+
+def test_engine_is_abstract():
+    with pytest.raises(TypeError):
+        PortalHttpEngine("http://127.0.0.1/")
+
+
+@pytest.mark.parametrize("engine_class, store", [(AuchanHttpEngine, "auchan"), (CarrefourHttpEngine, "carrefour")])
+def test_download(portals, tmp_path, engine_class, store):
+    engine = engine_class(portals.api_url(store))
+    try:
+        target = engine.download("2914177763171", STATUS, tmp_path / "invoice.pdf")
+    finally:
+        engine.close()
+    assert target.read_bytes().startswith(b"%PDF")
+    assert not (tmp_path / "invoice.pdf.part").exists()
+    assert portals.served[store] == 1
+
+
+def test_form_post_is_not_retried(portals):
+    portals.fail_rate = 1.0
+    engine = CarrefourHttpEngine(portals.api_url("carrefour"))
+    try:
+        with pytest.raises(FastPathError):
+            engine.fetch_invoice("2914177763171", STATUS)
+    finally:
+        engine.close()
+    assert portals.failed == 1
+
+
+def test_missing_fields_raise_key_error(portals):
+    engine = AuchanHttpEngine(portals.api_url("auchan"))
+    try:
+        with pytest.raises(KeyError):
+            engine.fetch_invoice("2914177763171", {})
+    finally:
+        engine.close()
+
+
+@pytest.mark.parametrize("body", [[], "done", {"status": "ok"}])
+def test_unexpected_json_raises_fast_path_error(body):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            payload = json.dumps(body).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    engine = AuchanHttpEngine(f"http://127.0.0.1:{server.server_address[1]}/api/invoices")
+    try:
+        with pytest.raises(FastPathError):
+            engine.fetch_invoice("2914177763171", STATUS)
+    finally:
+        engine.close()
+        server.shutdown()
+        server.server_close()
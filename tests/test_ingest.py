@@ -0,0 +1,82 @@
+import asyncio
+import io
+import zipfile
+
+import pytest
+
+from src.decoding import DecodeStage
+from src.ingest import UploadRejected, iter_receipt_images
+
+
+def _zip(path, members):
+    with zipfile.ZipFile(path, "w") as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    return path
+
+
+def _corrupt_member(path, name):
+    """Flips one byte of a stored member's data, so reading it fails the CRC check."""
+    data = bytearray(path.read_bytes())
+    with zipfile.ZipFile(path) as archive:
+        info = archive.getinfo(name)
+    offset = info.header_offset + 30 + len(info.filename.encode()) + len(info.extra)
+    data[offset] ^= 0xFF
+    path.write_bytes(bytes(data))
+
+
+def test_plain_images_pass_through(tmp_path):
+    image = tmp_path / "receipt.jpg"
+    image.write_bytes(b"jpeg")
+    assert list(iter_receipt_images([("receipt.jpg", image)], tmp_path)) == [("receipt.jpg", image)]
+
+
+def test_corrupt_member_is_reported_not_raised(tmp_path):
+    upload = _zip(tmp_path / "upload.zip", {"a.jpg": b"a" * 100, "b.jpg": b"b" * 100, "c.jpg": b"c" * 100})
+    _corrupt_member(upload, "b.jpg")
+
+    images = list(iter_receipt_images([("upload.zip", upload)], tmp_path))
+    assert [name for name, _ in images] == ["upload.zip/a.jpg", "upload.zip/b.jpg", "upload.zip/c.jpg"]
+    assert images[1][1] is None
+    assert images[0][1].read_bytes() == b"a" * 100 and images[2][1].read_bytes() == b"c" * 100
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["member_1.jpg", "member_3.jpg"]
+
+
+def test_member_above_size_limit_is_skipped(tmp_path):
+    upload = _zip(tmp_path / "upload.zip", {"small.jpg": b"s" * 10, "bomb.jpg": b"\0" * 10_000})
+    images = dict(iter_receipt_images([("upload.zip", upload)], tmp_path, max_member_bytes=1000))
+    assert images["upload.zip/bomb.jpg"] is None
+    assert images["upload.zip/small.jpg"] is not None
+
+
+def test_too_many_members_are_rejected(tmp_path):
+    upload = _zip(tmp_path / "upload.zip", {f"{i}.jpg": b"x" for i in range(5)})
+    with pytest.raises(UploadRejected):
+        next(iter_receipt_images([("upload.zip", upload)], tmp_path, max_members=4))
+    assert not list(tmp_path.glob("member_*"))
+
+
+def test_unreadable_zip_is_reported(tmp_path):
+    upload = tmp_path / "upload.zip"
+    buffer = io.BytesIO()
+    _zip(buffer, {"a.jpg": b"a"})
+    # Valid end record, damaged central directory
+    data = bytearray(buffer.getvalue())
+    data[data.rfind(b"PK\x01\x02")] = 0
+    upload.write_bytes(bytes(data))
+    assert list(iter_receipt_images([("upload.zip", upload)], tmp_path)) == [("upload.zip", None)]
+
+
+def test_decoded_files_are_deleted(tmp_path):
+    pytest.importorskip("pyzbar.pyzbar", exc_type=ImportError)  # needs the zbar shared library
+    upload = _zip(tmp_path / "upload.zip", {"a.jpg": b"not an image", "b.jpg": b"b"})
+    _corrupt_member(upload, "b.jpg")
+    stage = DecodeStage(workers=1)
+    try:
+        results = asyncio.run(
+            stage.decode_stream(iter_receipt_images([("upload.zip", upload)], tmp_path), delete_decoded=True)
+        )
+    finally:
+        stage.shutdown()
+    assert [(r.filename, r.barcode) for r in results] == [("upload.zip/a.jpg", None), ("upload.zip/b.jpg", None)]
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,68 @@
+import threading
+import time
+
+from src.jobs import JobManager, JobState
+
+
+def _wait(job, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while job.finished_at is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert job.finished_at is not None
+
+
+def _pipeline(job):
+    job.invoices_dir.mkdir(parents=True, exist_ok=True)
+    return {"downloaded": [], "failed": list(job.barcodes)}
+
+
+def test_finished_jobs_are_evicted_after_retention(tmp_path):
+    manager = JobManager(tmp_path, _pipeline, workers=1, retention=0.2)
+    try:
+        job = manager.submit("carrefour", "p", {}, ["111"], [])
+        _wait(job)
+        assert manager.get(job.id) is job and job.work_dir.exists()
+
+        leftover = tmp_path / "from-a-previous-run"
+        leftover.mkdir()
+        time.sleep(0.3)
+        assert manager.evict_expired() == 2
+        assert manager.get(job.id) is None
+        assert not job.work_dir.exists() and not leftover.exists()
+    finally:
+        manager.shutdown()
+
+
+def test_jobs_are_kept_without_retention(tmp_path):
+    manager = JobManager(tmp_path, _pipeline, workers=1)
+    try:
+        job = manager.submit("carrefour", "p", {}, ["111"], [])
+        _wait(job)
+        assert manager.evict_expired() == 0
+        assert manager.get(job.id) is job
+    finally:
+        manager.shutdown()
+
+
+def test_job_cancelled_before_it_starts_does_not_run(tmp_path):
+    release = threading.Event()
+    ran = []
+
+    def pipeline(job):
+        ran.append(job.id)
+        release.wait(5)
+        return _pipeline(job)
+
+    manager = JobManager(tmp_path, pipeline, workers=1)
+    try:
+        running = manager.submit("carrefour", "p", {}, ["111"], [])
+        queued = manager.submit("carrefour", "p", {}, ["222"], [])
+        manager.cancel(queued)
+        release.set()
+        _wait(running)
+        _wait(queued)
+    finally:
+        manager.shutdown()
+    assert ran == [running.id]
+    assert queued.state == JobState.failed and queued.error == "Cancelled"
+    assert manager.events(queued)[-1].final
@@ -0,0 +1,125 @@
+import io
+import time
+import zlib
+
+import PyPDF2
+
+from bench.portals import invoice_pdf
+from src.merge_pdf import IncrementalMerger
+
+
+def _invoices(tmp_path, count):
+    paths = []
+    for index in range(count):
+        path = tmp_path / f"facture_{index}.pdf"
+        path.write_bytes(invoice_pdf("carrefour", f"{index:013d}"))
+        paths.append(path)
+    return paths
+
+
+def _barcodes(pdf):
+    reader = PyPDF2.PdfReader(pdf if isinstance(pdf, io.BytesIO) else str(pdf))
+    return [page.extract_text().split("Code-barres: ")[1].split()[0] for page in reader.pages]
+
+
+def test_out_of_order_invoices_are_merged_in_batch_order(tmp_path):
+    invoices = _invoices(tmp_path, 4)
+    merger = IncrementalMerger(tmp_path / "merged.pdf", min_flush_interval=0)
+    merger.add(2, invoices[2])
+    merger.skip(1)
+    assert merger.appended == 0
+    merger.add(0, invoices[0])
+    merger.add(3, invoices[3])
+    assert merger.close() == tmp_path / "merged.pdf"
+    assert merger.appended == 3
+    assert _barcodes(tmp_path / "merged.pdf") == [f"{i:013d}" for i in (0, 2, 3)]
+
+
+def test_committed_prefix_is_a_complete_document_never_rewritten(tmp_path):
+    invoices = _invoices(tmp_path, 3)
+    merged = tmp_path / "merged.pdf"
+    merger = IncrementalMerger(merged, min_flush_interval=0)
+    merger.add(0, invoices[0])
+    first = merged.read_bytes()[:merger.committed_size]
+    merger.add(1, invoices[1])
+    second = merged.read_bytes()[:merger.committed_size]
+
+    assert _barcodes(io.BytesIO(first)) == [f"{0:013d}"]
+    assert second.startswith(first) and _barcodes(io.BytesIO(second)) == [f"{i:013d}" for i in (0, 1)]
+    merger.add(2, invoices[2])
+    merger.close()
+    assert merged.read_bytes().startswith(second)
+    assert _barcodes(merged) == [f"{i:013d}" for i in range(3)]
+
+
+def test_appends_within_the_flush_interval_are_flushed_by_a_timer(tmp_path):
+    invoices = _invoices(tmp_path, 3)
+    merger = IncrementalMerger(tmp_path / "merged.pdf", min_flush_interval=0.3)
+    merger.add(0, invoices[0])
+    merger.add(1, invoices[1])
+    merger.add(2, invoices[2])
+    assert merger.appended == 1
+
+    deadline = time.monotonic() + 5
+    while merger.appended < 3 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert merger.appended == 3
+    assert _barcodes(io.BytesIO((tmp_path / "merged.pdf").read_bytes()[:merger.committed_size])) == [
+        f"{i:013d}" for i in range(3)
+    ]
+    merger.close()
+
+
+def _inherited_resources_pdf(barcode):
+    """One page whose font and media box are set on the page tree, with a compressed content stream."""
+    content = zlib.compress(f"BT /F1 12 Tf 72 700 Td (Code-barres: {barcode}) Tj ET".encode())
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [4 0 R] /Count 1 /MediaBox [0 0 595 842] /Resources << /Font << /F1 3 0 R >> >> >>",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+        b"<< /Type /Page /Parent 2 0 R /Contents 5 0 R >>",
+        b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(content) + content + b"\nendstream",
+    ]
+    pdf = b"%PDF-1.4\n"
+    offsets = []
+    for number, obj in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n" % number + obj + b"\nendobj\n"
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f\r\n" % (len(objects) + 1)
+    pdf += b"".join(b"%010d 00000 n\r\n" % offset for offset in offsets)
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return pdf
+
+
+def test_inherited_attributes_and_compressed_streams_are_copied(tmp_path):
+    source = tmp_path / "inherited.pdf"
+    source.write_bytes(_inherited_resources_pdf("4006381333931"))
+    merger = IncrementalMerger(tmp_path / "merged.pdf", min_flush_interval=0)
+    merger.add(0, source)
+    merger.add(1, _invoices(tmp_path, 1)[0])
+    merger.close()
+
+    page = PyPDF2.PdfReader(str(tmp_path / "merged.pdf")).pages[0]
+    assert "/Resources" in page and [float(v) for v in page["/MediaBox"]] == [0, 0, 595, 842]
+    assert _barcodes(tmp_path / "merged.pdf") == ["4006381333931", f"{0:013d}"]
+
+
+def test_unreadable_invoice_is_left_out(tmp_path):
+    invoices = _invoices(tmp_path, 2)
+    broken = tmp_path / "broken.pdf"
+    broken.write_bytes(b"not a pdf")
+    merger = IncrementalMerger(tmp_path / "merged.pdf", min_flush_interval=0)
+    merger.add(0, invoices[0])
+    merger.add(1, broken)
+    merger.add(2, invoices[1])
+    merger.close()
+    assert merger.appended == 2
+    assert _barcodes(tmp_path / "merged.pdf") == [f"{i:013d}" for i in (0, 1)]
+
+
+def test_nothing_to_merge(tmp_path):
+    merger = IncrementalMerger(tmp_path / "merged.pdf")
+    merger.skip(0)
+    assert merger.close() is None
+    assert not (tmp_path / "merged.pdf").exists()
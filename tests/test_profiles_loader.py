@@ -0,0 +1,74 @@
+import json
+
+import pytest
+
+from src.profiles_loader import JsonProfileSource, ProfileError, ProfileRegistry, SQLiteProfileSource
+
+REQUIREMENTS = {"auchan": ["name", "zipCode"], "carrefour": ["name", "siret"]}
+
+
+def _write(path, profiles):
+    path.write_text(json.dumps(profiles), encoding="utf-8")
+
+
+@pytest.fixture
+def profiles_file(tmp_path):
+    path = tmp_path / "profiles.json"
+    _write(path, {"P1": {"name": "Martin", "zipCode": "75015", "siret": "73282932000074"}})
+    return path
+
+
+def test_json_profiles_are_reloaded_when_the_file_changes(profiles_file):
+    registry = ProfileRegistry(JsonProfileSource(profiles_file), REQUIREMENTS, check_interval=0)
+    assert registry.names() == ["P1"]
+
+    _write(profiles_file, {"P1": {"name": "Martin"}, "P2": {"name": "Durand", "siret": "1"}})
+    assert sorted(registry.names()) == ["P1", "P2"]
+    assert registry.get("P1") == {"name": "Martin"}
+
+
+def test_source_is_not_reread_within_the_check_interval(profiles_file):
+    registry = ProfileRegistry(JsonProfileSource(profiles_file), REQUIREMENTS, check_interval=3600)
+    registry.names()
+    _write(profiles_file, {"P2": {"name": "Durand"}})
+    assert registry.names() == ["P1"]
+
+
+def test_sqlite_profiles_are_reloaded_on_revision_change(tmp_path):
+    source = SQLiteProfileSource(tmp_path / "profiles.sqlite3")
+    source.put_many({"P1": {"name": "Martin", "siret": "1"}})
+    registry = ProfileRegistry(source, REQUIREMENTS, check_interval=0)
+    revision = source.version()
+    assert registry.valid_stores("P1") == ["carrefour"]
+
+    source.put_many({"P1": {"name": "Martin", "siret": "1", "zipCode": "75015"}})
+    assert source.version() > revision
+    assert registry.valid_stores("P1") == ["auchan", "carrefour"]
+
+
+def test_missing_fields_are_reported_per_store(profiles_file):
+    _write(profiles_file, {"P1": {"name": "Martin", "siret": ""}, "broken": ["not", "an", "object"]})
+    registry = ProfileRegistry(JsonProfileSource(profiles_file), REQUIREMENTS)
+
+    with pytest.raises(ProfileError, match=r"auchan: zipCode; carrefour: siret"):
+        registry.check("P1", ["auchan", "carrefour"])
+    with pytest.raises(ProfileError, match="not an object"):
+        registry.get("broken")
+    with pytest.raises(KeyError):
+        registry.get("P3")
+    assert registry.valid_stores("broken") == []
+
+
+def test_unreadable_source_keeps_the_last_good_profiles(profiles_file):
+    registry = ProfileRegistry(JsonProfileSource(profiles_file), REQUIREMENTS, check_interval=0)
+    registry.names()
+    profiles_file.write_text("{ not json", encoding="utf-8")
+    assert registry.names() == ["P1"]
+    _write(profiles_file, ["not", "keyed", "by", "name"])
+    assert registry.check("P1", ["auchan"])["name"] == "Martin"
+
+
+def test_missing_source_fails_on_first_load(tmp_path):
+    registry = ProfileRegistry(JsonProfileSource(tmp_path / "profiles.json"), REQUIREMENTS)
+    with pytest.raises(FileNotFoundError, match="profiles.example.json"):
+        registry.names()
@@ -0,0 +1,84 @@
+import time
+from datetime import datetime
+
+import pytest
+
+from src.retry_queue import DEAD, PENDING, RetryQueue, in_window, parse_window
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return RetryQueue(tmp_path / "retries.sqlite3", max_attempts=3, base_delay=0, claim_timeout=0.2)
+
+
+def test_push_counts_attempts_until_dead(queue):
+    for attempts in (1, 2):
+        entry = queue.push("carrefour", "P1", "4006381333931", "TimeoutException", "too slow")
+        assert entry.attempts == attempts and entry.state == PENDING
+    entry = queue.push("carrefour", "P1", "4006381333931", "WebDriverException", "crashed")
+    assert entry.attempts == 3 and entry.state == DEAD
+    assert entry.error_class == "WebDriverException"
+    assert len(queue.list()) == 1
+    assert queue.stats() == {"carrefour": {DEAD: 1}}
+
+
+def test_retry_delay_doubles_per_attempt(tmp_path):
+    queue = RetryQueue(tmp_path / "retries.sqlite3", base_delay=100, max_delay=300)
+    delays = []
+    for _ in range(4):
+        entry = queue.push("auchan", "P1", "1234567890123456", "TimeoutException")
+        delays.append(round(entry.next_retry - entry.updated_at))
+    assert delays == [100, 200, 300, 300]
+
+
+def test_claim_due_skips_entries_not_due(tmp_path):
+    queue = RetryQueue(tmp_path / "retries.sqlite3", base_delay=3600)
+    queue.push("carrefour", "P1", "4006381333931", "TimeoutException")
+    assert queue.claim_due(10) == []
+
+
+def test_claimed_entry_is_redelivered_after_claim_timeout(queue):
+    queue.push("carrefour", "P1", "4006381333931", "TimeoutException")
+    (entry,) = queue.claim_due(10)
+    assert entry.barcode == "4006381333931"
+    assert queue.claim_due(10) == []
+
+    time.sleep(0.3)
+    (again,) = queue.claim_due(10)
+    assert again.id == entry.id
+
+
+def test_claim_takes_entries_whatever_their_time_and_state(queue):
+    for _ in range(3):
+        queue.push("carrefour", "P1", "4006381333931", "TimeoutException")
+    queue.push("auchan", "P2", "1234567890123456", "TimeoutException")
+    assert queue.claim_due(10)[0].store == "auchan"  # the dead entry is never due
+
+    (entry,) = queue.claim(store="carrefour")
+    assert entry.state == DEAD
+    assert queue.list(store="carrefour")[0].state == PENDING
+    assert [e.store for e in queue.claim(ids=[entry.id])] == ["carrefour"]
+    assert queue.claim(ids=[]) == []
+
+
+def test_resolve_removes_the_entry(queue):
+    queue.push("carrefour", "P1", "4006381333931", "TimeoutException")
+    assert queue.resolve("carrefour", "P1", "4006381333931")
+    assert not queue.resolve("carrefour", "P1", "4006381333931")
+    assert queue.list() == []
+
+
+def test_window_wrapping_past_midnight():
+    window = parse_window("22-6")
+    assert window == (22, 6)
+    for hour, inside in [(21, False), (22, True), (23, True), (0, True), (5, True), (6, False), (12, False)]:
+        assert in_window(window, datetime(2025, 3, 14, hour)) is inside
+
+
+def test_window_parsing():
+    assert parse_window("") is None and parse_window("  ") is None
+    assert in_window(None)
+    assert parse_window("24-6") == (0, 6)
+    assert in_window(parse_window("9-17"), datetime(2025, 3, 14, 16))
+    assert not in_window(parse_window("9-17"), datetime(2025, 3, 14, 17))
+    assert in_window(parse_window("3-3"), datetime(2025, 3, 14, 12))
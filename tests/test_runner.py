@@ -0,0 +1,88 @@
+from contextlib import contextmanager
+
+import pytest
+
+import src.runner as runner
+from src.driver_pool import DriverSession
+from src.flows import HARD, STALE, TRANSIENT, StepError
+
+START_URL = "https://portal.test/start"
+
+
+class FakePool:
+    """Leases one session per call, recording the start page of each lease."""
+
+    def __init__(self, tmp_path):
+        self.tmp_path = tmp_path
+        self.leases = []
+
+    @contextmanager
+    def lease(self, start_url=None):
+        self.leases.append(start_url)
+        download_dir = self.tmp_path / f"session_{len(self.leases)}"
+        download_dir.mkdir()
+        yield DriverSession(driver=None, download_dir=download_dir)
+
+
+class StuckFlow:
+    """Fails at `fail_at` with errors of `kind`, `failures` times, then downloads the invoice."""
+
+    def __init__(self, kind, fail_at=2, failures=None):
+        self.kind = kind
+        self.fail_at = fail_at
+        self.failures = failures
+        self.started_at = []
+
+    def __call__(self, driver, barcode, status, checkpoint):
+        self.started_at.append(checkpoint.step)
+        if self.failures is None or len(self.started_at) <= self.failures:
+            checkpoint.step = self.fail_at
+            raise StepError("click did not register", self.fail_at, self.kind)
+        checkpoint.step = 4
+        self.download_dir.joinpath("invoice.pdf").write_bytes(b"%PDF-1.4")
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(runner, "_backoff", lambda retry: 0)
+
+
+def _process(tmp_path, pool, flow, max_attempts):
+    staging = tmp_path / "staging"
+    staging.mkdir(exist_ok=True)
+
+    def fill_invoice(driver, barcode, status, checkpoint):
+        flow.download_dir = pool.tmp_path / f"session_{len(pool.leases)}"
+        flow(driver, barcode, status, checkpoint)
+
+    return runner._process_barcode(
+        "Carrefour", 0, "4006381333931", {}, fill_invoice, START_URL, pool, staging, max_attempts
+    )
+
+
+@pytest.mark.parametrize("kind", [TRANSIENT, STALE])
+def test_stuck_step_is_resumed_once_then_restarted(tmp_path, kind):
+    pool, flow = FakePool(tmp_path), StuckFlow(kind)
+    with pytest.raises(StepError):
+        _process(tmp_path, pool, flow, max_attempts=5)
+
+    # One resume from the failing step per session, then a new session from the start page
+    assert flow.started_at == [0, 2, 0, 2, 0]
+    assert pool.leases == [START_URL] * 3
+
+
+def test_resume_that_succeeds_keeps_the_session(tmp_path):
+    pool, flow = FakePool(tmp_path), StuckFlow(STALE, failures=1)
+    staged = _process(tmp_path, pool, flow, max_attempts=3)
+
+    assert staged.read_bytes() == b"%PDF-1.4"
+    assert flow.started_at == [0, 2]
+    assert pool.leases == [START_URL]
+
+
+def test_hard_failure_restarts_from_the_start_page(tmp_path):
+    pool, flow = FakePool(tmp_path), StuckFlow(HARD, failures=1)
+    _process(tmp_path, pool, flow, max_attempts=3)
+
+    assert flow.started_at == [0, 0]
+    assert len(pool.leases) == 2
@@ -0,0 +1,54 @@
+from dataclasses import replace
+
+from src.stores import AUTO, STORES, detect_store, route_barcodes, run_mixed_batch
+
+AUCHAN = "29141777631710042"
+CARREFOUR = "4006381333931"
+
+
+def test_detect_store_by_format_and_symbology():
+    assert detect_store(AUCHAN) == "auchan"
+    assert detect_store(CARREFOUR) == "carrefour"
+    assert detect_store(CARREFOUR, "EAN13") == "carrefour"
+    # Right length, wrong symbology
+    assert detect_store(CARREFOUR, "I25") is None
+    assert detect_store("12345") is None
+    assert detect_store("ABC4006381333") is None
+
+
+def test_route_barcodes_detects_each_store():
+    decoded = [(CARREFOUR, "EAN13"), ("12345", None), (AUCHAN, "I25")]
+    assert route_barcodes(decoded) == ([CARREFOUR, AUCHAN], ["carrefour", "auchan"], ["12345"])
+
+
+def test_route_barcodes_override_takes_every_barcode():
+    decoded = [(CARREFOUR, "EAN13"), ("12345", None)]
+    assert route_barcodes(decoded, "auchan") == ([CARREFOUR, "12345"], ["auchan", "auchan"], [])
+    assert route_barcodes([], AUTO) == ([], [], [])
+
+
+def test_failing_store_only_fails_its_own_barcodes(monkeypatch, tmp_path):
+    def carrefour(barcodes, status, *, download_dir, on_progress, **options):
+        for index, barcode in enumerate(barcodes):
+            pdf = download_dir / f"{barcode}.pdf"
+            pdf.parent.mkdir(parents=True, exist_ok=True)
+            pdf.write_bytes(b"%PDF-1.4")
+            on_progress(index, barcode, pdf)
+        return {"downloaded": [download_dir / f"{b}.pdf" for b in barcodes], "failed": []}
+
+    def auchan(barcodes, status, **options):
+        raise KeyError("zipCode")
+
+    monkeypatch.setitem(STORES, "carrefour", replace(STORES["carrefour"], autofill=carrefour))
+    monkeypatch.setitem(STORES, "auchan", replace(STORES["auchan"], autofill=auchan))
+    progress, failures = [], []
+    result = run_mixed_batch(
+        [CARREFOUR, AUCHAN, "5449000000996"], ["carrefour", "auchan", "carrefour"], {},
+        download_dir=tmp_path,
+        on_progress=lambda index, barcode, pdf: progress.append((index, pdf is not None)),
+        on_failure=lambda store, barcode, error_class, error: failures.append((store, barcode, error_class)),
+    )
+
+    assert sorted(progress) == [(0, True), (1, False), (2, True)]
+    assert failures == [("auchan", AUCHAN, "KeyError")]
+    assert result["failed"] == [AUCHAN] and len(result["downloaded"]) == 2
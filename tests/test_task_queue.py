@@ -0,0 +1,82 @@
+import time
+
+import pytest
+
+from src.task_queue import DONE, FAILED, LEASED, QUEUED, SharedStorage, SQLiteTaskQueue, TaskQueue, run_on_workers
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return SQLiteTaskQueue(tmp_path / "tasks.sqlite3", lease_seconds=0.2, max_deliveries=2)
+
+
+def _expire_leases():
+    time.sleep(0.3)
+
+
+def test_task_queue_is_abstract():
+    with pytest.raises(TypeError):
+        TaskQueue()
+
+
+def test_expired_lease_is_queued_again(queue):
+    queue.enqueue("job", ["111"], ["carrefour"], {})
+    (task,) = queue.lease("w1")
+    assert task.state == LEASED and task.deliveries == 1
+
+    _expire_leases()
+    assert queue.requeue_expired() == 1
+    (task,) = queue.job_tasks("job")
+    assert task.state == QUEUED and task.worker is None
+
+    (task,) = queue.lease("w2")
+    assert task.worker == "w2" and task.deliveries == 2
+
+
+def test_heartbeat_keeps_the_lease(queue):
+    queue.enqueue("job", ["111"], ["carrefour"], {})
+    (task,) = queue.lease("w1")
+    for _ in range(3):
+        time.sleep(0.05)
+        assert queue.heartbeat("w1", [task.id]) == [task.id]
+    assert queue.requeue_expired() == 0
+    assert queue.heartbeat("w2", [task.id]) == []
+
+
+def test_task_fails_as_worker_lost_after_max_deliveries(queue):
+    queue.enqueue("job", ["111"], ["carrefour"], {})
+    for worker in ("w1", "w2"):
+        assert len(queue.lease(worker)) == 1
+        _expire_leases()
+    queue.requeue_expired()
+
+    (task,) = queue.job_tasks("job")
+    assert task.state == FAILED
+    assert task.error_class == "WorkerLost"
+    assert queue.lease("w3") == []
+
+
+def test_stale_worker_cannot_complete(queue):
+    queue.enqueue("job", ["111"], ["carrefour"], {})
+    (stale,) = queue.lease("w1")
+    _expire_leases()
+    (task,) = queue.lease("w2")
+
+    assert not queue.complete(stale.id, "w1", "results/stale.pdf")
+    assert not queue.fail(stale.id, "w1", "TimeoutException", "too slow")
+    assert queue.complete(task.id, "w2", "results/w2.pdf")
+    (task,) = queue.job_tasks("job")
+    assert task.state == DONE and task.result == "results/w2.pdf"
+
+
+def test_run_on_workers_times_out_without_workers(queue, tmp_path):
+    failures = []
+    started = time.monotonic()
+    result = run_on_workers(
+        queue, SharedStorage(tmp_path / "shared"), "job", ["111", "222"], ["carrefour"] * 2, {},
+        download_dir=tmp_path / "invoices", on_failure=lambda *args: failures.append(args),
+        timeout=0.3, poll_interval=0.05,
+    )
+    assert time.monotonic() - started < 5
+    assert result == {"downloaded": [], "failed": ["111", "222"]}
+    assert [error_class for _, _, error_class, _ in failures] == ["WorkerTimeout"] * 2